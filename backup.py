@@ -0,0 +1,244 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+
+# -----------------------------------------------------------------------------
+# ZAXIRA NUSXA (BACKUP)
+# -----------------------------------------------------------------------------
+# 1. Ishlayotgan bazadan SQLite online backup API orqali izchil nusxa olinadi
+#    (bot yozayotgan bo'lsa ham yarim yozilgan fayl chiqmaydi).
+# 2. Nusxa gzip bilan siqiladi va Telegram hujjat limiti (50 MB) dan oshmasligi
+#    uchun bo'laklarga (part) bo'linadi.
+# 3. Har bir zaxira alohida papkada, manifest.json da bo'laklar va sha256
+#    yig'indilari bilan saqlanadi. Eng yangi `keep` tasi qoldiriladi.
+#
+# Tiklash: python backup.py restore <zaxira papkasi> <yangi baza fayli>
+# Bu funksiyalar sinxron - botda asyncio.to_thread() orqali chaqiriladi.
+
+PART_SIZE = 45 * 1024 * 1024
+MANIFEST = "manifest.json"
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class _PartWriter:
+    # gzip shu obyektga yozadi, u esa oqimni part_size lik fayllarga bo'ladi
+    def __init__(self, directory, base, part_size):
+        self.directory = directory
+        self.base = base
+        self.part_size = part_size
+        self.parts = []
+        self._file = None
+        self._written = 0
+        self._hash = None
+
+    def _roll(self):
+        self._close_part()
+        name = f"{self.base}.part{len(self.parts) + 1:03d}"
+        self._file = open(os.path.join(self.directory, name), "wb")
+        self._hash = hashlib.sha256()
+        self._written = 0
+        self.parts.append({"name": name})
+
+    def _close_part(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self.parts[-1].update(size=self._written, sha256=self._hash.hexdigest())
+        self._file = None
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self._file is None or self._written >= self.part_size:
+                self._roll()
+            n = min(len(view), self.part_size - self._written)
+            self._file.write(view[:n])
+            self._hash.update(view[:n])
+            self._written += n
+            view = view[n:]
+        return len(data)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        self._close_part()
+
+
+def snapshot(db_path, dest_path):
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(dest_path)
+    try:
+        # Bitta qadamda (pages=-1), bitta o'qish tranzaksiyasi ichida. WAL rejimida
+        # o'quvchi yozuvchini to'xtatmaydi. Bo'lib-bo'lib olinganda esa qadamlar
+        # orasidagi har bir yozuv nusxani boshidan qayta boshlatadi va doimiy
+        # yozuvlarda backup tugamasligi mumkin.
+        src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+
+
+def create_backup(db_path, backup_dir, keep=7, part_size=PART_SIZE):
+    # Qaytaradi: (zaxira papkasi, manifest)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    target = os.path.join(backup_dir, stamp)
+    os.makedirs(target, exist_ok=True)
+    base = os.path.splitext(os.path.basename(db_path))[0]
+    raw = os.path.join(target, f"{base}.db")
+    try:
+        snapshot(db_path, raw)
+        raw_size = os.path.getsize(raw)
+        raw_sha = _sha256_file(raw)
+
+        writer = _PartWriter(target, f"{base}.db.gz", part_size)
+        with open(raw, "rb") as src, gzip.GzipFile(filename=f"{base}.db", mode="wb", fileobj=writer) as gz:
+            shutil.copyfileobj(src, gz, 1024 * 1024)
+        writer.close()
+    except BaseException:
+        # Chala qolgan zaxira papkasini qoldirmaymiz
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    finally:
+        if os.path.exists(raw):
+            os.remove(raw)
+
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "source": os.path.basename(db_path),
+        "db_size": raw_size,
+        "db_sha256": raw_sha,
+        "parts": writer.parts,
+    }
+    with open(os.path.join(target, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    rotate(backup_dir, keep)
+    return target, manifest
+
+
+def list_backups(backup_dir):
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if os.path.isfile(os.path.join(backup_dir, n, MANIFEST))]
+    return [os.path.join(backup_dir, n) for n in sorted(names)]
+
+
+def rotate(backup_dir, keep):
+    for old in list_backups(backup_dir)[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def restore_backup(source_dir, target_path, force=False):
+    # Bo'laklar sha256 bo'yicha tekshiriladi, birlashtirilib ochiladi, natija
+    # yana tekshiriladi va shundan keyingina target_path ga qo'yiladi.
+    if os.path.exists(target_path) and not force:
+        raise FileExistsError(f"{target_path} mavjud (ustiga yozish uchun --force)")
+    with open(os.path.join(source_dir, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    for part in manifest["parts"]:
+        path = os.path.join(source_dir, part["name"])
+        if _sha256_file(path) != part["sha256"]:
+            raise ValueError(f"{part['name']}: sha256 mos kelmadi")
+
+    tmp = target_path + ".restore"
+    h = hashlib.sha256()
+    try:
+        with open(tmp, "wb") as out, _PartReader(source_dir, manifest["parts"]) as reader, \
+                gzip.GzipFile(fileobj=reader, mode="rb") as gz:
+            for block in iter(lambda: gz.read(1024 * 1024), b""):
+                out.write(block)
+                h.update(block)
+        if h.hexdigest() != manifest["db_sha256"]:
+            raise ValueError("Tiklangan baza sha256 mos kelmadi")
+        conn = sqlite3.connect(tmp)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != "ok":
+            raise ValueError(f"integrity_check: {result}")
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    os.replace(tmp, target_path)
+    return manifest
+
+
+class _PartReader:
+    # Bo'laklarni ketma-ket o'qiydigan fayl-obyekt (gzip uchun)
+    def __init__(self, directory, parts):
+        self._paths = [os.path.join(directory, p["name"]) for p in parts]
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()
+
+    def read(self, size=-1):
+        while self._paths or self._file is not None:
+            if self._file is None:
+                self._file = open(self._paths.pop(0), "rb")
+            data = self._file.read(size)
+            if data:
+                return data
+            self._file.close()
+            self._file = None
+        return b""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Baza zaxira nusxalari")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_create = sub.add_parser("create", help="yangi zaxira nusxa")
+    p_create.add_argument("db")
+    p_create.add_argument("backup_dir")
+    p_create.add_argument("--keep", type=int, default=7)
+    p_list = sub.add_parser("list", help="mavjud zaxiralar")
+    p_list.add_argument("backup_dir")
+    p_restore = sub.add_parser("restore", help="zaxiradan tiklash")
+    p_restore.add_argument("source_dir")
+    p_restore.add_argument("target")
+    p_restore.add_argument("--force", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "create":
+        target, manifest = create_backup(args.db, args.backup_dir, keep=args.keep)
+        print(f"{target}: {len(manifest['parts'])} ta bo'lak")
+    elif args.cmd == "list":
+        for path in list_backups(args.backup_dir):
+            print(path)
+    else:
+        try:
+            manifest = restore_backup(args.source_dir, args.target, force=args.force)
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Xato: {e}", file=sys.stderr)
+            return 1
+        print(f"Tiklandi: {args.target} ({manifest['created_at']} dagi nusxa)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from bench.dataset import SCALES
+from bench.suite import run_scale
+
+# -----------------------------------------------------------------------------
+# ISHGA TUSHIRISH
+# -----------------------------------------------------------------------------
+#   python -m bench run --scale small --scale medium --out before.json
+#   python -m bench run --stores 50 --customers 1000 --transactions 5
+#   python -m bench compare before.json after.json
+#
+# Natija JSON: meta (commit, python, sqlite) va har bir o'lcham uchun
+# har bir holatning n, p50_ms, p95_ms, mean_ms, rows, rows_per_s qiymatlari.
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scales(args):
+    custom = {k: getattr(args, k) for k in ("stores", "staff", "customers", "transactions") if getattr(args, k) is not None}
+    if custom:
+        base = SCALES[args.scale[0] if args.scale else "small"]
+        return {"custom": base._replace(**custom)}
+    return {name: SCALES[name] for name in (args.scale or ["small"])}
+
+
+async def _run(args):
+    workdir = args.dir or tempfile.mkdtemp(prefix="nasiya_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "scales": {},
+    }
+    for name, scale in _scales(args).items():
+        path = os.path.join(workdir, f"bench_{name}.db")
+        print(f"[{name}] {dict(scale._asdict())}", file=sys.stderr)
+        result = await run_scale(path, scale, iterations=args.iterations, seed=args.seed, cases=args.case)
+        report["scales"][name] = result
+        print(f"[{name}] {result['customers']} mijoz, baza {result['db_bytes'] / 1e6:.1f} MB, "
+              f"yaratish {result['generate_s']} s", file=sys.stderr)
+        for case, r in result["results"].items():
+            if "error" in r:
+                print(f"  {case:40} XATO {r['error']}", file=sys.stderr)
+            else:
+                print(f"  {case:40} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms  {r['rows_per_s'] or 0:12.1f} rows/s",
+                      file=sys.stderr)
+        if not args.keep:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    if not args.dir and not args.keep:
+        os.rmdir(workdir)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def _compare(args):
+    # Ikki natijadagi bir xil (o'lcham, holat) juftlari: p50/p95 nisbati
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    worse = 0
+    for scale, data in after["scales"].items():
+        old = before["scales"].get(scale)
+        if old is None:
+            continue
+        print(f"[{scale}] {before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+        for case, r in data["results"].items():
+            o = old["results"].get(case)
+            if not o or "error" in o or "error" in r:
+                continue
+            p50 = r["p50_ms"] / o["p50_ms"] if o["p50_ms"] else float("inf")
+            p95 = r["p95_ms"] / o["p95_ms"] if o["p95_ms"] else float("inf")
+            flag = "  <-- sekinlashdi" if p50 > args.threshold else ""
+            worse += bool(flag)
+            print(f"  {case:40} p50 x{p50:6.2f}  p95 x{p95:6.2f}{flag}")
+    return 1 if worse else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="DB qatlami benchmarklari")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="sintetik bazada o'lchash")
+    p_run.add_argument("--scale", action="append", choices=sorted(SCALES), help="bir necha marta berish mumkin")
+    for field in ("stores", "staff", "customers", "transactions"):
+        p_run.add_argument(f"--{field}", type=int, help=f"o'lcham: {field} (--scale ni asos qilib)")
+    p_run.add_argument("--iterations", type=int, default=50)
+    p_run.add_argument("--seed", type=int, default=1)
+    p_run.add_argument("--case", action="append", help="faqat nomida shu matn bor holatlar")
+    p_run.add_argument("--dir", help="baza fayllari papkasi (standart: vaqtinchalik)")
+    p_run.add_argument("--keep", action="store_true", help="baza fayllarini o'chirmaslik")
+    p_run.add_argument("--out", help="JSON fayl (standart: stdout)")
+    p_cmp = sub.add_parser("compare", help="ikki natijani solishtirish")
+    p_cmp.add_argument("before")
+    p_cmp.add_argument("after")
+    p_cmp.add_argument("--threshold", type=float, default=1.25, help="p50 shuncha marta oshsa - sekinlashgan")
+    args = parser.parse_args(argv)
+
+    # Migratsiya va boshqa INFO loglari natija chiqishiga aralashmasin
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.cmd == "run":
+        asyncio.run(_run(args))
+        return 0
+    return _compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import random
+import sqlite3
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import main
+
+# -----------------------------------------------------------------------------
+# SINTETIK BAZA
+# -----------------------------------------------------------------------------
+# Sxema botning o'z migratsiyalari bilan yaratiladi (main.init_db), ma'lumot
+# esa sinxron sqlite3 orqali bitta tranzaksiyada yoziladi. Hisoblanadigan
+# ustunlar (phone_key, search_key, user_phones, balans) botdagi funksiyalar
+# bilan to'ldiriladi, store_stats oxirida noldan qayta hisoblanadi - baza
+# bot yaratadigan bazadan farq qilmaydi.
+
+# stores - do'konlar, staff - har do'kondagi xodimlar, customers - har do'kondagi
+# mijozlar, transactions - har mijozdagi amaliyotlar (o'rtacha), linked - botga
+# ulangan mijozlar ulushi, buyer_stores - ulangan xaridor o'rtacha nechta
+# do'konda mijoz
+Scale = namedtuple("Scale", "stores staff customers transactions linked buyer_stores")
+
+SCALES = {
+    "small": Scale(stores=10, staff=1, customers=50, transactions=10, linked=0.3, buyer_stores=1.5),
+    "medium": Scale(stores=100, staff=2, customers=200, transactions=20, linked=0.3, buyer_stores=1.5),
+    "large": Scale(stores=500, staff=3, customers=500, transactions=30, linked=0.3, buyer_stores=2.0),
+}
+
+# Benchmark argumentlari uchun bazadan olingan namunalar
+Sample = namedtuple("Sample", "owners staff buyers stores customers phones zero_customers")
+
+OWNER_BASE = 1_000_000_000
+STAFF_BASE = 2_000_000_000
+BUYER_BASE = 3_000_000_000
+
+FIRST_NAMES = ["Alisher", "Dilshod", "Jasur", "Sardor", "Bekzod", "Aziz", "Otabek", "Sherzod", "Nodira",
+               "Gulnora", "Dilnoza", "Malika", "Zarina", "Shahnoza", "Xasan", "Husan", "Umid", "Farrux",
+               "Алишер", "Дилшод", "Жасур", "Нодира", "Гулнора", "Ҳасан", "O'tkir", "G'ayrat"]
+LAST_NAMES = ["Karimov", "Toshmatov", "Rahimov", "Yusupov", "Aliyev", "Nazarov", "Qodirov", "Ergashev",
+              "Каримов", "Юсупов", "Рахимова", "Sobirova", "Xolmatov", "Mirzayeva"]
+SUFFIXES = ["", "", "", " aka", " opa", " (qo'shni)", " 2", " do'kon"]
+DESCRIPTIONS = ["non", "un 5 kg", "yog'", "shakar", "guruch", "sut, qatiq", "choy", "go'sht",
+                "qarz", "naqd", "karta orqali", "kredit", ""]
+OPERATORS = ["90", "91", "93", "94", "95", "97", "98", "99", "33", "88", "77"]
+
+
+def raw_phone(rng):
+    # Sotuvchi yozadigan turli ko'rinishlar - bazaga clean_phone() dan o'tib tushadi
+    op = rng.choice(OPERATORS)
+    n = f"{rng.randrange(10_000_000):07d}"
+    return rng.choice([
+        f"+998 {op} {n[:3]}-{n[3:5]}-{n[5:]}",
+        f"998{op}{n}",
+        f"{op}{n}",
+        f"({op}) {n[:3]} {n[3:5]} {n[5:]}",
+        f"+998-{op}-{n}",
+        f"{op} {n}",
+    ])
+
+
+def contact_phone(rng):
+    # Telegram kontakti orqali kelgan raqam
+    return f"998{rng.choice(OPERATORS)}{rng.randrange(10_000_000):07d}"
+
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{rng.choice(SUFFIXES)}"
+
+
+def _timestamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _transactions(rng, count, start, now):
+    # Nasiya yozuvlari va qisman to'lovlar, vaqt bo'yicha tartiblangan
+    times = sorted(start + (now - start) * rng.random() for _ in range(count))
+    rows, balance = [], 0
+    for t in times:
+        if balance > 0 and rng.random() < 0.35:
+            amount = -min(balance, rng.randrange(5, 300) * 1000)
+        else:
+            amount = rng.randrange(5, 500) * 1000
+        balance += amount
+        rows.append((amount, rng.choice(DESCRIPTIONS), _timestamp(t)))
+    return rows, balance
+
+
+def generate(path, scale, seed=1):
+    # Sxemasi tayyor (bo'sh) bazaga yozadi. Qaytaradi: Sample
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    history_start = now - timedelta(days=180)
+    subscription_until = (date.today() + timedelta(days=30)).isoformat()
+
+    n_linked = int(scale.stores * scale.customers * scale.linked)
+    n_buyers = max(1, int(n_linked / scale.buyer_stores))
+    buyers = [(BUYER_BASE + i, contact_phone(rng)) for i in range(n_buyers)]
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    owners, staff, stores, customers, zero_customers = [], [], [], [], []
+    try:
+        conn.execute("BEGIN")
+        user_rows, phone_rows = [], []
+        for tg_id, phone in buyers:
+            user_rows.append((tg_id, person_name(rng), None, phone, "client", None, 0, subscription_until))
+
+        for s in range(scale.stores):
+            owner_id = OWNER_BASE + s
+            phones = ", ".join(contact_phone(rng) for _ in range(rng.choice([1, 1, 2])))
+            cur = conn.execute("INSERT INTO stores (name, owner_id) VALUES (?, ?)", (f"Do'kon {s + 1}", owner_id))
+            store_id = cur.lastrowid
+            stores.append(store_id)
+            owners.append(owner_id)
+            user_rows.append((owner_id, person_name(rng), f"owner{s}", phones, "admin", store_id, 1, subscription_until))
+            for k in range(scale.staff):
+                staff_id = STAFF_BASE + s * 100 + k
+                staff.append(staff_id)
+                user_rows.append((staff_id, person_name(rng), None, contact_phone(rng), "admin", store_id, 0, subscription_until))
+
+            seen_keys = set()
+            for _ in range(scale.customers):
+                if rng.random() < scale.linked:
+                    linked_id, phone = rng.choice(buyers)
+                    phone = main.clean_phone(phone[3:] if rng.random() < 0.5 else phone)
+                else:
+                    linked_id, phone = None, main.clean_phone(raw_phone(rng))
+                key = main.phone_key(phone)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                name = person_name(rng)
+                count = max(0, int(rng.expovariate(1 / scale.transactions))) if scale.transactions else 0
+                trans, balance = _transactions(rng, count, history_start, now)
+                cur = conn.execute(
+                    """
+                    INSERT INTO customers (seller_id, full_name, phone, phone_key, search_key, telegram_id, balance)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (owner_id, name, phone, key, main.customer_search_key(name, phone), linked_id, balance),
+                )
+                cust_id = cur.lastrowid
+                customers.append((cust_id, owner_id))
+                if balance == 0:
+                    zero_customers.append((cust_id, owner_id))
+                conn.executemany(
+                    "INSERT INTO transactions (customer_id, amount, description, created_at) VALUES (?, ?, ?, ?)",
+                    [(cust_id, amount, desc, created) for amount, desc, created in trans],
+                )
+
+        conn.executemany(
+            """
+            INSERT INTO users (telegram_id, full_name, username, phone, role, store_id, is_owner, subscription_until)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            user_rows,
+        )
+        for row in user_rows:
+            phone_rows.extend((k, row[0]) for k in main.phone_keys(row[3]))
+        conn.executemany("INSERT OR IGNORE INTO user_phones (phone_key, telegram_id) VALUES (?, ?)", phone_rows)
+        for sql in main.REBUILD_STORE_STATS_SQL:
+            conn.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return Sample(
+        owners=owners,
+        staff=staff,
+        buyers=[tg_id for tg_id, _ in buyers],
+        stores=list(zip(stores, owners)),
+        customers=customers,
+        phones=[phone for _, phone in buyers],
+        zero_customers=zero_customers,
+    )
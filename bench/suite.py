@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from collections import namedtuple
+
+import main
+from bench.dataset import generate
+
+# -----------------------------------------------------------------------------
+# DB QATLAMI BENCHMARKLARI
+# -----------------------------------------------------------------------------
+# Har bir holat (case) - bitta db_* funksiya va uning argumentlari. Argumentlar
+# sintetik bazadagi namunalardan tasodifiy (lekin seed bo'yicha takrorlanadigan)
+# tanlanadi. Har chaqiruv alohida o'lchanadi: p50/p95, o'rtacha va rows/sec
+# (qaytgan qatorlar soni / umumiy vaqt). Foydalanuvchi konteksti keshi har
+# chaqiruvdan oldin tozalanadi - bazaga boradigan yo'l o'lchanadi.
+#
+# O'qish holatlari oldin, yozish holatlari keyin bajariladi (ular bazani
+# o'zgartiradi).
+
+# args(rng, sample, i) -> chaqiruv argumentlari
+# rows(result) -> qatorlar soni (None bo'lsa avtomatik)
+# limit - og'ir holatlar uchun iteratsiyalar soni chegarasi
+Case = namedtuple("Case", "name fn args rows limit", defaults=(None, None))
+
+SEARCH_QUERIES = ["ali", "karim", "Алишер", "hasan", "90", "1234", "opa", "yusup", "dil", "qo'shni"]
+
+
+def _pick(rng, items):
+    return rng.choice(items)
+
+
+def _rows_default(result):
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 0 if result is None else 1
+
+
+def _page_rows(result):
+    return len(result[0])
+
+
+async def _consume(agen_fn, *args):
+    rows = 0
+    async for chunk in agen_fn(*args):
+        rows += len(chunk) if isinstance(chunk, list) else 1
+    return rows
+
+
+async def _iter_user_ids():
+    return await _consume(main.db_iter_user_ids)
+
+
+async def _iter_report(seller_id):
+    return await _consume(main.db_iter_transactions_report, seller_id)
+
+
+async def _concurrent_trans(cust_ids):
+    await asyncio.gather(*(main.db_add_trans(cid, 1000, "bench") for cid in cust_ids))
+    return len(cust_ids)
+
+
+READ_CASES = [
+    Case("db_get_user_context", main.db_get_user_context, lambda r, s, i: (_pick(r, s.owners + s.staff + s.buyers),)),
+    Case("db_get_user", main.db_get_user, lambda r, s, i: (_pick(r, s.buyers),)),
+    Case("get_store_owner_id", main.get_store_owner_id, lambda r, s, i: (_pick(r, s.staff or s.owners),)),
+    Case("db_get_user_id_by_phone", main.db_get_user_id_by_phone, lambda r, s, i: (_pick(r, s.phones),)),
+    Case("db_get_store_staff", main.db_get_store_staff, lambda r, s, i: _pick(r, s.stores)),
+    Case("db_get_my_customers", main.db_get_my_customers, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_get_customers_page[a]", main.db_get_customers_page, lambda r, s, i: (_pick(r, s.owners), "a"), _page_rows),
+    Case("db_get_customers_page[d]", main.db_get_customers_page, lambda r, s, i: (_pick(r, s.owners), "d"), _page_rows),
+    Case("db_get_customers_page[l]", main.db_get_customers_page, lambda r, s, i: (_pick(r, s.owners), "l"), _page_rows),
+    Case("db_get_customer_if_mine", main.db_get_customer_if_mine, lambda r, s, i: _pick(r, s.customers)),
+    Case("db_get_customer_by_id", main.db_get_customer_by_id, lambda r, s, i: (_pick(r, s.customers)[0],)),
+    Case("db_get_buyer_debts", main.db_get_buyer_debts, lambda r, s, i: (_pick(r, s.buyers),)),
+    Case("db_get_buyer_debts_with_history", main.db_get_buyer_debts_with_history,
+         lambda r, s, i: (_pick(r, s.buyers),), lambda res: sum(len(x[3]) or 1 for x in res)),
+    Case("db_get_last_transactions", main.db_get_last_transactions, lambda r, s, i: (_pick(r, s.customers)[0],)),
+    Case("db_get_transactions_report[all]", main.db_get_transactions_report, lambda r, s, i: (_pick(r, s.owners),), None, 20),
+    Case("db_get_transactions_report[30d]", main.db_get_transactions_report, lambda r, s, i: (_pick(r, s.owners), 30), None, 20),
+    Case("db_iter_transactions_report", _iter_report, lambda r, s, i: (_pick(r, s.owners),), lambda n: n, 20),
+    Case("db_get_store_stats", main.db_get_store_stats, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_get_all_store_stats", main.db_get_all_store_stats, lambda r, s, i: (), None, 20),
+    Case("db_get_all_store_stats[debtors]", main.db_get_all_store_stats, lambda r, s, i: (True, True), None, 20),
+    Case("db_get_store_version", main.db_get_store_version, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_get_store_total", main.db_get_store_total, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_get_store_debtors", main.db_get_store_debtors, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_count_unreachable_debtors", main.db_count_unreachable_debtors, lambda r, s, i: (_pick(r, s.owners),)),
+    Case("db_search_customers", main.db_search_customers, lambda r, s, i: (_pick(r, s.owners), _pick(r, SEARCH_QUERIES))),
+    Case("db_get_all_active_stores", main.db_get_all_active_stores, lambda r, s, i: (), None, 20),
+    Case("db_get_all_debtors_with_store", main.db_get_all_debtors_with_store, lambda r, s, i: (), None, 10),
+    Case("db_get_all_users", main.db_get_all_users, lambda r, s, i: (), None, 10),
+    Case("db_get_users_by_role", main.db_get_users_by_role, lambda r, s, i: ("admin",), None, 20),
+    Case("db_get_blocked_users", main.db_get_blocked_users, lambda r, s, i: ()),
+    Case("db_iter_user_ids", _iter_user_ids, lambda r, s, i: (), lambda n: n, 10),
+]
+
+WRITE_CASES = [
+    Case("db_add_trans", main.db_add_trans, lambda r, s, i: (_pick(r, s.customers)[0], 1000, "bench")),
+    Case("db_add_trans[x64]", _concurrent_trans, lambda r, s, i: ([_pick(r, s.customers)[0] for _ in range(64)],), lambda n: n),
+    Case("db_add_customer", main.db_add_customer,
+         lambda r, s, i: (_pick(r, s.owners), f"Bench {i}", f"99{i:07d}")),
+    Case("db_update_customer_name", main.db_update_customer_name,
+         lambda r, s, i: (*_pick(r, s.customers), f"Bench {i}")),
+    Case("db_delete_customer", main.db_delete_customer,
+         lambda r, s, i: s.zero_customers[i % len(s.zero_customers)] if s.zero_customers else _pick(r, s.customers)),
+    Case("db_link_customer", main.db_link_customer, lambda r, s, i: (s.phones[i % len(s.phones)], s.buyers[i % len(s.buyers)])),
+    Case("db_update_user_phone", main.db_update_user_phone, lambda r, s, i: (_pick(r, s.buyers), f"99890{i:07d}")),
+    Case("db_update_store_name", main.db_update_store_name, lambda r, s, i: (_pick(r, s.stores)[0], f"Do'kon {i}")),
+    Case("db_renew_subscription", main.db_renew_subscription, lambda r, s, i: (_pick(r, s.owners), 1)),
+    Case("db_add_user", main.db_add_user,
+         lambda r, s, i: (4_000_000_000 + i, f"Bench {i}", None, "client", f"99891{i:07d}")),
+    Case("db_promote_to_staff", main.db_promote_to_staff, lambda r, s, i: (_pick(r, s.stores)[0], f"99891{i:07d}")),
+    Case("db_kick_staff", main.db_kick_staff, lambda r, s, i: (4_000_000_000 + i,)),
+    Case("db_set_role", main.db_set_role, lambda r, s, i: (4_000_000_000 + i, "client")),
+    Case("db_block_user", main.db_block_user, lambda r, s, i: (4_000_000_000 + i,)),
+    Case("db_unblock_user", main.db_unblock_user, lambda r, s, i: (4_000_000_000 + i,)),
+    Case("db_block_expired_subscriptions", main.db_block_expired_subscriptions, lambda r, s, i: ()),
+    Case("db_rebuild_store_stats", main.db_rebuild_store_stats, lambda r, s, i: (), None, 3),
+]
+
+
+def percentile(values, q):
+    # Nearest-rank: tartiblangan ro'yxatdan
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+async def run_case(case, sample, iterations, seed, warmup=2):
+    rng = random.Random(f"{seed}:{case.name}")
+    n = min(iterations, case.limit) if case.limit else iterations
+    rows_fn = case.rows or _rows_default
+    timings, rows = [], 0
+    for i in range(-min(warmup, n), n):
+        args = case.args(rng, sample, i if i >= 0 else n - 1 - i)  # isitish uchun ham takrorlanmas i
+        main.user_ctx_cache.clear()
+        started = time.perf_counter()
+        result = await case.fn(*args)
+        elapsed = time.perf_counter() - started
+        if i < 0:
+            continue
+        timings.append(elapsed)
+        rows += rows_fn(result)
+    total = sum(timings)
+    timings.sort()
+    return {
+        "n": len(timings),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "mean_ms": round(total / len(timings) * 1000, 3),
+        "rows": rows,
+        "rows_per_s": round(rows / total, 1) if total else None,
+    }
+
+
+async def run_scale(path, scale, iterations=50, seed=1, cases=None):
+    # Bazani yaratadi, barcha holatlarni o'lchaydi. Qaytaradi: natija lug'ati
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    main.db_pool.path = path
+    main.user_ctx_cache.clear()
+    main.report_cache.clear()
+
+    await main.init_db()  # sxema (migratsiyalar)
+    await main.close_db()
+    started = time.perf_counter()
+    sample = await asyncio.to_thread(generate, path, scale, seed)
+    generate_s = time.perf_counter() - started
+
+    results = {}
+    await main.init_db()
+    try:
+        for case in READ_CASES + WRITE_CASES:
+            if cases and not any(c in case.name for c in cases):
+                continue
+            try:
+                results[case.name] = await run_case(case, sample, iterations, seed)
+            except Exception as e:
+                logging.error(f"Benchmark {case.name}: {e}")
+                results[case.name] = {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        await main.close_db()
+
+    return {
+        "params": scale._asdict(),
+        "generate_s": round(generate_s, 2),
+        "db_bytes": os.path.getsize(path),
+        "customers": len(sample.customers),
+        "results": results,
+    }
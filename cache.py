@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------------
+# TTL + LRU KESH
+# -----------------------------------------------------------------------------
+# Jarayon ichidagi oddiy kesh: eng eski ishlatilgan yozuvlar `maxsize` dan
+# oshganda chiqarib yuboriladi, har bir yozuv `ttl` soniyadan keyin eskiradi.
+# Yozuvchi funksiyalar o'zgartirgan kalitni invalidate() bilan o'chiradi.
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        for key in [k for k, (v, _) in self._data.items() if predicate(v)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
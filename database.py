@@ -0,0 +1,254 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# -----------------------------------------------------------------------------
+# ULANISHLAR MENEJERI
+# -----------------------------------------------------------------------------
+# Har bir so'rov uchun yangi aiosqlite.connect() yangi thread ochib, faylni
+# qayta ochadi. Buning o'rniga bot ishga tushganda bitta yozuvchi (writer) va
+# bir nechta o'quvchi (reader) ulanish ochiladi va butun jarayon davomida
+# qayta ishlatiladi. WAL rejimida o'quvchilar yozuvchini kutib qolmaydi.
+
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",  # ~16 MB sahifa keshi (har bir ulanishga)
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",
+)
+
+
+class ConnectionManager:
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.readers_count = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+        # wrap(conn) -> conn yoki uning proksisi (masalan, tracing uchun)
+        self.wrap = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self, read_only=False):
+        conn = await aiosqlite.connect(self.path)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            # O'quvchi ulanish orqali tasodifan yozib yubormaslik uchun
+            await conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._writer = await self._connect()
+        # journal_mode fayl darajasida saqlanadi, bir marta o'rnatish kifoya
+        async with self._writer.execute("PRAGMA journal_mode = WAL") as cur:
+            mode = (await cur.fetchone())[0]
+        if mode != "wal":
+            logging.warning(f"WAL rejimi yoqilmadi (journal_mode={mode})")
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        if not self.is_open:
+            return
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        await self._writer.close()
+        self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn if self.wrap is None else self.wrap(conn)
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def dedicated(self):
+        # Uzoq o'qish (masalan, hisobot eksporti) uchun alohida vaqtinchalik
+        # ulanish: umumiy o'quvchilar butun eksport davomida band bo'lmaydi
+        conn = await self._connect(read_only=True)
+        try:
+            yield conn if self.wrap is None else self.wrap(conn)
+        finally:
+            await conn.close()
+
+    @asynccontextmanager
+    async def writer(self):
+        # Bitta yozuvchi ulanish umumiy, shuning uchun tranzaksiyalar
+        # bir-biriga aralashib ketmasligi uchun qulf ostida ishlatiladi.
+        async with self._write_lock:
+            try:
+                yield self._writer if self.wrap is None else self.wrap(self._writer)
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
+            if self._writer.in_transaction:
+                await self._writer.commit()
+
+
+# -----------------------------------------------------------------------------
+# GURUHLI YOZISH NAVBATI (group commit)
+# -----------------------------------------------------------------------------
+# Daftar (ledger) yozuvlari navbatga qo'yiladi va bitta fon vazifasi ularni
+# kichik guruhlarda bitta BEGIN IMMEDIATE ... COMMIT ichida bajaradi. Har bir
+# ish o'z SAVEPOINT ida ishlaydi: xato bo'lsa faqat o'sha ish bekor qilinadi
+# va xato aynan uni yuborgan chaqiruvchiga qaytariladi.
+#
+# Ish funksiyasi: `async def job(db, *args)` - commit() chaqirmaydi.
+# `propagate` dagi ContextVar lar qiymati chaqiruvchidan ishga o'tkaziladi
+# (ish boshqa vazifada bajarilsa ham, masalan, trace id saqlanib qoladi).
+# Ular faqat ish funksiyasi atrofida o'rnatiladi - BEGIN/SAVEPOINT/RELEASE
+# kabi navbatning o'z so'rovlari chaqiruvchiga yozilmaydi. `on_job()` (bo'lsa)
+# shu kontekstda har bir ish boshida chaqiriladi.
+
+class WriteQueue:
+    def __init__(self, pool, max_batch=64):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.propagate = ()
+        self.on_job = None
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, fn, *args):
+        if self._task is None:
+            raise RuntimeError("WriteQueue ishga tushirilmagan (start())")
+        fut = asyncio.get_running_loop().create_future()
+        ctx = [(var, var.get(None)) for var in self.propagate]
+        await self._queue.put((fn, args, fut, ctx))
+        return await fut
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stop = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            await self._commit_batch(batch)
+            if stop:
+                return
+
+    async def _commit_batch(self, batch):
+        results = []
+        try:
+            async with self.pool.writer() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                for fn, args, fut, ctx in batch:
+                    await db.execute("SAVEPOINT job")
+                    tokens = [(var, var.set(value)) for var, value in ctx]
+                    try:
+                        if self.on_job is not None:
+                            self.on_job()
+                        res, err = await fn(db, *args), None
+                    except Exception as e:
+                        res, err = None, e
+                    finally:
+                        for var, token in tokens:
+                            var.reset(token)
+                    if err is not None:
+                        await db.execute("ROLLBACK TO job")
+                    await db.execute("RELEASE job")
+                    results.append((fut, res, err))
+                await db.commit()
+        except Exception as e:
+            logging.error(f"Guruhli yozish xatosi ({len(batch)} ta ish): {e}")
+            for _, _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for fut, res, err in results:
+            if fut.done():  # chaqiruvchi bekor qilgan bo'lishi mumkin
+                continue
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+
+# -----------------------------------------------------------------------------
+# MIGRATSIYALAR
+# -----------------------------------------------------------------------------
+# Har bir migratsiya: (versiya, tavsif, qadam). Qadam - SQL so'rovlar ro'yxati
+# yoki `async def step(db)` funksiya. Qo'llanilgan versiyalar schema_version
+# jadvalida saqlanadi, har bir qadam alohida tranzaksiyada bajariladi.
+
+async def column_exists(db, table, column):
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        return any(row[1] == column for row in await cur.fetchall())
+
+
+async def add_column_if_missing(db, table, column, decl):
+    if not await column_exists(db, table, column):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def migrate(db, migrations):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.commit()
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cur:
+        current = (await cur.fetchone())[0]
+
+    for version, description, step in sorted(migrations, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        logging.info(f"Migratsiya {version}: {description}")
+        await db.execute("BEGIN")
+        try:
+            if callable(step):
+                await step(db)
+            else:
+                for sql in step:
+                    await db.execute(sql)
+            await db.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        current = version
+    return current
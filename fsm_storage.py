@@ -0,0 +1,207 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage
+
+# -----------------------------------------------------------------------------
+# FSM HOLATLARI OMBORI (SQLite)
+# -----------------------------------------------------------------------------
+# Holat va uning ma'lumotlari (Summa/Izoh jarayonlari) bazadagi fsm_states
+# jadvalida saqlanadi, shuning uchun bot qayta ishga tushsa ham sotuvchi
+# qolgan joyidan davom etadi. Issiq yozuvlar xotiradagi LRU da turadi:
+# o'qish bazaga bormaydi, yozish esa darhol emas, fon vazifasi tomonidan har
+# `flush_interval` soniyada bitta tranzaksiyada bazaga tushiriladi.
+# `ttl` dan uzoq o'zgarmagan holatlar tashlab ketilgan hisoblanadi va o'chadi.
+#
+# Bir nechta jarayon (worker) bir bazani ishlatsa, har bir foydalanuvchi
+# yangilanishlari doim bitta jarayonga tushishi kerak, yoki maxsize=0 qilinadi:
+# unda kesh yo'q, har bir o'qish/yozish to'g'ridan-to'g'ri bazaga boradi.
+
+FSM_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)",
+]
+
+PURGE_EVERY = 3600  # Eskirgan qatorlar shuncha soniyada bir tozalanadi
+
+
+def storage_key(key):
+    # Oddiy holatda "bot:chat:user", qo'shimcha maydonlar faqat bo'lsa qo'shiladi
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id or key.business_connection_id or key.destiny != DEFAULT_DESTINY:
+        parts += [str(key.thread_id or ""), key.business_connection_id or "", key.destiny]
+    return ":".join(parts)
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state=None, data=None, updated_at=0.0):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+
+    @property
+    def empty(self):
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, pool, ttl=7 * 86400, maxsize=5000, flush_interval=1.0):
+        self.pool = pool
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._task = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._task is None and self.maxsize:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # --- kesh ---
+
+    def _evict(self):
+        # Bazaga hali yozilmagan (dirty) yozuvlar chiqarilmaydi
+        while len(self._cache) > self.maxsize:
+            for key in self._cache:
+                if key not in self._dirty:
+                    del self._cache[key]
+                    break
+            else:
+                return
+
+    async def _fetch(self, key):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)) as cur:
+                row = await cur.fetchone()
+        if row is None:
+            return _Entry()
+        state, data, updated_at = row
+        return _Entry(state, json.loads(data) if data else None, updated_at)
+
+    async def _get(self, key):
+        key = storage_key(key)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = await self._fetch(key)
+            if self.maxsize:
+                # _fetch kutilayotganda boshqa korutina yozib qo'ygan bo'lishi mumkin
+                entry = self._cache.setdefault(key, entry)
+                self._evict()
+        else:
+            self._cache.move_to_end(key)
+        if not entry.empty and entry.updated_at + self.ttl < time.time():
+            # Tashlab ketilgan holat
+            await self._put(key, None, {})
+            return _Entry()
+        return entry
+
+    async def _put(self, key, state, data):
+        entry = _Entry(state, data, time.time())
+        if not self.maxsize:
+            await self._write({key: entry})
+            return
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        self._dirty.add(key)
+        self._evict()
+        self.start()
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        entry = await self._get(key)
+        await self._put(storage_key(key), state, entry.data)
+
+    async def get_state(self, key):
+        return (await self._get(key)).state
+
+    async def set_data(self, key, data):
+        entry = await self._get(key)
+        await self._put(storage_key(key), entry.state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key):
+        return copy.deepcopy((await self._get(key)).data)
+
+    # --- bazaga yozish ---
+
+    async def _write(self, entries):
+        upserts, deletes = [], []
+        for key, entry in entries.items():
+            if entry.empty:
+                deletes.append((key,))
+            else:
+                upserts.append((key, entry.state, _dump(entry.data), entry.updated_at))
+        async with self.pool.writer() as db:
+            await db.executemany(
+                """
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        # Yozuvlar o'zgarmas (_put har safar yangisini qo'yadi), shuning uchun
+        # yozish davomida kelgan o'zgarishlar keyingi flush ga qoladi
+        entries = {k: self._cache[k] for k in keys if k in self._cache}
+        try:
+            await self._write(entries)
+        except BaseException:
+            self._dirty |= keys
+            raise
+
+    async def purge(self):
+        async with self.pool.writer() as db:
+            cur = await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+            return cur.rowcount
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge > PURGE_EVERY:
+                    self._last_purge = time.time()
+                    removed = await self.purge()
+                    if removed:
+                        logging.info(f"FSM: {removed} ta eskirgan holat o'chirildi")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"FSM holatlarini yozishda xato: {e}")
@@ -1,18 +1,28 @@
 
 import asyncio
 from dotenv import load_dotenv
-from keep_alive import keep_alive
+from webhook import make_app, start_server, wait_for_signal
+from metrics import BotApiMetricsMiddleware, HandlerMetricsMiddleware, Registry, instrument_functions
+from tracing import TraceHandlerMiddleware, Tracer, TracingMiddleware, trace_functions
+from database import ConnectionManager, WriteQueue, migrate, add_column_if_missing, column_exists
+from cache import TTLCache
+from reports import ReportCache, ReportWorkers, render_csv, render_xlsx
+from sender import DEAD_CHATS_SCHEMA, Broadcast, DeadChats, RateLimiter, alive_sql, deliver
+from outbox import OUTBOX_SCHEMA, OutboxWorker, enqueue
+from scheduler import JOB_RUNS_SCHEMA, Scheduler
+from backup import create_backup
+from fsm_storage import FSM_SCHEMA, SQLiteStorage
 import logging
-from datetime import datetime, timedelta
-import aiosqlite
-from aiogram import Bot, Dispatcher, Router, F
+import calendar
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from aiogram import Bot, Dispatcher, Router, F, BaseMiddleware
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-import openpyxl
 import os
 from aiogram.types import (
+    BufferedInputFile,
     FSInputFile,
     Message,
     ReplyKeyboardMarkup,
@@ -23,8 +33,12 @@ from aiogram.types import (
     CallbackQuery,
     ReplyKeyboardRemove
 )
+from aiogram.exceptions import TelegramBadRequest
 import hashlib
+import html
 import re
+from collections import namedtuple
+from itertools import groupby
 
 # -----------------------------------------------------------------------------
 # KONFIGURATSIYA
@@ -38,115 +52,654 @@ REMINDER_TIME = "18:00"
 ADMINS = [6104862378, 998999999] 
 ADMIN_USERNAMES = ["xzzz911"] # Admin username (bot egasi)
 WELCOME_VIDEO_ID = None # Videoni yuborgandan keyin bu yerga ID sini yozamiz
+DB_READERS = int(os.getenv("DB_READERS", "4")) # O'quvchi ulanishlar soni
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60")) # Foydalanuvchi keshi (soniya)
+SEARCH_LIMIT = 20 # Mijoz qidiruvida ko'rsatiladigan natijalar soni
+PAGE_SIZE = 20 # Mijoz tanlash klaviaturasida bir sahifadagi mijozlar
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2")) # Excel fayl yasovchi threadlar soni
+REPORT_CHUNK = 1000 # Hisobot qatorlari bazadan shu hajmdagi bo'laklarda o'qiladi
+REPORT_CACHE_MB = int(os.getenv("REPORT_CACHE_MB", "64")) # Tayyor hisobotlar keshi hajmi
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", str(6 * 3600))) # Kesh yozuvining umri (soniya)
+SEND_RATE = int(os.getenv("SEND_RATE", "30")) # Bot yuboradigan xabarlar soni / soniya (Telegram limiti)
+BROADCAST_WORKERS = 10 # Ommaviy xabarni parallel yuboruvchilar soni
+NIGHTLY_REPORT_WORKERS = 3 # Kechki hisobotni yuboruvchilar (kam - xabarlar bir tekis tarqaladi)
+# Bazadagi vaqtlar UTC (CURRENT_TIMESTAMP). "Bugun" Toshkent vaqti bo'yicha (UTC+5, yozgi vaqt yo'q).
+TZ_SQL_OFFSET = "+5 hours"
+TIMEZONE = os.getenv("TIMEZONE", "Asia/Tashkent") # Vaqtli vazifalar shu zonada ishlaydi
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7")) # Saqlanadigan zaxira nusxalar soni
+FSM_TTL = int(os.getenv("FSM_TTL", str(3 * 86400))) # Tashlab ketilgan FSM holati shuncha soniyadan keyin o'chadi
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "5000")) # 0 - keshsiz (bir nechta worker uchun)
+# Yangilanishlarni olish: "polling" yoki "webhook". Health route ("/") har ikkisida PORT da ishlaydi.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "") # Tashqi manzil, masalan https://bot.example.com (bo'sh - set_webhook qilinmaydi)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") # Webhook rejimida majburiy
+TRACE_UPDATES = os.getenv("TRACE_UPDATES", "0") == "1" # Har bir update uchun SQL trace (logga bitta qator)
+TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", "50")) # Bundan sekin so'rovlar EXPLAIN QUERY PLAN bilan
 
 logging.basicConfig(level=logging.INFO)
 router = Router()
+db_pool = ConnectionManager(DB_NAME, readers=DB_READERS)
+user_ctx_cache = TTLCache(maxsize=5000, ttl=USER_CACHE_TTL)
+ledger_queue = WriteQueue(db_pool) # Mijoz va tranzaksiya yozuvlari shu navbat orqali
+report_workers = ReportWorkers(workers=REPORT_WORKERS, per_store=1)
+report_cache = ReportCache(max_bytes=REPORT_CACHE_MB * 1024 * 1024, ttl=REPORT_CACHE_TTL)
+send_limiter = RateLimiter(rate=SEND_RATE, per_chat=1.0) # Barcha ommaviy yuborishlar uchun umumiy
+broadcasts = {} # "a<xabar ID>" / "s<ega ID>" -> (Broadcast, asyncio.Task)
+dead_chats = DeadChats(db_pool) # Botni bloklagan / o'chirilgan chatlar
+outbox_worker = OutboxWorker(db_pool, send_limiter, dead=dead_chats) # Mijozlarga bildirishnomalar
+job_scheduler = Scheduler(db_pool, tz=TIMEZONE)
+fsm_storage = SQLiteStorage(db_pool, ttl=FSM_TTL, maxsize=FSM_CACHE_SIZE) # Summa/Izoh jarayonlari qayta ishga tushishda yo'qolmaydi
+tracer = Tracer(db_pool, slow_ms=TRACE_SLOW_MS) if TRACE_UPDATES else None
+
+# Metrikalar (/metrics)
+metrics = Registry()
+handler_seconds = metrics.histogram("bot_handler_seconds", "Handler bajarilish vaqti", ["handler"])
+handler_errors = metrics.counter("bot_handler_errors_total", "Handlerdagi xatolar", ["handler"])
+db_seconds = metrics.histogram("bot_db_seconds", "db_* funksiyalari bajarilish vaqti", ["function"])
+db_errors = metrics.counter("bot_db_errors_total", "db_* funksiyalaridagi xatolar", ["function"])
+api_seconds = metrics.histogram("bot_api_seconds", "Bot API so'rovlari vaqti", ["method"])
+api_errors = metrics.counter("bot_api_errors_total", "Bot API xatolari", ["method", "error"])
+metrics.gauge("bot_ledger_queue_depth", "Yozilishini kutayotgan daftar ishlari", ledger_queue.qsize)
+metrics.gauge("bot_outbox_pending", "Yuborilmagan bildirishnomalar (outbox)", lambda: outbox_worker.pending())
+metrics.gauge("bot_broadcasts_active", "Davom etayotgan ommaviy xabarlar",
+              lambda: sum(1 for b, _ in broadcasts.values() if not b.done))
+metrics.gauge("bot_job_last_duration_seconds", "Vaqtli vazifaning oxirgi bajarilish vaqti",
+              lambda: {(j.name,): j.last_duration for j in job_scheduler.jobs.values() if j.last_duration is not None},
+              ["job"])
+metrics.gauge("bot_job_runs", "Vaqtli vazifa necha marta bajarilgan",
+              lambda: {(j.name,): j.runs for j in job_scheduler.jobs.values()}, ["job"])
+metrics.gauge("bot_job_overlaps", "Oldingi ishi tugamagani uchun o'tkazib yuborilgan slotlar",
+              lambda: {(j.name,): j.overlaps for j in job_scheduler.jobs.values()}, ["job"])
 
 # -----------------------------------------------------------------------------
 # MA'LUMOTLAR BAZASI
 # -----------------------------------------------------------------------------
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                telegram_id INTEGER PRIMARY KEY,
-                full_name TEXT,
-                username TEXT,
-                phone TEXT, 
-                role TEXT,
-                store_name TEXT,
-                is_owner INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                locked_until TIMESTAMP
-            )
-        """)
-        
-        # Migration for existing table (if missing columns)
+# Migratsiyalar tartib bilan qo'llaniladi (database.migrate). Yangi o'zgarish
+# kerak bo'lsa, ro'yxat oxiriga keyingi versiya raqami bilan qo'shing.
+async def _m2_users_locked_until(db):
+    # Eski bazalarda bu ustun bo'lmasligi mumkin
+    await add_column_if_missing(db, "users", "locked_until", "TIMESTAMP")
+
+async def _m4_phone_keys(db):
+    # customers.phone_key - bitta raqam. Egalarda bir nechta raqam bo'lishi
+    # mumkin ("998..., 998..."), shuning uchun users uchun alohida jadval.
+    await add_column_if_missing(db, "customers", "phone_key", "TEXT")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_phones (
+            phone_key TEXT NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            PRIMARY KEY (phone_key, telegram_id)
+        ) WITHOUT ROWID
+    """)
+    async with db.execute("SELECT id, phone FROM customers") as cur:
+        rows = await cur.fetchall()
+    await db.executemany("UPDATE customers SET phone_key = ? WHERE id = ?", [(phone_key(p), cid) for cid, p in rows])
+    async with db.execute("SELECT telegram_id, phone FROM users WHERE phone IS NOT NULL") as cur:
+        rows = await cur.fetchall()
+    await db.executemany("INSERT OR IGNORE INTO user_phones (phone_key, telegram_id) VALUES (?, ?)",
+                         [(k, tg_id) for tg_id, p in rows for k in phone_keys(p)])
+    await db.execute("DROP INDEX IF EXISTS idx_customers_seller_phone")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_customers_seller_phone_key ON customers(seller_id, phone_key)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone_key ON customers(phone_key)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_phones_telegram ON user_phones(telegram_id)")
+
+def today_local():
+    return datetime.now(ZoneInfo(TIMEZONE)).date()
+
+def add_months(d, months):
+    # 31-yanvar + 1 oy = 28/29-fevral (oy oxiridan oshib ketmaydi)
+    month_index = d.month - 1 + months
+    year, month = d.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+async def _m5_stores(db):
+    # Do'kon identifikatori endi users.store_name matni emas, stores.id.
+    # Mijozlar do'konga seller_id (= stores.owner_id) orqali bog'lanadi.
+    # users.store_name ustuni eski ma'lumot sifatida qoldiriladi, lekin
+    # yangi kod uni o'qimaydi va yozmaydi.
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            owner_id INTEGER NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(owner_id) REFERENCES users(telegram_id)
+        )
+    """)
+    await add_column_if_missing(db, "users", "store_id", "INTEGER REFERENCES stores(id)")
+    await db.execute("""
+        INSERT OR IGNORE INTO stores (name, owner_id, created_at)
+        SELECT store_name, telegram_id, created_at FROM users
+        WHERE is_owner = 1 AND store_name IS NOT NULL
+    """)
+    # Ega - o'z do'koniga, xodim - shu nomdagi do'konga (eski get_store_owner_id mantig'i)
+    await db.execute("""
+        UPDATE users SET store_id = CASE
+            WHEN is_owner = 1 THEN (SELECT s.id FROM stores s WHERE s.owner_id = users.telegram_id)
+            ELSE (SELECT MIN(s.id) FROM stores s WHERE s.name = users.store_name)
+        END
+        WHERE store_name IS NOT NULL
+    """)
+    await db.execute("DROP INDEX IF EXISTS idx_users_store_owner")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_store ON users(store_id, is_owner)")
+
+async def _m6_customer_search(db):
+    # customers.search_key = fold_text(ism) + telefon kaliti. FTS5 (trigram)
+    # jadvali shu ustunni indekslaydi va triggerlar orqali sinxron turadi.
+    await add_column_if_missing(db, "customers", "search_key", "TEXT")
+    async with db.execute("SELECT id, full_name, phone FROM customers") as cur:
+        rows = await cur.fetchall()
+    await db.executemany("UPDATE customers SET search_key = ? WHERE id = ?",
+                         [(customer_search_key(name, phone), cid) for cid, name, phone in rows])
+    await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+            search_key, content='customers', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_ai AFTER INSERT ON customers BEGIN
+            INSERT INTO customers_fts (rowid, search_key) VALUES (new.id, new.search_key);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_ad AFTER DELETE ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, search_key) VALUES ('delete', old.id, old.search_key);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_au AFTER UPDATE OF search_key ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, search_key) VALUES ('delete', old.id, old.search_key);
+            INSERT INTO customers_fts (rowid, search_key) VALUES (new.id, new.search_key);
+        END
+    """)
+    await db.execute("INSERT INTO customers_fts (customers_fts) VALUES ('rebuild')")
+
+# --- Do'kon statistikasi (store_stats) ---
+# Har bir do'kon (seller_id = ega ID si) uchun agregatlar triggerlar orqali
+# yangilanib boradi: umumiy qarz, qarzdorlar va mijozlar soni, bugungi nasiya
+# va to'lovlar. db_rebuild_store_stats() ularni noldan qayta hisoblaydi.
+STORE_STATS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS store_stats_cust_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO store_stats (seller_id) VALUES (new.seller_id) ON CONFLICT(seller_id) DO NOTHING;
+        UPDATE store_stats SET
+            customers_count = customers_count + 1,
+            total_debt = total_debt + MAX(new.balance, 0),
+            debtors_count = debtors_count + (new.balance > 0)
+        WHERE seller_id = new.seller_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_stats_cust_ad AFTER DELETE ON customers BEGIN
+        UPDATE store_stats SET
+            customers_count = customers_count - 1,
+            total_debt = total_debt - MAX(old.balance, 0),
+            debtors_count = debtors_count - (old.balance > 0)
+        WHERE seller_id = old.seller_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_stats_cust_au AFTER UPDATE OF balance, seller_id ON customers BEGIN
+        UPDATE store_stats SET
+            customers_count = customers_count - (old.seller_id != new.seller_id),
+            total_debt = total_debt - MAX(old.balance, 0),
+            debtors_count = debtors_count - (old.balance > 0)
+        WHERE seller_id = old.seller_id;
+        INSERT INTO store_stats (seller_id) VALUES (new.seller_id) ON CONFLICT(seller_id) DO NOTHING;
+        UPDATE store_stats SET
+            customers_count = customers_count + (old.seller_id != new.seller_id),
+            total_debt = total_debt + MAX(new.balance, 0),
+            debtors_count = debtors_count + (new.balance > 0)
+        WHERE seller_id = new.seller_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_trans_ai AFTER INSERT ON transactions BEGIN
+        UPDATE store_stats SET
+            debt_today = (CASE WHEN stats_day = date(new.created_at, '{TZ_SQL_OFFSET}') THEN debt_today ELSE 0 END) + MAX(new.amount, 0),
+            paid_today = (CASE WHEN stats_day = date(new.created_at, '{TZ_SQL_OFFSET}') THEN paid_today ELSE 0 END) + MAX(-new.amount, 0),
+            stats_day = date(new.created_at, '{TZ_SQL_OFFSET}'),
+            last_tx_rowid = new.rowid
+        WHERE seller_id = (SELECT seller_id FROM customers WHERE id = new.customer_id);
+    END
+    """,
+]
+
+# Mijoz o'chirilganda uning tranzaksiyalari ham o'chadi: o'sha kunga tegishli
+# bo'lsa, bugungi nasiya/to'lovdan ayiriladi (mijoz qatori hali mavjud bo'lishi kerak)
+STORE_STATS_TRANS_AD_TRIGGER = f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_trans_ad AFTER DELETE ON transactions BEGIN
+        UPDATE store_stats SET
+            debt_today = debt_today - MAX(old.amount, 0),
+            paid_today = paid_today - MAX(-old.amount, 0)
+        WHERE seller_id = (SELECT seller_id FROM customers WHERE id = old.customer_id)
+          AND stats_day = date(old.created_at, '{TZ_SQL_OFFSET}');
+    END
+"""
+
+REBUILD_STORE_STATS_SQL = [
+    "DELETE FROM store_stats",
+    """
+    INSERT INTO store_stats (seller_id, total_debt, debtors_count, customers_count)
+    SELECT seller_id,
+           COALESCE(SUM(CASE WHEN balance > 0 THEN balance END), 0),
+           COUNT(CASE WHEN balance > 0 THEN 1 END),
+           COUNT(*)
+    FROM customers GROUP BY seller_id
+    """,
+    f"""
+    UPDATE store_stats SET
+        stats_day = date('now', '{TZ_SQL_OFFSET}'),
+        debt_today = COALESCE((
+            SELECT SUM(MAX(t.amount, 0)) FROM transactions t JOIN customers c ON c.id = t.customer_id
+            WHERE c.seller_id = store_stats.seller_id AND date(t.created_at, '{TZ_SQL_OFFSET}') = date('now', '{TZ_SQL_OFFSET}')
+        ), 0),
+        paid_today = COALESCE((
+            SELECT SUM(MAX(-t.amount, 0)) FROM transactions t JOIN customers c ON c.id = t.customer_id
+            WHERE c.seller_id = store_stats.seller_id AND date(t.created_at, '{TZ_SQL_OFFSET}') = date('now', '{TZ_SQL_OFFSET}')
+        ), 0),
+        last_tx_rowid = (
+            SELECT MAX(t.rowid) FROM transactions t JOIN customers c ON c.id = t.customer_id
+            WHERE c.seller_id = store_stats.seller_id
+        )
+    """,
+]
+
+async def _m7_store_stats(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS store_stats (
+            seller_id INTEGER PRIMARY KEY,
+            total_debt REAL NOT NULL DEFAULT 0,
+            debtors_count INTEGER NOT NULL DEFAULT 0,
+            customers_count INTEGER NOT NULL DEFAULT 0,
+            stats_day TEXT,
+            debt_today REAL NOT NULL DEFAULT 0,
+            paid_today REAL NOT NULL DEFAULT 0,
+            last_tx_rowid INTEGER
+        )
+    """)
+    for sql in STORE_STATS_TRIGGERS + REBUILD_STORE_STATS_SQL:
+        await db.execute(sql)
+
+# store_stats.version - do'kon mijozlari yoki tranzaksiyalari har o'zgarganda
+# oshadi (ism, telefon, balans, o'chirish). Hisobot keshi shu bo'yicha eskiradi.
+STORE_VERSION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS store_version_cust_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO store_stats (seller_id, version) VALUES (new.seller_id, 1)
+        ON CONFLICT(seller_id) DO UPDATE SET version = version + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_version_cust_au AFTER UPDATE ON customers BEGIN
+        UPDATE store_stats SET version = version + 1 WHERE seller_id IN (old.seller_id, new.seller_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_version_cust_ad AFTER DELETE ON customers BEGIN
+        UPDATE store_stats SET version = version + 1 WHERE seller_id = old.seller_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_version_trans_ai AFTER INSERT ON transactions BEGIN
+        UPDATE store_stats SET version = version + 1
+        WHERE seller_id = (SELECT seller_id FROM customers WHERE id = new.customer_id);
+    END
+    """,
+]
+
+async def _m8_store_version(db):
+    await add_column_if_missing(db, "store_stats", "version", "INTEGER NOT NULL DEFAULT 0")
+    for sql in STORE_VERSION_TRIGGERS:
+        await db.execute(sql)
+
+async def _m12_subscription_until(db):
+    # Eski qoida: har oyning ro'yxatdan o'tgan kunida bloklash. Hozirgi
+    # sotuvchilar uchun shu qoidaga ko'ra navbatdagi sanani hisoblab qo'yamiz.
+    await add_column_if_missing(db, "users", "subscription_until", "TEXT")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_subscription ON users(role, subscription_until)
+    """)
+    today = today_local()
+    async with db.execute("SELECT telegram_id, created_at FROM users WHERE role = 'admin'") as cur:
+        rows = await cur.fetchall()
+    updates = []
+    for tg_id, created_at in rows:
         try:
-            await db.execute("ALTER TABLE users ADD COLUMN locked_until TIMESTAMP")
-        except: pass
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                seller_id INTEGER NOT NULL,
-                full_name TEXT,
-                phone TEXT,
-                balance REAL DEFAULT 0,
-                telegram_id INTEGER,
-                FOREIGN KEY(seller_id) REFERENCES users(telegram_id),
-                FOREIGN KEY(telegram_id) REFERENCES users(telegram_id)
-            )
-        """)
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                customer_id INTEGER,
-                amount REAL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(customer_id) REFERENCES customers(id)
-            )
-        """)
-        await db.commit()
+            created = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
+        except (TypeError, ValueError):
+            created = today
+        months = 1
+        while add_months(created, months) < today:
+            months += 1
+        updates.append((add_months(created, months).isoformat(), tg_id))
+    await db.executemany("UPDATE users SET subscription_until = ? WHERE telegram_id = ?", updates)
+
+async def _m14_search_full_phone(db):
+    # search_key ga to'liq raqam (998...) ham qo'shildi; FTS triggerlar orqali yangilanadi
+    async with db.execute("SELECT id, full_name, phone FROM customers") as cur:
+        rows = await cur.fetchall()
+    await db.executemany("UPDATE customers SET search_key = ? WHERE id = ?",
+                         [(customer_search_key(name, phone), cid) for cid, name, phone in rows])
+
+async def _m15_blocked_reason(db):
+    # 'expired' - obuna tugagani uchun (db_block_expired_subscriptions), 'manual' -
+    # bot egasi bloklagan. Eski bloklar: muddati o'tgan sotuvchilar - 'expired',
+    # qolganlari (obunasi yo'q yoki hali amalda) - 'manual'.
+    await add_column_if_missing(db, "users", "blocked_reason", "TEXT")
+    await db.execute("""
+        UPDATE users SET blocked_reason = CASE
+            WHEN subscription_until IS NOT NULL AND subscription_until <= ? THEN 'expired'
+            ELSE 'manual'
+        END
+        WHERE role = 'blocked'
+    """, (today_local().isoformat(),))
+
+async def _m16_drop_customers_store_id(db):
+    # Eski 5-migratsiya qo'shgan customers.store_id hech qayerda o'qilmaydi
+    # (do'kon - seller_id), eskirib qolmasligi uchun olib tashlanadi
+    await db.execute("DROP INDEX IF EXISTS idx_customers_store")
+    if await column_exists(db, "customers", "store_id"):
+        await db.execute("ALTER TABLE customers DROP COLUMN store_id")
+
+MIGRATIONS = [
+    (1, "boshlang'ich jadvallar", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            full_name TEXT,
+            username TEXT,
+            phone TEXT, 
+            role TEXT,
+            store_name TEXT,
+            is_owner INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked_until TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER NOT NULL,
+            full_name TEXT,
+            phone TEXT,
+            balance REAL DEFAULT 0,
+            telegram_id INTEGER,
+            FOREIGN KEY(seller_id) REFERENCES users(telegram_id),
+            FOREIGN KEY(telegram_id) REFERENCES users(telegram_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            customer_id INTEGER,
+            amount REAL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(customer_id) REFERENCES customers(id)
+        )
+        """,
+    ]),
+    (2, "users.locked_until ustuni", _m2_users_locked_until),
+    (3, "asosiy so'rovlar uchun indekslar", [
+        # Mijozlar ro'yxati (ORDER BY full_name), qidiruv va qarzdorlar
+        "CREATE INDEX IF NOT EXISTS idx_customers_seller_name ON customers(seller_id, full_name)",
+        # db_add_customer dagi dublikat tekshiruvi
+        "CREATE INDEX IF NOT EXISTS idx_customers_seller_phone ON customers(seller_id, phone)",
+        # Haridorning qarzlari (Mening qarzim)
+        "CREATE INDEX IF NOT EXISTS idx_customers_telegram ON customers(telegram_id)",
+        # Balans kartochkasi va hisobotlar
+        "CREATE INDEX IF NOT EXISTS idx_transactions_customer_date ON transactions(customer_id, created_at)",
+        # get_store_owner_id va xodimlar ro'yxati
+        "CREATE INDEX IF NOT EXISTS idx_users_store_owner ON users(store_name, is_owner)",
+        # Admin panelidagi rol bo'yicha ro'yxatlar
+        "CREATE INDEX IF NOT EXISTS idx_users_role_created ON users(role, created_at)",
+    ]),
+    (4, "normallashtirilgan telefon kaliti", _m4_phone_keys),
+    (5, "stores jadvali", _m5_stores),
+    (6, "mijozlar uchun FTS5 qidiruv", _m6_customer_search),
+    (7, "store_stats agregat jadvali", _m7_store_stats),
+    (8, "store_stats.version (hisobot keshi uchun)", _m8_store_version),
+    (9, "outbox jadvali", OUTBOX_SCHEMA),
+    (10, "dead_chats reestri", DEAD_CHATS_SCHEMA),
+    (11, "job_runs (vaqtli vazifalar tarixi)", JOB_RUNS_SCHEMA),
+    (12, "users.subscription_until", _m12_subscription_until),
+    (13, "fsm_states (FSM holatlari)", FSM_SCHEMA),
+    (14, "qidiruvda to'liq telefon raqami", _m14_search_full_phone),
+    (15, "users.blocked_reason", _m15_blocked_reason),
+    (16, "customers.store_id olib tashlandi", _m16_drop_customers_store_id),
+    (17, "store_stats: tranzaksiya o'chirilishi", [STORE_STATS_TRANS_AD_TRIGGER, *REBUILD_STORE_STATS_SQL]),
+]
 
-        await db.commit()
+async def init_db():
+    await db_pool.open()
+    async with db_pool.writer() as db:
+        version = await migrate(db, MIGRATIONS)
+    logging.info(f"Baza sxemasi versiyasi: {version}")
+    await dead_chats.load()
+    ledger_queue.start()
+
+async def close_db():
+    await job_scheduler.stop()
+    await fsm_storage.close()
+    await outbox_worker.stop()
+    await ledger_queue.stop()
+    await db_pool.close()
 
 # --- DB Metodlari ---
 
+async def _set_user_phones(db, tg_id, phone):
+    await db.execute("DELETE FROM user_phones WHERE telegram_id = ?", (tg_id,))
+    await db.executemany("INSERT OR IGNORE INTO user_phones (phone_key, telegram_id) VALUES (?, ?)",
+                         [(k, tg_id) for k in phone_keys(phone)])
+
 async def db_add_user(tg_id, name, username, role, phone=None, store_name=None, is_owner=0):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.writer() as db:
+        store_id = None
+        # INSERT OR REPLACE qatorni qayta yozadi - amaldagi obuna muddati saqlanib qolsin
+        async with db.execute("SELECT subscription_until FROM users WHERE telegram_id = ?", (tg_id,)) as cur:
+            row = await cur.fetchone()
+        subscription_until = row[0] if row else None
+        if role == 'admin':
+            subscription_until = subscription_start(subscription_until)
+        if is_owner and store_name:
+            # Har bir egaga bitta do'kon; qayta ro'yxatdan o'tsa nomi yangilanadi
+            await db.execute("""
+                INSERT INTO stores (name, owner_id) VALUES (?, ?)
+                ON CONFLICT(owner_id) DO UPDATE SET name = excluded.name
+            """, (store_name, tg_id))
+            async with db.execute("SELECT id FROM stores WHERE owner_id = ?", (tg_id,)) as cur:
+                store_id = (await cur.fetchone())[0]
         await db.execute("""
-            INSERT OR REPLACE INTO users (telegram_id, full_name, username, role, phone, store_name, is_owner) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (tg_id, name, username, role, phone, store_name, is_owner))
+            INSERT OR REPLACE INTO users (telegram_id, full_name, username, role, phone, store_id, is_owner, subscription_until) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (tg_id, name, username, role, phone, store_id, is_owner, subscription_until))
+        await _set_user_phones(db, tg_id, phone)
+        await db.commit()
+    invalidate_user_ctx(tg_id)
+    if store_id:
+        # Xodimlar keshidagi do'kon nomi ham o'zgargan bo'lishi mumkin
+        invalidate_store_ctx(store_id)
+
+# --- Obuna (sotuvchilar uchun oylik to'lov) ---
+def subscription_start(current):
+    # Sotuvchi bo'lganda: amaldagi muddat tugamagan bo'lsa o'zi, aks holda bugundan 1 oy
+    today = today_local()
+    if current and current > today.isoformat():
+        return current
+    return add_months(today, 1).isoformat()
+
+async def db_renew_subscription(tg_id, months=1):
+    # Bot egasi uchun: muddatni uzaytirish (tugagan bo'lsa bugundan hisoblanadi).
+    # Faqat obuna tugagani uchun bloklangan sotuvchi qayta faollashtiriladi;
+    # qo'lda bloklangan foydalanuvchi uchun "blocked", sotuvchi bo'lmagan
+    # (masalan, blokdan ochilgach client) uchun "not_seller" qaytadi (o'zgarishsiz).
+    async with db_pool.writer() as db:
+        async with db.execute("SELECT role, subscription_until, blocked_reason FROM users WHERE telegram_id = ?", (tg_id,)) as cur:
+            row = await cur.fetchone()
+        if not row:
+            return None
+        role, current, reason = row
+        if role == 'blocked' and reason != 'expired':
+            return "blocked"
+        if role not in ('admin', 'blocked'):
+            return "not_seller"
+        today = today_local()
+        base = date.fromisoformat(current) if current and current > today.isoformat() else today
+        until = add_months(base, months)
+        new_role = 'admin' if role == 'blocked' else role
+        await db.execute("UPDATE users SET subscription_until = ?, role = ?, blocked_reason = NULL WHERE telegram_id = ?",
+                         (until.isoformat(), new_role, tg_id))
         await db.commit()
+    invalidate_user_ctx(tg_id)
+    return until
+
+async def db_block_expired_subscriptions():
+    # Muddati tugagan barcha sotuvchilar bitta UPDATE bilan bloklanadi (idx_users_subscription)
+    today = today_local().isoformat()
+    async with db_pool.writer() as db:
+        sql = """
+            SELECT u.telegram_id, u.full_name, u.phone, s.name, u.subscription_until
+            FROM users u LEFT JOIN stores s ON s.id = u.store_id
+            WHERE u.role = 'admin' AND u.subscription_until <= ?
+        """
+        async with db.execute(sql, (today,)) as cur:
+            expired = await cur.fetchall()
+        if expired:
+            await db.execute("UPDATE users SET role = 'blocked', blocked_reason = 'expired' WHERE role = 'admin' AND subscription_until <= ?", (today,))
+            await db.commit()
+    for row in expired:
+        invalidate_user_ctx(row[0])
+    return expired
+
+# --- Foydalanuvchi konteksti (kesh) ---
+# user - foydalanuvchi qatori (USER_COLUMNS tartibida), owner_id - do'kon egasining ID si.
+UserContext = namedtuple("UserContext", "user role store_id store_name is_owner owner_id")
+NO_USER = UserContext(None, None, None, None, 0, None)
+
+# 0:id, 1:full_name, 2:username, 3:phone, 4:role, 5:store_name, 6:is_owner,
+# 7:created_at, 8:locked_until, 9:store_id
+USER_COLUMNS = """
+    u.telegram_id, u.full_name, u.username, u.phone, u.role, s.name, u.is_owner,
+    u.created_at, u.locked_until, u.store_id
+"""
+
+async def db_get_user_context(tg_id):
+    ctx = user_ctx_cache.get(tg_id)
+    if ctx is not None: return ctx
+    async with db_pool.reader() as db:
+        sql = f"""
+            SELECT {USER_COLUMNS}, s.owner_id
+            FROM users u LEFT JOIN stores s ON s.id = u.store_id
+            WHERE u.telegram_id = ?
+        """
+        async with db.execute(sql, (tg_id,)) as cur:
+            row = await cur.fetchone()
+    if row:
+        user = tuple(row[:-1])
+        ctx = UserContext(user, user[4], user[9], user[5], user[6], row[-1])
+    else:
+        ctx = NO_USER
+    user_ctx_cache.set(tg_id, ctx)
+    return ctx
+
+def invalidate_user_ctx(tg_id):
+    user_ctx_cache.invalidate(tg_id)
+
+def invalidate_store_ctx(store_id):
+    user_ctx_cache.invalidate_where(lambda ctx: ctx.store_id == store_id)
 
 async def db_get_user(tg_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM users WHERE telegram_id = ?", (tg_id,)) as cur:
-            return await cur.fetchone()
+    return (await db_get_user_context(tg_id)).user
 
 async def db_get_user_id_by_phone(phone):
-    async with aiosqlite.connect(DB_NAME) as db:
-        short_phone = phone[-9:]
-        async with db.execute("SELECT telegram_id FROM users WHERE phone LIKE ?", (f"%{short_phone}",)) as cur:
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT telegram_id FROM user_phones WHERE phone_key = ?", (phone_key(phone),)) as cur:
             res = await cur.fetchone()
             return res[0] if res else None
 
-async def db_get_store_staff(store_name, exclude_tg_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def db_get_store_staff(store_id, exclude_tg_id):
+    async with db_pool.reader() as db:
         # Get employees of the same store, excluding the owner/current user
-        async with db.execute("SELECT telegram_id, full_name, username, phone, created_at FROM users WHERE store_name = ? AND telegram_id != ? AND role = 'admin'", (store_name, exclude_tg_id)) as cur:
+        async with db.execute("SELECT telegram_id, full_name, username, phone, created_at FROM users WHERE store_id = ? AND telegram_id != ? AND role = 'admin'", (store_id, exclude_tg_id)) as cur:
             return await cur.fetchall()
 
 async def db_kick_staff(tg_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.writer() as db:
         # Reset user to buyer status, remove store access
-        await db.execute("UPDATE users SET role = 'client', store_name = NULL, is_owner = 0 WHERE telegram_id = ?", (tg_id,))
+        await db.execute("UPDATE users SET role = 'client', store_id = NULL, is_owner = 0 WHERE telegram_id = ?", (tg_id,))
         await db.commit()
+    invalidate_user_ctx(tg_id)
+
+# --- Daftar yozuvlari (ledger_queue ishlari, commit navbatda) ---
+
+async def _job_add_customer(db, seller_id, name, phone, linked_tg_id):
+    key = phone_key(phone)
+    async with db.execute("SELECT id FROM customers WHERE seller_id = ? AND phone_key = ?", (seller_id, key)) as cur:
+        if await cur.fetchone(): return None
+    
+    sql = """
+        INSERT INTO customers (seller_id, full_name, phone, phone_key, search_key, telegram_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    params = (seller_id, name, phone, key, customer_search_key(name, phone), linked_tg_id)
+    async with db.execute(sql, params) as cur:
+        return cur.lastrowid
+
+async def _job_add_trans(db, cust_id, amount, desc, notify=None):
+    await db.execute("INSERT INTO transactions (customer_id, amount, description) VALUES (?, ?, ?)", (cust_id, amount, desc))
+    await db.execute("UPDATE customers SET balance = balance + ? WHERE id = ?", (amount, cust_id))
+    if notify:
+        await enqueue(db, *notify)
+
+async def _job_update_customer_name(db, cust_id, seller_id, name):
+    async with db.execute("SELECT phone FROM customers WHERE id = ? AND seller_id = ?", (cust_id, seller_id)) as cur:
+        row = await cur.fetchone()
+    if not row: return False
+    await db.execute("UPDATE customers SET full_name = ?, search_key = ? WHERE id = ?",
+                     (name, customer_search_key(name, row[0]), cust_id))
+    return True
+
+async def _job_delete_customer(db, cust_id, seller_id):
+    # Balans tekshiruvi shu tranzaksiya ichida, oraliqda nasiya yozilib qolmasligi uchun.
+    # Avval tranzaksiyalar: store_stats_trans_ad trigger mijoz orqali do'konni topadi.
+    async with db.execute("SELECT 1 FROM customers WHERE id = ? AND seller_id = ? AND balance = 0", (cust_id, seller_id)) as cur:
+        if not await cur.fetchone(): return False
+    await db.execute("DELETE FROM transactions WHERE customer_id = ?", (cust_id,))
+    await db.execute("DELETE FROM customers WHERE id = ?", (cust_id,))
+    return True
 
 async def db_add_customer(seller_id, name, phone, linked_tg_id=None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id FROM customers WHERE seller_id = ? AND phone = ?", (seller_id, phone)) as cur:
-            if await cur.fetchone(): return None
-        
-        async with db.execute("INSERT INTO customers (seller_id, full_name, phone, telegram_id) VALUES (?, ?, ?, ?)", 
-                              (seller_id, name, phone, linked_tg_id)) as cur:
-            await db.commit()
-            return cur.lastrowid
+    return await ledger_queue.submit(_job_add_customer, seller_id, name, phone, linked_tg_id)
+
+async def db_add_trans(cust_id, amount, desc, notify=None):
+    # notify = (chat_id, matn): bildirishnoma tranzaksiya bilan birga outbox ga yoziladi
+    await ledger_queue.submit(_job_add_trans, cust_id, amount, desc, notify)
+    if notify:
+        outbox_worker.wake()
+
+async def db_update_customer_name(cust_id, seller_id, name):
+    return await ledger_queue.submit(_job_update_customer_name, cust_id, seller_id, name)
+
+async def db_delete_customer(cust_id, seller_id):
+    return await ledger_queue.submit(_job_delete_customer, cust_id, seller_id)
 
 async def db_link_customer(phone, tg_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        search_phone = f"%{phone[-9:]}"
-        await db.execute("UPDATE customers SET telegram_id = ? WHERE phone LIKE ?", (tg_id, search_phone))
+    async with db_pool.writer() as db:
+        await db.execute("UPDATE customers SET telegram_id = ? WHERE phone_key = ?", (tg_id, phone_key(phone)))
         await db.commit()
 
-async def db_promote_to_staff(store_name, phone):
-    async with aiosqlite.connect(DB_NAME) as db:
-        short_phone = phone[-9:]
+async def db_promote_to_staff(store_id, phone):
+    async with db_pool.writer() as db:
         # Find user by phone
-        async with db.execute("SELECT telegram_id, role FROM users WHERE phone LIKE ?", (f"%{short_phone}",)) as cur:
+        sql = """
+            SELECT u.telegram_id, u.role FROM user_phones p
+            JOIN users u ON u.telegram_id = p.telegram_id
+            WHERE p.phone_key = ?
+        """
+        async with db.execute(sql, (phone_key(phone),)) as cur:
             user = await cur.fetchone()
             
         if not user: return "not_found"
@@ -154,163 +707,478 @@ async def db_promote_to_staff(store_name, phone):
         if user[1] == 'blocked': return "blocked"
         
         # Promote
-        await db.execute("UPDATE users SET role = 'admin', store_name = ?, is_owner = 0 WHERE telegram_id = ?", (store_name, user[0]))
+        async with db.execute("SELECT subscription_until FROM users WHERE telegram_id = ?", (user[0],)) as cur:
+            current = (await cur.fetchone())[0]
+        await db.execute("UPDATE users SET role = 'admin', store_id = ?, is_owner = 0, subscription_until = ? WHERE telegram_id = ?",
+                         (store_id, subscription_start(current), user[0]))
         await db.commit()
-        return user[0] # Return TG ID to notify
+    invalidate_user_ctx(user[0])
+    return user[0] # Return TG ID to notify
 
 async def db_get_my_customers(seller_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT id, full_name, balance, telegram_id, phone FROM customers WHERE seller_id = ? ORDER BY full_name", (seller_id,)) as cur:
             return await cur.fetchall()
 
+# Sahifalash filtrlari: a - hammasi, d - qarzdorlar, l - botga ulanganlar
+CUSTOMER_FILTERS = {
+    "a": "",
+    "d": " AND balance > 0",
+    "l": " AND telegram_id IS NOT NULL",
+}
+
+async def db_get_customers_page(seller_id, flt="a", after=None, before=None, limit=PAGE_SIZE):
+    # Keyset pagination (full_name, id) bo'yicha: after/before - chegaraviy mijoz ID si.
+    # Chegaraviy mijoz o'chirilgan bo'lsa - birinchi sahifa.
+    # Qaytaradi: (qatorlar, oldingi sahifa bormi, keyingi sahifa bormi)
+    sql = f"""
+        SELECT id, full_name, balance, telegram_id, phone FROM customers
+        WHERE seller_id = ?{CUSTOMER_FILTERS.get(flt, "")}
+    """
+    params = [seller_id]
+    async with db_pool.reader() as db:
+        anchor = None
+        if before or after:
+            async with db.execute("SELECT full_name, id FROM customers WHERE id = ? AND seller_id = ?",
+                                  (before or after, seller_id)) as cur:
+                anchor = await cur.fetchone()
+            if anchor is None:
+                before = after = None
+        if before:
+            sql += " AND (full_name, id) < (?, ?) ORDER BY full_name DESC, id DESC"
+            params += anchor
+        else:
+            if after:
+                sql += " AND (full_name, id) > (?, ?)"
+                params += anchor
+            sql += " ORDER BY full_name, id"
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+        async with db.execute(sql, params) as cur:
+            rows = await cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+        return rows, more, True
+    return rows, bool(after), more
+
 async def db_get_customer_if_mine(cust_id, seller_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT id, full_name, phone, balance, telegram_id FROM customers WHERE id = ? AND seller_id = ?", (cust_id, seller_id)) as cur:
             return await cur.fetchone()
 
 async def db_get_customer_by_id(cust_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT id, full_name, phone, balance FROM customers WHERE id = ?", (cust_id,)) as cur:
             return await cur.fetchone()
 
 async def db_get_buyer_debts(buyer_tg_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    # Do'kon egasi (seller_id) bo'yicha LEFT JOIN: stores qatori yo'q bo'lsa ham qarz ko'rinadi
+    async with db_pool.reader() as db:
         sql = """
-            SELECT u.store_name, c.balance, c.full_name, c.id
+            SELECT COALESCE(s.name, 'Do''kon'), c.balance, c.full_name, c.id
             FROM customers c
-            JOIN users u ON c.seller_id = u.telegram_id
+            LEFT JOIN stores s ON s.owner_id = c.seller_id
             WHERE c.telegram_id = ? AND c.balance != 0
         """
         async with db.execute(sql, (buyer_tg_id,)) as cur:
             return await cur.fetchall()
 
+async def db_get_buyer_debts_with_history(buyer_tg_id, limit=10):
+    # "Mening qarzim" uchun bitta so'rov: har bir do'kondagi balans, do'kon
+    # aloqa raqami va oxirgi `limit` ta amaliyot (ROW_NUMBER oynasi orqali).
+    sql = """
+        WITH debts AS (
+            SELECT c.id, c.balance, COALESCE(s.name, 'Do''kon') AS store_name, o.phone AS store_phone
+            FROM customers c
+            LEFT JOIN stores s ON s.owner_id = c.seller_id
+            LEFT JOIN users o ON o.telegram_id = c.seller_id
+            WHERE c.telegram_id = ? AND c.balance != 0
+        ),
+        recent AS (
+            SELECT t.customer_id, t.amount, t.description, t.created_at,
+                   ROW_NUMBER() OVER (PARTITION BY t.customer_id ORDER BY t.created_at DESC, t.rowid DESC) AS rn
+            FROM transactions t
+            WHERE t.customer_id IN (SELECT id FROM debts)
+        )
+        SELECT d.id, d.store_name, d.store_phone, d.balance, r.amount, r.description, r.created_at
+        FROM debts d
+        LEFT JOIN recent r ON r.customer_id = d.id AND r.rn <= ?
+        ORDER BY d.store_name, d.id, r.rn
+    """
+    async with db_pool.reader() as db:
+        async with db.execute(sql, (buyer_tg_id, limit)) as cur:
+            rows = await cur.fetchall()
+    result = []
+    for _, group in groupby(rows, key=lambda r: r[0]):
+        group = list(group)
+        _, store_name, store_phone, balance = group[0][:4]
+        trans = [r[4:] for r in group if r[4] is not None]
+        result.append((store_name, store_phone, balance, trans))
+    return result
+
 async def db_get_last_transactions(cust_id, limit=3):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         sql = "SELECT amount, description, created_at FROM transactions WHERE customer_id = ? ORDER BY created_at DESC LIMIT ?"
         async with db.execute(sql, (cust_id, limit)) as cur:
             return await cur.fetchall()
 
-async def db_add_trans(cust_id, amount, desc):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT INTO transactions (customer_id, amount, description) VALUES (?, ?, ?)", (cust_id, amount, desc))
-        await db.execute("UPDATE customers SET balance = balance + ? WHERE id = ?", (amount, cust_id))
-        await db.commit()
+async def db_iter_transactions_report(seller_id, days=None, chunk_size=REPORT_CHUNK):
+    # Hisobot qatorlarini chunk_size lik ro'yxatlar bilan beradi (fetchall() siz).
+    # Eksport sekin bo'lishi mumkin, shuning uchun umumiy o'quvchi emas, alohida
+    # ulanish ishlatiladi (bir vaqtdagi eksportlar soni report_workers.slot da cheklangan).
+    sql = """
+        SELECT t.created_at, c.full_name, c.phone, t.amount, t.description 
+        FROM transactions t
+        JOIN customers c ON t.customer_id = c.id
+        WHERE c.seller_id = ?
+    """
+    params = [seller_id]
+    if days:
+        date_filter = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        sql += " AND t.created_at >= ?"
+        params.append(date_filter)
+    sql += " ORDER BY t.created_at DESC"
+
+    async with db_pool.dedicated() as db:
+        async with db.execute(sql, tuple(params)) as cur:
+            while True:
+                rows = await cur.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
 
 async def db_get_transactions_report(seller_id, days=None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        sql = """
-            SELECT t.created_at, c.full_name, c.phone, t.amount, t.description 
-            FROM transactions t
-            JOIN customers c ON t.customer_id = c.id
-            WHERE c.seller_id = ?
-        """
-        params = [seller_id]
-        if days:
-            date_filter = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-            sql += " AND t.created_at >= ?"
-            params.append(date_filter)
-        
-        sql += " ORDER BY t.created_at DESC"
-        async with db.execute(sql, tuple(params)) as cur:
-            return await cur.fetchall()
+    return [row async for chunk in db_iter_transactions_report(seller_id, days) for row in chunk]
+
+StoreStats = namedtuple("StoreStats", "total_debt debtors_count customers_count debt_today paid_today")
+EMPTY_STATS = StoreStats(0, 0, 0, 0, 0)
+
+# Bugungi ko'rsatkichlar faqat stats_day bugungi sana bo'lsa hisobga olinadi
+STORE_STATS_COLUMNS = f"""
+    s.total_debt, s.debtors_count, s.customers_count,
+    CASE WHEN s.stats_day = date('now', '{TZ_SQL_OFFSET}') THEN s.debt_today ELSE 0 END,
+    CASE WHEN s.stats_day = date('now', '{TZ_SQL_OFFSET}') THEN s.paid_today ELSE 0 END
+"""
+
+async def db_get_store_stats(seller_id):
+    async with db_pool.reader() as db:
+        async with db.execute(f"SELECT {STORE_STATS_COLUMNS} FROM store_stats s WHERE s.seller_id = ?", (seller_id,)) as cur:
+            row = await cur.fetchone()
+    return StoreStats(*row) if row else EMPTY_STATS
+
+async def db_get_all_store_stats(with_debtors=False, reachable=False):
+    # Faol do'konlar (ega + do'kon nomi) va ularning statistikasi, bitta so'rov.
+    # with_debtors - faqat qarzdori bor do'konlar, reachable - egasi botni bloklamagan
+    sql = f"""
+        SELECT u.telegram_id, st.name, u.full_name, {STORE_STATS_COLUMNS}
+        FROM stores st
+        JOIN users u ON u.telegram_id = st.owner_id
+        JOIN store_stats s ON s.seller_id = st.owner_id
+        WHERE u.role = 'admin' AND u.is_owner = 1
+    """
+    if with_debtors:
+        sql += " AND s.debtors_count > 0"
+    if reachable:
+        sql += f" AND {alive_sql('u.telegram_id')}"
+    async with db_pool.reader() as db:
+        async with db.execute(sql) as cur:
+            rows = await cur.fetchall()
+    return [(r[0], r[1], r[2], StoreStats(*r[3:])) for r in rows]
+
+async def db_rebuild_store_stats():
+    # Agregatlarni noldan qayta hisoblaydi. Qaytaradi: mos kelmagan do'konlar soni.
+    # Bugungi qiymatlar o'qilgandagidek solishtiriladi (stats_day bugun bo'lmasa 0):
+    # qayta hisoblash stats_day ni har doim bugunga qo'yadi
+    sql = f"SELECT s.seller_id, {STORE_STATS_COLUMNS} FROM store_stats s"
+    async with db_pool.writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute(sql) as cur:
+            before = {r[0]: r[1:] for r in await cur.fetchall()}
+        for rebuild in REBUILD_STORE_STATS_SQL:
+            await db.execute(rebuild)
+        async with db.execute(sql) as cur:
+            after = {r[0]: r[1:] for r in await cur.fetchall()}
+        await db.commit()
+    # Qayta hisoblashda version 0 dan boshlanadi - eski kesh kalitlari to'qnashmasin
+    report_cache.clear()
+    def same(a, b):
+        # total_debt, debtors_count, customers_count, debt_today, paid_today
+        return (a is not None and b is not None and a[1:3] == b[1:3]
+                and all(abs(x - y) < 0.01 for x, y in zip((a[0], a[3], a[4]), (b[0], b[3], b[4]))))
+    return sum(1 for k in set(before) | set(after) if not same(before.get(k), after.get(k)))
+
+async def db_get_store_version(seller_id):
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT version, last_tx_rowid FROM store_stats WHERE seller_id = ?", (seller_id,)) as cur:
+            row = await cur.fetchone()
+    return tuple(row) if row else (0, None)
+
+async def db_iter_user_ids(chunk_size=500):
+    # Keyset bo'yicha bo'laklab o'qiydi: ulanish bo'laklar orasida bo'shatiladi
+    last_id = None
+    while True:
+        async with db_pool.reader() as db:
+            sql = f"""
+                SELECT telegram_id FROM users
+                WHERE telegram_id > COALESCE(?, -1) AND {alive_sql('telegram_id')}
+                ORDER BY telegram_id LIMIT ?
+            """
+            async with db.execute(sql, (last_id, chunk_size)) as cur:
+                rows = await cur.fetchall()
+        for (tg_id,) in rows:
+            yield tg_id
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
 
 async def db_get_store_total(seller_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT SUM(balance) FROM customers WHERE seller_id = ? AND balance > 0", (seller_id,)) as cur:
-            res = await cur.fetchone()
-            return res[0] if res[0] else 0
+    return (await db_get_store_stats(seller_id)).total_debt
 
-            res = await cur.fetchone()
-            return res[0] if res[0] else 0
-
-async def db_get_store_debtors(seller_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+async def db_get_store_debtors(seller_id, reachable=False):
+    # reachable=True: faqat Telegramga ulangan va botni bloklamagan qarzdorlar
+    async with db_pool.reader() as db:
         sql = """
             SELECT telegram_id, full_name, balance, phone
             FROM customers 
             WHERE seller_id = ? AND balance > 0
         """
+        if reachable:
+            sql += f" AND telegram_id IS NOT NULL AND {alive_sql('telegram_id')}"
         async with db.execute(sql, (seller_id,)) as cur:
             return await cur.fetchall()
 
+async def db_count_unreachable_debtors(seller_id):
+    async with db_pool.reader() as db:
+        sql = """
+            SELECT COUNT(*) FROM customers c
+            JOIN dead_chats d ON d.telegram_id = c.telegram_id
+            WHERE c.seller_id = ? AND c.balance > 0
+        """
+        async with db.execute(sql, (seller_id,)) as cur:
+            return (await cur.fetchone())[0]
+
 async def db_get_all_active_stores():
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT telegram_id, store_name, full_name FROM users WHERE role = 'admin' AND is_owner = 1") as cur:
+    async with db_pool.reader() as db:
+        sql = """
+            SELECT u.telegram_id, s.name, u.full_name
+            FROM stores s JOIN users u ON u.telegram_id = s.owner_id
+            WHERE u.role = 'admin' AND u.is_owner = 1
+        """
+        async with db.execute(sql) as cur:
             return await cur.fetchall()
 
 async def db_get_all_debtors_with_store():
-    async with aiosqlite.connect(DB_NAME) as db:
-        sql = """
-            SELECT c.telegram_id, c.full_name, c.balance, u.store_name
+    async with db_pool.reader() as db:
+        sql = f"""
+            SELECT c.telegram_id, c.full_name, c.balance, COALESCE(s.name, 'Do''kon')
             FROM customers c
-            JOIN users u ON c.seller_id = u.telegram_id
-            WHERE c.balance > 0 AND c.telegram_id IS NOT NULL
+            LEFT JOIN stores s ON s.owner_id = c.seller_id
+            WHERE c.balance > 0 AND c.telegram_id IS NOT NULL AND {alive_sql('c.telegram_id')}
         """
         async with db.execute(sql) as cur:
             return await cur.fetchall()
 
 async def db_get_all_users():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT full_name, username, phone, role, created_at FROM users") as cur:
             return await cur.fetchall()
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT full_name, username, phone, role, created_at FROM users") as cur:
             return await cur.fetchall()
 
 async def db_get_users_by_role(role):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.reader() as db:
         # ID ni ham olamiz (telegram_id)
-        async with db.execute("SELECT telegram_id, full_name, username, phone, created_at, store_name FROM users WHERE role = ? ORDER BY created_at DESC", (role,)) as cur:
+        sql = """
+            SELECT u.telegram_id, u.full_name, u.username, u.phone, u.created_at, s.name
+            FROM users u LEFT JOIN stores s ON s.id = u.store_id
+            WHERE u.role = ? ORDER BY u.created_at DESC
+        """
+        async with db.execute(sql, (role,)) as cur:
             return await cur.fetchall()
 
 async def db_get_blocked_users():
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT telegram_id, full_name, username, phone, created_at, store_name FROM users WHERE role = 'blocked' ORDER BY created_at DESC") as cur:
-            return await cur.fetchall()
-
-async def db_search_customers(seller_id, query):
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Search by name or phone
-        # Normalize query?
+    return await db_get_users_by_role('blocked')
+
+async def db_search_customers(seller_id, query, limit=SEARCH_LIMIT):
+    # Search by name or phone: 3+ belgili so'zlar FTS5 trigram indeksi orqali
+    # (istalgan joyidan), qisqa so'zlar esa so'z boshidan (prefiks) qidiriladi.
+    tokens = search_tokens(query)
+    if not tokens: return []
+    long_tokens = [t for t in tokens if len(t) >= 3]
+    short_tokens = [t for t in tokens if len(t) < 3]
+    if long_tokens:
         sql = """
-            SELECT id, full_name, balance, telegram_id, phone 
-            FROM customers 
-            WHERE seller_id = ? AND (full_name LIKE ? OR phone LIKE ?) 
-            ORDER BY full_name
+            SELECT c.id, c.full_name, c.balance, c.telegram_id, c.phone
+            FROM customers_fts f JOIN customers c ON c.id = f.rowid
+            WHERE customers_fts MATCH ? AND c.seller_id = ?
+        """
+        params = [" ".join('"' + t.replace('"', '""') + '"' for t in long_tokens), seller_id]
+    else:
+        sql = """
+            SELECT c.id, c.full_name, c.balance, c.telegram_id, c.phone
+            FROM customers c WHERE c.seller_id = ?
         """
-        like_query = f"%{query}%"
-        async with db.execute(sql, (seller_id, like_query, like_query)) as cur:
+        params = [seller_id]
+    for t in short_tokens:
+        sql += " AND (c.search_key LIKE ? OR c.search_key LIKE ?)"
+        params += [f"{t}%", f"% {t}%"]
+    sql += " ORDER BY f.rank, c.full_name" if long_tokens else " ORDER BY c.full_name"
+    sql += " LIMIT ?"
+    params.append(limit)
+    async with db_pool.reader() as db:
+        async with db.execute(sql, params) as cur:
             return await cur.fetchall()
 
 async def get_store_owner_id(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT store_name, is_owner FROM users WHERE telegram_id = ?", (user_id,)) as cur:
-            res = await cur.fetchone()
-            if not res: return None
-            store_name, is_owner = res
-            
-        if is_owner: return user_id
-        
-        # If staff, find the owner of this store
-        async with db.execute("SELECT telegram_id FROM users WHERE store_name = ? AND is_owner = 1", (store_name,)) as cur:
-            owner = await cur.fetchone()
-            return owner[0] if owner else None
-
-async def db_update_store_name(old_name, new_name):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET store_name = ? WHERE store_name = ?", (new_name, old_name))
+    # Staff uchun egasining ID si, ega uchun o'zi (kontekst keshidan)
+    return (await db_get_user_context(user_id)).owner_id
+
+async def db_update_store_name(store_id, new_name):
+    async with db_pool.writer() as db:
+        await db.execute("UPDATE stores SET name = ? WHERE id = ?", (new_name, store_id))
         await db.commit()
+    invalidate_store_ctx(store_id)
 
 async def db_update_user_phone(tg_id, new_phone):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.writer() as db:
         await db.execute("UPDATE users SET phone = ? WHERE telegram_id = ?", (new_phone, tg_id))
+        await _set_user_phones(db, tg_id, new_phone)
+        await db.commit()
+    invalidate_user_ctx(tg_id)
+
+async def db_set_role(tg_id, role, blocked_reason=None):
+    # Bloklash / blokdan ochish
+    async with db_pool.writer() as db:
+        await db.execute("UPDATE users SET role = ?, blocked_reason = ? WHERE telegram_id = ?", (role, blocked_reason, tg_id))
         await db.commit()
+    invalidate_user_ctx(tg_id)
+
+async def db_block_user(tg_id):
+    await db_set_role(tg_id, 'blocked', 'manual')
+
+async def db_unblock_user(tg_id):
+    # Reset to 'client'. They must login again to regain admin/seller access. 
+    # This is safer than guessing if they were admin or owner.
+    await db_set_role(tg_id, 'client')
+
+# Barcha db_* funksiyalari vaqti /metrics da (bot_db_seconds{function="..."})
+instrument_functions(globals(), "db_", db_seconds, db_errors)
+if tracer:
+    trace_functions(globals(), "db_")
+
+class UserContextMiddleware(BaseMiddleware):
+    # Har bir update uchun foydalanuvchi, rol, do'kon va egasini bir marta
+    # aniqlab, handlerlarga `user_ctx` argumenti sifatida uzatadi.
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user:
+            data["user_ctx"] = await db_get_user_context(from_user.id)
+        return await handler(event, data)
+
+class ChatAliveMiddleware(BaseMiddleware):
+    # Botga yozayotgan foydalanuvchi bizni bloklamagan: dead_chats dan o'chiramiz.
+    # Outer middleware - handler topilmagan updatelar uchun ham ishlaydi.
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user and from_user.id in dead_chats:
+            await dead_chats.mark_alive(from_user.id)
+        return await handler(event, data)
 
 def clean_phone(phone):
     if not phone: return None
     return phone.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
 
+def phone_key(phone):
+    # Qidiruv kaliti: faqat raqamlar, oxirgi 9 tasi (998 kodisiz)
+    if not phone: return None
+    digits = re.sub(r"\D", "", str(phone))
+    return digits[-9:] or None
+
+def phone_keys(phones):
+    # Egalarning telefoni "998..., 998..." ko'rinishida saqlanadi
+    if not phones: return []
+    keys = [phone_key(p) for p in str(phones).split(",")]
+    return list(dict.fromkeys(k for k in keys if k))
+
+# Kirill -> lotin (o'zbek imlosi). Qidiruvda ikkala alifbo bir xil ko'rinishga keladi.
+CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 's',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+}
+FOLD_TABLE = str.maketrans(CYR_TO_LAT)
+
+def fold_text(text):
+    # "Алишер", "Alisher", "ALISHER" -> "alisher"; "Xasan" va "Hasan" -> "hasan"
+    if not text: return ""
+    text = str(text).lower()
+    text = re.sub(r"[ʻʼ'`‘’]", "", text)  # o', g' dagi tutuq belgilari
+    text = text.translate(FOLD_TABLE).replace('x', 'h')
+    text = re.sub(r"[^\w\s]|_", " ", text)
+    return " ".join(text.split())
+
+def phone_full(phone):
+    # To'liq raqam: 9 xonali mahalliy raqamga 998 qo'shiladi
+    if not phone: return None
+    digits = re.sub(r"\D", "", str(phone))
+    return "998" + digits if len(digits) == 9 else digits or None
+
+def customer_search_key(name, phone):
+    # Ism + to'liq raqam (998901234567, "+998 90 123" kabi so'rovlar uchun)
+    # + 9 xonali kalit ("90" kabi qisqa so'rovlar so'z boshidan qidiriladi)
+    phones = " ".join(dict.fromkeys(p for p in (phone_full(phone), phone_key(phone)) if p))
+    return f"{fold_text(name)} {phones}".strip()
+
+def search_tokens(query):
+    # Yonma-yon turgan raqamlar bitta raqamga qo'shiladi: "90 123 45 67" -> "901234567"
+    tokens = []
+    for t in fold_text(query).split():
+        if t.isdigit() and tokens and tokens[-1].isdigit():
+            tokens[-1] += t
+        else:
+            tokens.append(t)
+    return tokens
+
+def chunk_blocks(blocks, limit=4000):
+    # Telegram xabari 4096 belgidan oshmasligi uchun bloklarni (HTML teglarini
+    # buzmasdan) bir nechta xabarga bo'lib chiqadi. Juda uzun blok qatorlarga
+    # bo'linadi (teglar bitta qator ichida ochilib-yopiladi).
+    chunks, current = [], ""
+    for block in blocks:
+        parts = [block] if len(block) < limit else split_long_block(block, limit - 1)
+        for part in parts:
+            if current and len(current) + len(part) + 1 > limit:
+                chunks.append(current)
+                current = ""
+            current += part + "\n"
+    if current.strip(): chunks.append(current)
+    return chunks
+
+def split_long_block(block, limit):
+    # Qatorlarga bo'ladi; qatorning o'zi ham uzun bo'lsa, teglarsiz oddiy
+    # matn sifatida (HTML escape qilib) bo'laklarga kesiladi
+    parts = []
+    for line in block.split("\n"):
+        if len(line) <= limit:
+            parts.append(line)
+            continue
+        text = html.unescape(re.sub(r"<[^>]*>", "", line))
+        while text:
+            n = limit
+            piece = html.escape(text[:n], quote=False)
+            while len(piece) > limit: # escape qatorni uzaytiradi (& -> &amp;)
+                n = max(1, n * limit // len(piece))
+                piece = html.escape(text[:n], quote=False)
+            parts.append(piece)
+            text = text[n:]
+    return parts
+
 def format_phone_display(phone):
     if not phone: return "Yo'q"
     phone = str(phone).replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
@@ -376,8 +1244,8 @@ seller_staff_kb = ReplyKeyboardMarkup(keyboard=[
 
 reports_kb = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text="📅 1 Haftalik (Excel)"), KeyboardButton(text="📅 1 Oylik (Excel)")],
-    [KeyboardButton(text="📋 Barchasi (Excel)"), KeyboardButton(text="📈 Umumiy statistika")],
-    [KeyboardButton(text="⬅️ Orqaga")]
+    [KeyboardButton(text="📋 Barchasi (Excel)"), KeyboardButton(text="📄 Barchasi (CSV)")],
+    [KeyboardButton(text="📈 Umumiy statistika"), KeyboardButton(text="⬅️ Orqaga")]
 ], resize_keyboard=True)
 
 # Cabinet KB
@@ -572,8 +1440,14 @@ async def save_buyer(msg: Message, state: FSMContext):
     await msg.answer("✅ Rahmat! Siz muvaffaqiyatli ro'yxatdan o'tdingiz.", reply_markup=buyer_kb)
     await state.clear()
 
-async def ensure_seller(msg: Message):
-    user = await db_get_user(msg.from_user.id)
+def seller_menu_kb(user_ctx):
+    # Do'kon egasi kabinetli menyuni, xodim oddiy menyuni ko'radi
+    return seller_owner_kb if user_ctx.is_owner else seller_staff_kb
+
+async def ensure_seller(msg: Message, user_ctx: UserContext = None):
+    if user_ctx is None:
+        user_ctx = await db_get_user_context(msg.from_user.id)
+    user = user_ctx.user
     if not user:
         await msg.answer("Ro'yxatdan o'tmagansiz.")
         return False
@@ -600,7 +1474,7 @@ async def save_c_name(msg: Message, state: FSMContext):
     await state.set_state(Form.cust_phone)
 
 @router.message(Form.cust_phone)
-async def save_c_phone(msg: Message, state: FSMContext):
+async def save_c_phone(msg: Message, state: FSMContext, user_ctx: UserContext):
     data = await state.get_data()
     phone = clean_phone(msg.text)
     
@@ -608,9 +1482,9 @@ async def save_c_phone(msg: Message, state: FSMContext):
         await msg.answer("⚠️ Iltimos, to'g'ri telefon raqam kiriting (faqat raqamlar).")
         return
 
-    seller_id = await get_store_owner_id(msg.from_user.id)
+    seller_id = user_ctx.owner_id
     if not seller_id:
-        await msg.answer("⚠️ Do'kon egasi topilmadi (Tizim xatosi).", reply_markup=seller_kb)
+        await msg.answer("⚠️ Do'kon egasi topilmadi (Tizim xatosi).", reply_markup=seller_menu_kb(user_ctx))
         await state.clear()
         return
 
@@ -620,24 +1494,58 @@ async def save_c_phone(msg: Message, state: FSMContext):
     link_status = "🔗 (Botga ulangan)" if linked_tg_id else "⚪️ (Botga ulanmagan)"
     phone_f = format_phone_display(phone)
     if res:
-        await msg.answer(f"✅ Mijoz qo'shildi!\n👤 <b>{data['name']}</b>\n📞 {phone_f}\n{link_status}", reply_markup=seller_kb, parse_mode="HTML")
+        await msg.answer(f"✅ Mijoz qo'shildi!\n👤 <b>{data['name']}</b>\n📞 {phone_f}\n{link_status}", reply_markup=seller_menu_kb(user_ctx), parse_mode="HTML")
     else:
-        await msg.answer("⚠️ Bu mijoz allaqachon mavjud.", reply_markup=seller_kb)
+        await msg.answer("⚠️ Bu mijoz allaqachon mavjud.", reply_markup=seller_menu_kb(user_ctx))
     await state.clear()
 
-async def get_my_cust_kb(seller_id, prefix):
-    custs = await db_get_my_customers(seller_id)
-    if not custs: return None
+FILTER_LABELS = {"a": "👥 Hammasi", "d": "🔴 Qarzdorlar", "l": "🟢 Ulanganlar"}
+
+async def get_my_cust_kb(seller_id, prefix, flt="a", after=None, before=None):
+    # Bitta sahifa mijozlar + sahifalash va filtr tugmalari.
+    # callback_data: cp:<prefix>:<filtr>:<n|p>:<chegaraviy mijoz ID>
+    custs, has_prev, has_next = await db_get_customers_page(seller_id, flt, after, before)
+    if not custs and flt == "a" and not (after or before): return None
     kb = InlineKeyboardMarkup(inline_keyboard=[])
     for c in custs:
         marker = "🟢" if c[3] else "⚪️"
         kb.inline_keyboard.append([InlineKeyboardButton(text=f"{marker} {c[1]} | {c[4]} ({c[2]:,.0f})", callback_data=f"{prefix}_{c[0]}")])
+    nav = []
+    if custs and has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"cp:{prefix}:{flt}:p:{custs[0][0]}"))
+    if custs and has_next:
+        nav.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"cp:{prefix}:{flt}:n:{custs[-1][0]}"))
+    if nav: kb.inline_keyboard.append(nav)
+    kb.inline_keyboard.append([
+        InlineKeyboardButton(text=("✅ " if f == flt else "") + label, callback_data=f"cp:{prefix}:{f}:n:0")
+        for f, label in FILTER_LABELS.items()
+    ])
     return kb
 
+@router.callback_query(F.data.startswith("cp:"))
+async def cust_page(call: CallbackQuery, user_ctx: UserContext):
+    if user_ctx.role != 'admin' or not user_ctx.owner_id:
+        await call.answer("Ruxsat yo'q")
+        return
+    _, prefix, flt, direction, anchor = call.data.split(":")
+    anchor = int(anchor) or None
+    if direction == "p":
+        kb = await get_my_cust_kb(user_ctx.owner_id, prefix, flt, before=anchor)
+    else:
+        kb = await get_my_cust_kb(user_ctx.owner_id, prefix, flt, after=anchor)
+    if kb is None:
+        await call.answer("Mijozlar yo'q")
+        return
+    try:
+        await call.message.edit_reply_markup(reply_markup=kb)
+    except TelegramBadRequest: pass # "message is not modified"
+    # Faqat filtr tugmalari qolgan bo'lsa - bu filtr bo'yicha hech kim yo'q
+    await call.answer("Bu filtr bo'yicha mijozlar yo'q" if len(kb.inline_keyboard) == 1 else None)
+
 @router.message(F.text == "💸 Nasiya yozish")
-async def debt_start(msg: Message, state: FSMContext):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+async def debt_start(msg: Message, state: FSMContext, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    store_owner_id = user_ctx.owner_id
     kb = await get_my_cust_kb(store_owner_id, "debt")
     if kb: await msg.answer("Kimga?", reply_markup=kb)
     else: await msg.answer("Mijozlar yo'q")
@@ -660,37 +1568,34 @@ async def debt_save(msg: Message, state: FSMContext):
     except: await msg.answer("Raqam yozing")
 
 @router.message(Form.debt_desc)
-async def debt_fin(msg: Message, state: FSMContext):
+async def debt_fin(msg: Message, state: FSMContext, user_ctx: UserContext):
     d = await state.get_data()
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+    store_owner_id = user_ctx.owner_id
     cust = await db_get_customer_if_mine(d['cid'], store_owner_id) # Verify ownership
     if cust:
-        await db_add_trans(d['cid'], d['amt'], msg.text)
-        
-        # Notify user (if linked)
+        # Notify user (if linked) - outbox orqali, fon ishchisi yuboradi
+        notify = None
         if cust[4]: 
-            try:
-                user = await db_get_user(msg.from_user.id)
-                store_name = user[5] if user else "Do'kon"
-                timestamp = datetime.now().strftime("%d.%m.%Y %H:%M")
-                await msg.bot.send_message(cust[4], 
-                    f"💸 <b>Sizga nasiya yozildi!</b>\n\n"
-                    f"🏪 <b>{store_name}</b>\n"
-                    f"💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n"
-                    f"📝 <b>Izoh:</b> {msg.text}\n"
-                    f"📅 {timestamp}\n\n"
-                    f"<i>Batafsil ma'lumot uchun botga kiring: @nasiyambot</i>", parse_mode="HTML")
-            except: pass
+            store_name = user_ctx.store_name or "Do'kon"
+            timestamp = datetime.now().strftime("%d.%m.%Y %H:%M")
+            notify = (cust[4],
+                f"💸 <b>Sizga nasiya yozildi!</b>\n\n"
+                f"🏪 <b>{store_name}</b>\n"
+                f"💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n"
+                f"📝 <b>Izoh:</b> {msg.text}\n"
+                f"📅 {timestamp}\n\n"
+                f"<i>Batafsil ma'lumot uchun botga kiring: @nasiyambot</i>")
+        await db_add_trans(d['cid'], d['amt'], msg.text, notify)
             
-        await msg.answer(f"✅ <b>Nasiya Muvaffaqiyatli Yozildi!</b>\n\n👤 <b>Mijoz:</b> {cust[1]}\n💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n📝 <b>Izoh:</b> {msg.text}", reply_markup=seller_kb, parse_mode="HTML")
+        await msg.answer(f"✅ <b>Nasiya Muvaffaqiyatli Yozildi!</b>\n\n👤 <b>Mijoz:</b> {cust[1]}\n💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n📝 <b>Izoh:</b> {msg.text}", reply_markup=seller_menu_kb(user_ctx), parse_mode="HTML")
     else:
-        await msg.answer("⚠️ Xatolik: Mijoz topilmadi.", reply_markup=seller_kb)
+        await msg.answer("⚠️ Xatolik: Mijoz topilmadi.", reply_markup=seller_menu_kb(user_ctx))
     await state.clear()
 
 @router.message(F.text == "💰 To'lov qabul qilish")
-async def pay_start(msg: Message, state: FSMContext):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+async def pay_start(msg: Message, state: FSMContext, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    store_owner_id = user_ctx.owner_id
     kb = await get_my_cust_kb(store_owner_id, "pay")
     if kb: await msg.answer("Kimdan to'lov qabul qilamiz?", reply_markup=kb)
 
@@ -712,37 +1617,33 @@ async def pay_save(msg: Message, state: FSMContext):
     except: await msg.answer("Raqam yozing")
 
 @router.message(Form.pay_desc)
-async def pay_fin(msg: Message, state: FSMContext):
+async def pay_fin(msg: Message, state: FSMContext, user_ctx: UserContext):
     d = await state.get_data()
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+    store_owner_id = user_ctx.owner_id
     cust = await db_get_customer_if_mine(d['cid'], store_owner_id)
     if cust:
-        await db_add_trans(d['cid'], -d['amt'], msg.text)
-        
-        # Notify user implicitly handled by next checking balance or explicit msg? 
-        # Usually payment notification is good.
+        # Payment notification - outbox orqali, tranzaksiya bilan birga yoziladi
+        notify = None
         if cust[4]:
-             try:
-                user = await db_get_user(msg.from_user.id)
-                store_name = user[5] if user else "Do'kon"
-                timestamp = datetime.now().strftime("%d.%m.%Y %H:%M")
-                await msg.bot.send_message(cust[4], 
-                    f"✅ <b>To'lov qabul qilindi!</b>\n\n"
-                    f"🏪 <b>{store_name}</b>\n"
-                    f"💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n"
-                    f"📝 <b>Izoh:</b> {msg.text}\n"
-                    f"📅 {timestamp}\n\n"
-                    f"<i>Sizning to'lovingiz uchun rahmat!</i>", parse_mode="HTML")
-             except: pass
+            store_name = user_ctx.store_name or "Do'kon"
+            timestamp = datetime.now().strftime("%d.%m.%Y %H:%M")
+            notify = (cust[4],
+                f"✅ <b>To'lov qabul qilindi!</b>\n\n"
+                f"🏪 <b>{store_name}</b>\n"
+                f"💰 <b>Summa:</b> {d['amt']:,.0f} so'm\n"
+                f"📝 <b>Izoh:</b> {msg.text}\n"
+                f"📅 {timestamp}\n\n"
+                f"<i>Sizning to'lovingiz uchun rahmat!</i>")
+        await db_add_trans(d['cid'], -d['amt'], msg.text, notify)
 
         new_balance = cust[3] - d['amt']
-        await msg.answer(f"✅ <b>To'lov Muvaffaqiyatli Qabul Qilindi!</b>\n\n👤 <b>Mijoz:</b> {cust[1]}\n💰 <b>To'landi:</b> {d['amt']:,.0f} so'm\n📉 <b>Qoldiq Qarz:</b> {new_balance:,.0f} so'm", reply_markup=seller_kb, parse_mode="HTML")
+        await msg.answer(f"✅ <b>To'lov Muvaffaqiyatli Qabul Qilindi!</b>\n\n👤 <b>Mijoz:</b> {cust[1]}\n💰 <b>To'landi:</b> {d['amt']:,.0f} so'm\n📉 <b>Qoldiq Qarz:</b> {new_balance:,.0f} so'm", reply_markup=seller_menu_kb(user_ctx), parse_mode="HTML")
     await state.clear()
 
 @router.message(F.text == "📊 Balansni tekshirish")
-async def check_start(msg: Message):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+async def check_start(msg: Message, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    store_owner_id = user_ctx.owner_id
     kb = await get_my_cust_kb(store_owner_id, "check")
     if kb: await msg.answer("Kimni?", reply_markup=kb)
 
@@ -787,11 +1688,11 @@ async def search_cmd(msg: Message, state: FSMContext):
     await state.set_state(Form.search_query)
 
 @router.message(Form.search_query)
-async def search_handle(msg: Message, state: FSMContext):
+async def search_handle(msg: Message, state: FSMContext, user_ctx: UserContext):
     query = msg.text.strip()
-    if not await ensure_seller(msg): return
+    if not await ensure_seller(msg, user_ctx): return
     
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+    store_owner_id = user_ctx.owner_id
     customers = await db_search_customers(store_owner_id, query)
     
     if not customers:
@@ -808,7 +1709,8 @@ async def search_handle(msg: Message, state: FSMContext):
     
     kb = InlineKeyboardMarkup(inline_keyboard=kb_builder)
     
-    await msg.answer(f"🔍 <b>Qidiruv natijalari:</b>\n\nTopildi: {len(customers)} ta mijoz.", reply_markup=kb, parse_mode="HTML")
+    found = f"{len(customers)} ta mijoz" if len(customers) < SEARCH_LIMIT else f"eng mos {SEARCH_LIMIT} ta mijoz (aniqroq yozing)"
+    await msg.answer(f"🔍 <b>Qidiruv natijalari:</b>\n\nTopildi: {found}.", reply_markup=kb, parse_mode="HTML")
     # Finish state? Or keep searching? 
     # Usually better to clear state so they can use buttons.
     # But if they want to search again? 
@@ -844,65 +1746,73 @@ async def back_to_main(msg: Message):
         await msg.answer("Bosh menyu:", reply_markup=buyer_kb)
 
 @router.message(F.text == "📈 Umumiy statistika")
-async def report(msg: Message):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
-    total = await db_get_store_total(store_owner_id)
-    
-    # Get debtors count
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT COUNT(*) FROM customers WHERE seller_id = ? AND balance > 0", (store_owner_id,)) as cur:
-            debtors_count = (await cur.fetchone())[0]
+async def report(msg: Message, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    stats = await db_get_store_stats(user_ctx.owner_id)
+    unreachable = await db_count_unreachable_debtors(user_ctx.owner_id)
             
     text = (f"📊 <b>DO'KON STATISTIKASI</b>\n\n"
-            f"💰 <b>Umumiy Nasiya:</b> {total:,.0f} so'm\n"
-            f"👥 <b>Qarzdorlar soni:</b> {debtors_count} ta\n"
+            f"💰 <b>Umumiy Nasiya:</b> {stats.total_debt:,.0f} so'm\n"
+            f"👥 <b>Qarzdorlar soni:</b> {stats.debtors_count} ta\n"
+            f"📵 <b>Botni bloklagan qarzdorlar:</b> {unreachable} ta\n"
+            f"🧾 <b>Mijozlar soni:</b> {stats.customers_count} ta\n\n"
+            f"📈 <b>Bugun yozilgan nasiya:</b> {stats.debt_today:,.0f} so'm\n"
+            f"📉 <b>Bugun qabul qilingan to'lov:</b> {stats.paid_today:,.0f} so'm\n"
             f"📅 Sana: {datetime.now().strftime('%d.%m.%Y')}")
             
     await msg.answer(text, reply_markup=reports_kb, parse_mode="HTML")
 
-async def generate_excel(data, filename):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Hisobot"
-    ws.append(["Sana", "Mijoz", "Telefon", "Summa", "Izoh", "Tur"])
-    
-    for row in data:
-        dt, name, phone, amt, desc = row
-        trans_type = "Nasiya (+)" if amt > 0 else "To'lov (-)"
-        ws.append([dt, name, phone, amt, desc, trans_type])
-        
-    wb.save(filename)
-    return filename
-
-@router.message(F.text.in_({"📅 1 Haftalik (Excel)", "📅 1 Oylik (Excel)", "📋 Barchasi (Excel)"}))
-async def send_excel_report(msg: Message):
-    if not await ensure_seller(msg): return
+@router.message(F.text.in_({"📅 1 Haftalik (Excel)", "📅 1 Oylik (Excel)", "📋 Barchasi (Excel)", "📄 Barchasi (CSV)"}))
+async def send_excel_report(msg: Message, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
     
     days = None
     if "1 Haftalik" in msg.text: days = 7
     elif "1 Oylik" in msg.text: days = 30
     
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
-    data = await db_get_transactions_report(store_owner_id, days)
-    if not data:
+    store_owner_id = user_ctx.owner_id
+    # CSV katta eksportlar uchun xlsx dan ancha arzon
+    render = render_csv if "(CSV)" in msg.text else render_xlsx
+    caption = f"📊 Hisobot: {msg.text}"
+
+    # Sana kalitda (mahalliy kun, server UTC da bo'lsa ham): haftalik/oylik oyna kun o'tishi bilan siljiydi
+    version = await db_get_store_version(store_owner_id)
+    key = (store_owner_id, days, render.__name__, version, today_local())
+    cached = report_cache.get(key)
+    if cached is not None:
+        if cached.file_id:
+            try:
+                await msg.answer_document(cached.file_id, caption=caption)
+                return
+            except TelegramBadRequest:
+                cached.file_id = None
+        sent = await msg.answer_document(BufferedInputFile(cached.result.content, cached.filename), caption=caption)
+        cached.file_id = sent.document.file_id if sent.document else None
+        return
+
+    # Bitta do'kon bir vaqtda bitta hisobot: og'ir eksport boshqalarni kutdirmasin
+    if report_workers.busy(store_owner_id):
+        await msg.answer("⏳ Oldingi hisobot hali tayyorlanmoqda, biroz kuting.")
+        return
+
+    async with report_workers.slot(store_owner_id):
+        await msg.answer("📁 Fayl tayyorlanmoqda...")
+        chunks = db_iter_transactions_report(store_owner_id, days)
+        result = await report_workers.render_stream(render, chunks)
+
+    if not result.rows:
         await msg.answer("Bu davr uchun ma'lumot yo'q.")
         return
-        
-    await msg.answer("📁 Fayl tayyorlanmoqda...")
-    filename = f"hisobot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    await generate_excel(data, filename)
-    
-    file = FSInputFile(filename)
-    await msg.answer_document(file, caption=f"📊 Hisobot: {msg.text}")
-    
-    os.remove(filename)
+    filename = f"hisobot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{result.ext}"
+    entry = report_cache.set(key, result, filename)
+    sent = await msg.answer_document(BufferedInputFile(result.content, filename), caption=caption)
+    entry.file_id = sent.document.file_id if sent.document else None
 
 @router.message(F.text == "📤 Qarzdorga xabar")
-async def msg_start(msg: Message, state: FSMContext):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
-    async with aiosqlite.connect(DB_NAME) as db:
+async def msg_start(msg: Message, state: FSMContext, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    store_owner_id = user_ctx.owner_id
+    async with db_pool.reader() as db:
         sql = "SELECT telegram_id, full_name, balance FROM customers WHERE seller_id = ? AND balance > 0 AND telegram_id IS NOT NULL"
         async with db.execute(sql, (store_owner_id,)) as cur:
             debtors = await cur.fetchall()
@@ -925,23 +1835,22 @@ async def msg_sel(call: CallbackQuery, state: FSMContext):
     await state.set_state(Form.msg_content)
 
 @router.message(Form.msg_content)
-async def msg_send(msg: Message, state: FSMContext, bot: Bot):
+async def msg_send(msg: Message, state: FSMContext, bot: Bot, user_ctx: UserContext):
     d = await state.get_data()
-    user = await db_get_user(msg.from_user.id)
-    store_name = user[5] 
+    store_name = user_ctx.store_name
     try:
         if msg.text:
             await bot.send_message(d['target'], f"✉️ <b>{store_name}</b>:\n{msg.text}", parse_mode="HTML")
         elif msg.voice:
             await bot.send_voice(d['target'], msg.voice.file_id, caption=f"📞 <b>{store_name}</b>", parse_mode="HTML")
-        await msg.answer("Yuborildi!", reply_markup=seller_kb)
+        await msg.answer("Yuborildi!", reply_markup=seller_menu_kb(user_ctx))
     except: await msg.answer("Xatolik")
     await state.clear()
 
 @router.message(F.text == "👥 A'zo odamlar")
-async def members_start(msg: Message):
-    if not await ensure_seller(msg): return
-    store_owner_id = await get_store_owner_id(msg.from_user.id)
+async def members_start(msg: Message, user_ctx: UserContext):
+    if not await ensure_seller(msg, user_ctx): return
+    store_owner_id = user_ctx.owner_id
     kb = await get_my_cust_kb(store_owner_id, "member")
     if kb: await msg.answer("A'zolar (🟢=Ulangan, ⚪️=Ulanmagan):", reply_markup=kb)
     else: await msg.answer("Hozircha a'zolar yo'q.")
@@ -981,31 +1890,28 @@ async def edit_name_start(call: CallbackQuery, state: FSMContext):
     await state.set_state(EditNameState.waiting_for_new_name)
 
 @router.message(EditNameState.waiting_for_new_name)
-async def edit_name_save(msg: Message, state: FSMContext):
+async def edit_name_save(msg: Message, state: FSMContext, user_ctx: UserContext):
     d = await state.get_data()
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE customers SET full_name = ? WHERE id = ?", (msg.text, d['cid']))
-        await db.commit()
-    await msg.answer(f"✅ Ism o'zgartirildi: {msg.text}", reply_markup=seller_kb)
+    if not await db_update_customer_name(d['cid'], user_ctx.owner_id, msg.text):
+        await msg.answer("⚠️ Xatolik: Mijoz topilmadi.", reply_markup=seller_menu_kb(user_ctx))
+        await state.clear()
+        return
+    await msg.answer(f"✅ Ism o'zgartirildi: {msg.text}", reply_markup=seller_menu_kb(user_ctx))
     await state.clear()
 
 @router.callback_query(F.data.startswith("delcust_"))
-async def delete_customer(call: CallbackQuery):
+async def delete_customer(call: CallbackQuery, user_ctx: UserContext):
     cid = int(call.data.split("_")[1])
-    store_owner_id = await get_store_owner_id(call.from_user.id)
+    store_owner_id = user_ctx.owner_id
     cust = await db_get_customer_if_mine(cid, store_owner_id)
     if not cust:
         await call.answer("Xatolik: Mijoz topilmadi")
         return
-    if cust[3] != 0:
+    if cust[3] != 0 or not await db_delete_customer(cid, store_owner_id):
         await call.answer("❌ O'chirib bo'lmaydi! Mijozning qarzi yoki haqi bor.", show_alert=True)
         return
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM customers WHERE id = ?", (cid,))
-        await db.execute("DELETE FROM transactions WHERE customer_id = ?", (cid,))
-        await db.commit()
     await call.message.delete()
-    await call.message.answer(f"✅ Mijoz ({cust[1]}) <b>butunlay o'chirildi.</b>", parse_mode="HTML", reply_markup=seller_kb)
+    await call.message.answer(f"✅ Mijoz ({cust[1]}) <b>butunlay o'chirildi.</b>", parse_mode="HTML", reply_markup=seller_menu_kb(user_ctx))
 
 @router.message(F.text == "👨‍💼 Sotuvchilar Ro'yxati")
 async def show_sellers_list(msg: Message):
@@ -1145,9 +2051,7 @@ async def perform_block(call: CallbackQuery, bot: Bot):
         await call.answer("O'zingizni bloklay olmaysiz!", show_alert=True)
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET role = 'blocked' WHERE telegram_id = ?", (target_id,))
-        await db.commit()
+    await db_block_user(target_id)
     
     try:
         await bot.send_message(target_id, "⛔️ <b>DIQQAT!</b>\n\nSizning hisobingiz Bot Administratori tomonidan bloklandi.\nQayta tiklash uchun @xzzz911 ga murojaat qiling.", parse_mode="HTML")
@@ -1159,11 +2063,7 @@ async def perform_block(call: CallbackQuery, bot: Bot):
 async def unblock_user_handler(call: CallbackQuery, bot: Bot):
     target_id = int(call.data.split("_")[1])
     
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Reset to 'client'. They must login again to regain admin/seller access. 
-        # This is safer than guessing if they were admin or owner.
-        await db.execute("UPDATE users SET role = 'client' WHERE telegram_id = ?", (target_id,))
-        await db.commit()
+    await db_unblock_user(target_id)
     
     try:
         await bot.send_message(target_id, "✅ <b>Xushxabar!</b>\n\nSiz blokdan ochildingiz. Botdan foydalanish uchun qayta kirishingiz mumkin (/start).", parse_mode="HTML")
@@ -1195,7 +2095,7 @@ async def show_cabinet_staff(msg: Message):
 
     store_owner_id = await get_store_owner_id(msg.from_user.id)
     # Get staff for this store
-    staff = await db_get_store_staff(user[5], msg.from_user.id)
+    staff = await db_get_store_staff(user[9], msg.from_user.id)
     if not staff:
         await msg.answer("Sizning do'koningizda boshqa ulangan xodimlar yo'q.", reply_markup=cabinet_kb)
         return
@@ -1268,7 +2168,7 @@ async def add_staff_save(msg: Message, state: FSMContext, bot: Bot):
     user = await db_get_user(msg.from_user.id) # Owner
     store_name = user[5]
     
-    result = await db_promote_to_staff(store_name, phone)
+    result = await db_promote_to_staff(user[9], phone)
     
     if result == "not_found":
         await msg.answer("⚠️ Foydalanuvchi topilmadi. U avval botga kirib (/start), oddiy foydalanuvchi sifatida ro'yxatdan o'tishi kerak.", reply_markup=cabinet_kb)
@@ -1300,8 +2200,7 @@ async def edit_store_name_save(msg: Message, state: FSMContext):
         
     user = await db_get_user(msg.from_user.id)
     if user:
-        old_name = user[5]
-        await db_update_store_name(old_name, new_name)
+        await db_update_store_name(user[9], new_name)
         await msg.answer(f"✅ Do'kon nomi o'zgartirildi: <b>{new_name}</b>", parse_mode="HTML", reply_markup=cabinet_kb)
     else:
         await msg.answer("Xatolik.")
@@ -1371,9 +2270,7 @@ async def block_user_save(msg: Message, state: FSMContext, bot: Bot):
         await msg.answer("O'zingizni bloklay olmaysiz!")
         return
         
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET role = 'blocked' WHERE telegram_id = ?", (target_id,))
-        await db.commit()
+    await db_block_user(target_id)
     
     # Notify user
     try:
@@ -1384,21 +2281,19 @@ async def block_user_save(msg: Message, state: FSMContext, bot: Bot):
     
     await state.clear()
 
-@router.message(F.text == "💰 Mening qarzim")
-async def my_debts(msg: Message):
-    user = await db_get_user(msg.from_user.id)
-    if user and user[4] == 'blocked':
-        await msg.answer("⛔️ Siz bloklangansiz.")
-        return
-
 @router.callback_query(F.data == "notify_all_debtors")
 async def notify_all_debtors_handler(call: CallbackQuery, bot: Bot):
     store_owner_id = await get_store_owner_id(call.from_user.id)
     if not store_owner_id:
         await call.answer("Do'kon egasi topilmadi", show_alert=True)
         return
+    key = f"s{store_owner_id}"
+    if key in broadcasts:
+        await call.answer("⏳ Eslatmalar hali yuborilmoqda.", show_alert=True)
+        return
 
-    debtors = await db_get_store_debtors(store_owner_id)
+    # Telegramga ulanmagan va botni bloklaganlar SQL da chiqarib tashlanadi
+    debtors = await db_get_store_debtors(store_owner_id, reachable=True)
     if not debtors:
         await call.answer("Xushxabar: Qarzdorlar yo'q! 🎉", show_alert=True)
         return
@@ -1406,38 +2301,38 @@ async def notify_all_debtors_handler(call: CallbackQuery, bot: Bot):
     user = await db_get_user(call.from_user.id) # Sender (could be staff or owner)
     store_name = user[5] if user else "Bizning Do'kon"
     
-    count = 0
-    await call.message.edit_text("⏳ <i>Xabarlar yuborilmoqda...</i>", parse_mode="HTML")
-    
-    for d in debtors:
-        tg_id, name, balance, phone = d
-        if not tg_id: continue # Skip if no telegram linked
-        
-        try:
-            msg_text = (f"🌸 <b>Assalomu alaykum, {name}!</b>\n\n"
-                        f"Sizga <b>{store_name}</b> do'konidan muhim eslatma:\n\n"
-                        f"Kichik qarzdorlik mavjud: <b>{balance:,.0f} so'm</b> 📉\n\n"
-                        f"<i>Imkoningiz bo'lganda to'lov qilsangiz, biz juda xursand bo'lar edik.</i>\n"
-                        f"Siz bilan ishlashdan mamnunmiz! 😊")
-            await bot.send_message(tg_id, msg_text, parse_mode="HTML")
-            count += 1
-            await asyncio.sleep(0.5) # Anti-flood
-        except: pass
-        
-    await call.message.delete()
-    await call.message.answer(
-        f"✅ <b>Xabarlar Muvaffaqiyatli Yetkazildi!</b>\n\n"
-        f"📨 Jami <b>{count} nafar</b> mijozga ushbu muloyim eslatma yuborildi.\n"
-        f"<i>Ishlaringizga rivoj tilaymiz!</i> 🚀", parse_mode="HTML")
+    messages = {}
+    for tg_id, name, balance, phone in debtors:
+        messages[tg_id] = (f"🌸 <b>Assalomu alaykum, {name}!</b>\n\n"
+                           f"Sizga <b>{store_name}</b> do'konidan muhim eslatma:\n\n"
+                           f"Kichik qarzdorlik mavjud: <b>{balance:,.0f} so'm</b> 📉\n\n"
+                           f"<i>Imkoningiz bo'lganda to'lov qilsangiz, biz juda xursand bo'lar edik.</i>\n"
+                           f"Siz bilan ishlashdan mamnunmiz! 😊", None)
+
+    async def status_text(b: Broadcast):
+        if not b.done or b.cancelled:
+            return broadcast_status_text(b)
+        unreachable = await db_count_unreachable_debtors(store_owner_id)
+        text = (f"✅ <b>Xabarlar Muvaffaqiyatli Yetkazildi!</b>\n\n"
+                f"📨 Jami <b>{b.sent} nafar</b> mijozga ushbu muloyim eslatma yuborildi.\n")
+        if unreachable:
+            text += f"📵 <b>{unreachable} nafar</b> qarzdor botni bloklagan, ularga xabar bormaydi.\n"
+        return text + "<i>Ishlaringizga rivoj tilaymiz!</i> 🚀"
+
+    # Yuborish fonda: handler darhol qaytadi, holat shu xabarda yangilanadi
+    cancel_markup = broadcast_cancel_markup(key)
+    await call.message.edit_text("⏳ <i>Xabarlar yuborilmoqda...</i>", parse_mode="HTML", reply_markup=cancel_markup)
+    on_progress = broadcast_status_updater(bot, call.message, cancel_markup, status_text)
+    start_broadcast(key, message_broadcast(bot, messages, concurrency=5, on_progress=on_progress))
+    await call.answer()
 
 async def send_daily_debtor_report(bot: Bot):
-    owners = await db_get_all_active_stores()
-    for owner_id, store_name, owner_name in owners:
-        debtors = await db_get_store_debtors(owner_id)
-        if not debtors: continue
-        
-        total_debt = sum(d[2] for d in debtors)
-        debtors_count = len(debtors)
+    # Barcha do'konlar statistikasi bitta so'rovda (store_stats), xabarlar esa
+    # umumiy cheklovchi orqali bir necha ishchi bilan bo'lib-bo'lib yuboriladi
+    messages = {}
+    for owner_id, store_name, owner_name, stats in await db_get_all_store_stats(with_debtors=True, reachable=True):
+        total_debt = stats.total_debt
+        debtors_count = stats.debtors_count
         
         text = (f"🌙 <b>XAYRLI KECH, {owner_name}!</b>\n\n"
                 f"Siz uchun <b>{store_name}</b> do'konining bugungi qisqacha hisoboti:\n\n"
@@ -1449,10 +2344,10 @@ async def send_daily_debtor_report(bot: Bot):
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text=f"✨ Barchasiga Eslatma Yuborish ({debtors_count})", callback_data="notify_all_debtors")]
         ])
-        
-        try:
-            await bot.send_message(owner_id, text, reply_markup=kb, parse_mode="HTML")
-        except: pass
+        messages[owner_id] = (text, kb)
+
+    result = await message_broadcast(bot, messages, concurrency=NIGHTLY_REPORT_WORKERS).run()
+    logging.info(f"Kechki hisobot: {result.sent} ta yuborildi, {result.blocked} bloklangan, {result.failed} xato")
 
 @router.message(F.text == "💰 Mening qarzim")
 async def my_debts(msg: Message):
@@ -1461,37 +2356,31 @@ async def my_debts(msg: Message):
         await msg.answer("⛔️ Siz bloklangansiz.")
         return
 
-    debts = await db_get_buyer_debts(msg.from_user.id)
+    debts = await db_get_buyer_debts_with_history(msg.from_user.id, 10)
     if not debts:
         await msg.answer("🎉 Sizda hech qaysi do'kondan qarz yo'q!")
         return
-    text = "📋 <b>Sizning qarzlar ro'yxatingiz:</b>\n\n"
+    blocks = ["📋 <b>Sizning qarzlar ro'yxatingiz:</b>\n"]
     total_all = 0
-    async with aiosqlite.connect(DB_NAME) as db:
-        for store_name, balance, _, cust_id in debts:
-            if balance == 0: continue
-            seller_phone_res = await db.execute("SELECT u.phone FROM customers c JOIN users u ON c.seller_id = u.telegram_id WHERE c.id = ?", (cust_id,))
-            async with seller_phone_res as cur:
-                s_row = await cur.fetchone()
-                store_contact = format_phone_display(s_row[0]) if s_row and s_row[0] else "Mavjud emas"
-            status = "🔴 Qarz" if balance > 0 else "🟢 Haq"
-            text += f"🏪 <b>{store_name}</b>\n"
-            text += f"📞 Aloqa: {store_contact}\n"
-            text += f"└ {status}: {balance:,.0f} so'm\n"
-            trans = await db_get_last_transactions(cust_id, 10)
-            if trans:
-                text += "   <i>So'nggi amaliyotlar:</i>\n"
-                for t_amt, t_desc, t_date in trans:
-                    d = t_date[:10] if t_date else ""
-                    if t_amt > 0:
-                         text += f"   • {t_desc}: {t_amt:,.0f} <i>({d})</i>\n"
-                    else:
-                         text += f"   • To'lov: {-t_amt:,.0f} <i>({d})</i>\n"
-            text += "\n"
-            total_all += balance
-    text += f"▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
-    text += f"📊 <b>Jami balans:</b> {total_all:,.0f} so'm"
-    await msg.answer(text, parse_mode="HTML")
+    for store_name, store_phone, balance, trans in debts:
+        store_contact = format_phone_display(store_phone) if store_phone else "Mavjud emas"
+        status = "🔴 Qarz" if balance > 0 else "🟢 Haq"
+        text = f"🏪 <b>{store_name}</b>\n"
+        text += f"📞 Aloqa: {store_contact}\n"
+        text += f"└ {status}: {balance:,.0f} so'm\n"
+        if trans:
+            text += "   <i>So'nggi amaliyotlar:</i>\n"
+            for t_amt, t_desc, t_date in trans:
+                d = t_date[:10] if t_date else ""
+                if t_amt > 0:
+                     text += f"   • {t_desc}: {t_amt:,.0f} <i>({d})</i>\n"
+                else:
+                     text += f"   • To'lov: {-t_amt:,.0f} <i>({d})</i>\n"
+        blocks.append(text)
+        total_all += balance
+    blocks.append(f"▬▬▬▬▬▬▬▬▬▬▬▬▬\n📊 <b>Jami balans:</b> {total_all:,.0f} so'm")
+    for chunk in chunk_blocks(blocks):
+        await msg.answer(chunk, parse_mode="HTML")
 
 @router.message(F.text == "🔄 Yangilash")
 async def refresh(msg: Message):
@@ -1503,137 +2392,157 @@ async def send_reminders(bot: Bot):
     # Making it polite too
     debtors = await db_get_all_debtors_with_store()
     for tg_id, name, balance, store in debtors:
-        try:
-            msg = (f"🌸 <b>Assalomu alaykum, {name}!</b>\n\n"
-                   f"Sizning <b>{store}</b> do'konidan <b>{balance:,.0f} so'm</b> qarzingiz bor ekan.\n"
-                   f"<i>Iltimos, vaqtingiz bo'lganda xabar oling. Rahmat!</i> 😊")
-            await bot.send_message(tg_id, msg, parse_mode="HTML")
-            await asyncio.sleep(0.5)
-        except: pass
+        msg = (f"🌸 <b>Assalomu alaykum, {name}!</b>\n\n"
+               f"Sizning <b>{store}</b> do'konidan <b>{balance:,.0f} so'm</b> qarzingiz bor ekan.\n"
+               f"<i>Iltimos, vaqtingiz bo'lganda xabar oling. Rahmat!</i> 😊")
+        await deliver(send_limiter, tg_id, lambda: bot.send_message(tg_id, msg, parse_mode="HTML"), dead=dead_chats)
 
 async def check_subscriptions(bot: Bot):
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Get all active admins (sellers/owners) who are not blocked
-        async with db.execute("SELECT telegram_id, full_name, created_at, phone, store_name FROM users WHERE role = 'admin'") as cur:
-            users = await cur.fetchall()
-
-    for u in users:
-        tg_id, name, created_at_str, phone, store_name = u
-        
-        # Parse created_at
-        try:
-            # created_at format: YYYY-MM-DD HH:MM:SS (default sqlite)
-            created_dt = datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S")
-        except:
-            continue # Skip if date format is wrong
-            
-        now = datetime.now()
-        
-        # Calculate subscription end (1 month after creation, then 2 months, etc.)
-        # Logic: If today is the same day of the month as creation day
-        # But simplistic approach: Check if (now - created_at).days % 30 == 0? 
-        # Better: Store 'subscription_end' date. But requested "har oyning shu sanasida".
-        # So if created 10th Feb, check on 10th March, 10th April...
-        
-        # Check if today is the "payment day"
-        # We need to check if today's day matches created_at day.
-        # AND we must ensure we haven't already blocked them or notified them today?
-        # The prompt says "avtomatik bloklansin". 
-        # Let's assume the user has a 1 month trial/subscription from creation.
-        # If we want RECURRING payment, we need to track "last_payment_date".
-        # Default behavior based on request: "Har oyning shu sanasida u avtomatik bloklansin"
-        # This implies they are blocked EVERY MONTH until they pay?
-        # Yes. So every month on day X, they get blocked.
-        
-        if now.day == created_dt.day and now.date() != created_dt.date(): # processing only if not registration day
-             # It is the day!
-             # We should block them.
-             
-             # Block user
-             async with aiosqlite.connect(DB_NAME) as db:
-                 await db.execute("UPDATE users SET role = 'blocked' WHERE telegram_id = ?", (tg_id,))
-                 await db.commit()
-                 
-             # Notify User
-             try:
-                 await bot.send_message(tg_id, 
-                     f"⛔️ <b>DIQQAT! OYLIK TO'LOV VAQTI KELDI</b>\n\n"
-                     f"Hurmatli <b>{name}</b>,\n"
-                     f"Sizning botdan foydalanish muddatingiz tugadi (Bugun sana: {now.strftime('%d.%m.%Y')}).\n"
-                     f"Xizmatdan foydalanishni davom ettirish uchun Bot Egasi bilan bog'laning va to'lovni amalga oshiring.\n\n"
-                     f"📞 <b>Admin:</b> @xzzz911", parse_mode="HTML")
-             except: pass
-             
-             # Notify Admin (Owner)
-             for admin_id in ADMINS:
-                 try:
-                     await bot.send_message(admin_id,
-                         f"💸 <b>TO'LOV VAQTI KELDI! (AUTO-BLOCK)</b>\n\n"
-                         f"👤 <b>Mijoz:</b> {name}\n"
-                         f"🏪 <b>Do'kon:</b> {store_name}\n"
-                         f"📞 <b>Aloqa:</b> {phone}\n"
-                         f"⏳ <b>Ro'yxatdan o'tgan:</b> {created_at_str}\n\n"
-                         f"🛑 <b>Status:</b> Tizim tomonidan BLOKLANDI.\n"
-                         f"<i>To'lov qabul qilingach, \"Bloklash bo'limi\" orqali faollashtiring.</i>", parse_mode="HTML")
-                 except: pass
+    # Obuna muddati (subscription_until) tugagan sotuvchilarni bloklash
+    expired = await db_block_expired_subscriptions()
+    if not expired:
+        return
+    today = today_local()
+
+    for tg_id, name, phone, store_name, until in expired:
+        text = (f"⛔️ <b>DIQQAT! OYLIK TO'LOV VAQTI KELDI</b>\n\n"
+                f"Hurmatli <b>{name}</b>,\n"
+                f"Sizning botdan foydalanish muddatingiz tugadi (Bugun sana: {today.strftime('%d.%m.%Y')}).\n"
+                f"Xizmatdan foydalanishni davom ettirish uchun Bot Egasi bilan bog'laning va to'lovni amalga oshiring.\n\n"
+                f"📞 <b>Admin:</b> @xzzz911")
+        await deliver(send_limiter, tg_id, lambda: bot.send_message(tg_id, text, parse_mode="HTML"), dead=dead_chats)
+
+    # Bot egasiga bitta umumiy xabar (har bir sotuvchi uchun alohida emas)
+    blocks = [f"👤 <b>{name}</b> (ID: <code>{tg_id}</code>)\n"
+              f"🏪 {store_name or '-'} | 📞 {phone or '-'} | ⏳ {until}"
+              for tg_id, name, phone, store_name, until in expired]
+    header = (f"💸 <b>TO'LOV VAQTI KELDI! (AUTO-BLOCK)</b>\n\n"
+              f"🛑 Tizim tomonidan <b>{len(expired)} ta</b> sotuvchi bloklandi:")
+    footer = "<i>To'lov qabul qilingach: /renew &lt;ID&gt; [oylar soni]</i>"
+    for admin_id in ADMINS:
+        for part in chunk_blocks([header, *blocks, footer]):
+            await deliver(send_limiter, admin_id, lambda: bot.send_message(admin_id, part, parse_mode="HTML"))
+
+@router.message(Command("renew"))
+async def renew_cmd(msg: Message):
+    # /renew <telegram_id> [oylar] - obunani uzaytirish (faqat bot egasi)
+    is_owner = msg.from_user.id in ADMINS or (msg.from_user.username in ADMIN_USERNAMES)
+    if not is_owner: return
+    args = (msg.text or "").split()[1:]
+    try:
+        tg_id = int(args[0])
+        months = int(args[1]) if len(args) > 1 else 1
+        if not 1 <= months <= 24: raise ValueError
+    except (IndexError, ValueError):
+        await msg.answer("Foydalanish: /renew &lt;telegram_id&gt; [oylar soni, 1-24]", parse_mode="HTML")
+        return
+    until = await db_renew_subscription(tg_id, months)
+    if until is None:
+        await msg.answer("Foydalanuvchi topilmadi.")
+        return
+    if until == "blocked":
+        await msg.answer(f"⛔️ ID {tg_id} qo'lda bloklangan, obuna uzaytirilmadi. Avval blokdan oching.")
+        return
+    if until == "not_seller":
+        await msg.answer(f"⚠️ ID {tg_id} sotuvchi emas, obuna uzaytirilmadi.")
+        return
+    await msg.answer(f"✅ ID {tg_id} obunasi {until.strftime('%d.%m.%Y')} gacha uzaytirildi.")
+    await deliver(send_limiter, tg_id, lambda: msg.bot.send_message(
+        tg_id, f"✅ <b>Obunangiz uzaytirildi!</b>\n\n📅 Amal qilish muddati: <b>{until.strftime('%d.%m.%Y')}</b>",
+        parse_mode="HTML"), dead=dead_chats)
 
 async def send_backup(bot: Bot):
+    # Izchil nusxa (backup API) + gzip + bo'laklar, og'ir ish alohida threadda
     try:
-        # Send DB file to the Main Admin (first one in ADMINS)
-        super_admin_id = ADMINS[0] 
-        backup_file = FSInputFile(DB_NAME)
-        caption = (f"💾 <b>RAQAMLI OLTIN ZAXIRANGIZ</b>\n\n"
+        target, manifest = await asyncio.to_thread(create_backup, DB_NAME, BACKUP_DIR, BACKUP_KEEP)
+    except Exception as e:
+        logging.error(f"Backup error: {e}")
+        return
+
+    # Send DB parts to the Main Admin (first one in ADMINS)
+    super_admin_id = ADMINS[0]
+    parts = manifest["parts"]
+    for i, part in enumerate(parts, 1):
+        caption = (f"💾 <b>RAQAMLI OLTIN ZAXIRANGIZ</b> ({i}/{len(parts)})\n\n"
                    f"📅 <b>Sana:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-                   f"🔒 <b>Hajmi:</b> {os.path.getsize(DB_NAME) / 1024:.2f} KB\n\n"
+                   f"🔒 <b>Hajmi:</b> {manifest['db_size'] / 1024:.2f} KB (siqilgan: {part['size'] / 1024:.2f} KB)\n"
+                   f"🔑 <b>sha256:</b> <code>{part['sha256'][:16]}</code>\n\n"
                    f"<i>Ma'lumotlaringiz xavfsiz joyda!</i> 🛡")
-        
-        await bot.send_document(super_admin_id, backup_file, caption=caption, parse_mode="HTML")
+        try:
+            await bot.send_document(super_admin_id, FSInputFile(os.path.join(target, part["name"])),
+                                    caption=caption, parse_mode="HTML")
+        except Exception as e:
+            logging.error(f"Backup error: {e}")
+            return
+    try:
+        await bot.send_document(super_admin_id, FSInputFile(os.path.join(target, "manifest.json")),
+                                caption="📋 Tiklash: <code>python backup.py restore &lt;papka&gt; &lt;baza.db&gt;</code>",
+                                parse_mode="HTML")
     except Exception as e:
         logging.error(f"Backup error: {e}")
 
-async def scheduler(bot: Bot):
-    sent_reminders = False
-    checked_subs = False
-    sent_backup = False
-    
-    while True:
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
-        
-        # New 20:00 Logic (Daily Report)
-        if current_time == "20:00":
-            if not sent_reminders:
-                await send_daily_debtor_report(bot)
-                sent_reminders = True
-        else:
-            sent_reminders = False
-            
-        # Subscription Check (09:00)
-        if current_time == "09:00":
-             if not checked_subs:
-                 await check_subscriptions(bot)
-                 checked_subs = True
-        else:
-            checked_subs = False
-
-        # Backup (23:00)
-        if current_time == "23:00":
-            if not sent_backup:
-                await send_backup(bot)
-                sent_backup = True
-        else:
-            sent_backup = False
-            
-        await asyncio.sleep(30)
+# Vaqtli vazifalar: (nomi, soat Toshkent vaqti bilan, funksiya(bot))
+SCHEDULED_JOBS = [
+    ("daily_debtor_report", "20:00", send_daily_debtor_report),
+    ("check_subscriptions", "09:00", check_subscriptions),
+    ("backup", "23:00", send_backup),
+]
 
 async def main():
+    webhook_mode = BOT_MODE == "webhook"
+    if webhook_mode and not WEBHOOK_SECRET:
+        logging.error("BOT_MODE=webhook uchun WEBHOOK_SECRET berilishi shart")
+        return
     await init_db()
     bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=fsm_storage)
+    bot.session.middleware(BotApiMetricsMiddleware(api_seconds, api_errors))
+    if tracer:
+        tracer.install(ledger_queue)
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+        router.message.middleware(TraceHandlerMiddleware())
+        router.callback_query.middleware(TraceHandlerMiddleware())
+    router.message.middleware(HandlerMetricsMiddleware(handler_seconds, handler_errors))
+    router.callback_query.middleware(HandlerMetricsMiddleware(handler_seconds, handler_errors))
+    router.message.middleware(UserContextMiddleware())
+    router.callback_query.middleware(UserContextMiddleware())
+    dp.update.outer_middleware(ChatAliveMiddleware())
     dp.include_router(router)
-    asyncio.create_task(scheduler(bot))
-    print("Bot v8.3 (Clean Rebuild) ishga tushdi...")
-    await dp.start_polling(bot)
+    outbox_worker.start(bot)
+    for name, at, fn in SCHEDULED_JOBS:
+        job_scheduler.add(name, at, tracer.wrap_job(name, fn) if tracer else fn)
+    await job_scheduler.start(bot)
+    if webhook_mode:
+        app = make_app(dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, metrics=metrics)
+    else:
+        app = make_app(metrics=metrics)
+    runner = await start_server(app, PORT)
+    print(f"Bot v8.3 (Clean Rebuild) ishga tushdi ({BOT_MODE})...")
+    try:
+        if webhook_mode:
+            if WEBHOOK_URL:
+                await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                      allowed_updates=dp.resolve_used_update_types())
+            await wait_for_signal()
+        else:
+            # Oldin webhook rejimida ishlagan bo'lsa, getUpdates ishlashi uchun
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await runner.cleanup()
+        report_workers.shutdown()
+        await close_db()
+
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats_cmd(msg: Message):
+    # Bot egasi uchun: store_stats ni noldan qayta hisoblash va tekshirish
+    is_owner = msg.from_user.id in ADMINS or (msg.from_user.username in ADMIN_USERNAMES)
+    if not is_owner: return
+    mismatched = await db_rebuild_store_stats()
+    if mismatched:
+        await msg.answer(f"⚠️ Statistika qayta hisoblandi. {mismatched} ta do'kon ma'lumoti mos kelmagan edi va tuzatildi.")
+    else:
+        await msg.answer("✅ Statistika qayta hisoblandi, barcha do'konlar ma'lumoti to'g'ri.")
 
 @router.message(F.text == "📢 Xabar yuborish")
 async def broadcast_start(msg: Message, state: FSMContext):
@@ -1642,31 +2551,100 @@ async def broadcast_start(msg: Message, state: FSMContext):
     await msg.answer("📢 Barcha foydalanuvchilarga yuboriladigan xabarni kiriting (Rasm, Video yoki Matn):", reply_markup=cancel_kb)
     await state.set_state(Form.broadcast_msg)
 
+def broadcast_status_text(b: Broadcast):
+    if b.done:
+        title = "🛑 <b>Yuborish to'xtatildi</b>" if b.cancelled else "✅ <b>Yuborish yakunlandi</b>"
+    else:
+        title = "⏳ <b>Xabar yuborilmoqda...</b>"
+    return (f"{title}\n\n"
+            f"📨 Yuborildi: {b.sent}\n"
+            f"🚫 Botni bloklagan: {b.blocked}\n"
+            f"⚠️ Xatolik: {b.failed}")
+
+# --- Fondagi ommaviy yuborishlar ---
+# broadcasts kaliti: "a<xabar ID>" - admin xabari, "s<ega ID>" - do'kon
+# qarzdorlariga eslatma (bitta do'konda bir vaqtda bittasi).
+
+def message_broadcast(bot, messages, concurrency, on_progress=None):
+    # messages: chat_id -> (HTML matn, klaviatura yoki None)
+    async def recipients():
+        for chat_id in messages:
+            yield chat_id
+
+    async def send(chat_id):
+        text, kb = messages[chat_id]
+        await bot.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML")
+
+    return Broadcast(recipients(), send, send_limiter, concurrency=concurrency, on_progress=on_progress, dead=dead_chats)
+
+def broadcast_cancel_markup(key):
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🛑 To'xtatish", callback_data=f"bc_cancel:{key}")
+    ]])
+
+def broadcast_status_updater(bot, status_msg, cancel_markup, status_text=None):
+    # Broadcast.on_progress: holat xabarini (o'zgargan bo'lsa) yangilaydi,
+    # tugaganda "To'xtatish" tugmasi olib tashlanadi
+    last_text = [None]
+
+    async def on_progress(b: Broadcast):
+        text = await status_text(b) if status_text else broadcast_status_text(b)
+        if text == last_text[0] and not b.done:
+            return
+        last_text[0] = text
+        try:
+            await bot.edit_message_text(text, chat_id=status_msg.chat.id, message_id=status_msg.message_id,
+                                        parse_mode="HTML", reply_markup=None if b.done else cancel_markup)
+        except TelegramBadRequest:
+            pass # "message is not modified"
+
+    return on_progress
+
+def start_broadcast(key, broadcast):
+    task = asyncio.create_task(broadcast.run())
+    broadcasts[key] = (broadcast, task)
+    task.add_done_callback(lambda _: broadcasts.pop(key, None))
+    return task
+
 @router.message(Form.broadcast_msg)
 async def broadcast_send(msg: Message, state: FSMContext, bot: Bot):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT telegram_id FROM users") as cur:
-            users = await cur.fetchall()
-    
-    count = 0
-    status_msg = await msg.answer("⏳ Xabar yuborilmoqda...")
-    for u in users:
-        try:
-            if msg.text:
-                await bot.send_message(u[0], msg.text)
-            elif msg.photo:
-                await bot.send_photo(u[0], msg.photo[-1].file_id, caption=msg.caption)
-            elif msg.video:
-                await bot.send_video(u[0], msg.video.file_id, caption=msg.caption)
-            count += 1
-            await asyncio.sleep(0.05)
-        except:
-            pass
-    
-    await status_msg.delete()
-    await msg.answer(f"✅ Xabar {count} ta foydalanuvchiga muvaffaqiyatli yuborildi!", reply_markup=owner_kb)
+    if not (msg.text or msg.photo or msg.video):
+        await msg.answer("Faqat matn, rasm yoki video yuborish mumkin.")
+        return
     await state.clear()
 
+    async def send(chat_id):
+        if msg.text:
+            await bot.send_message(chat_id, msg.text)
+        elif msg.photo:
+            await bot.send_photo(chat_id, msg.photo[-1].file_id, caption=msg.caption)
+        elif msg.video:
+            await bot.send_video(chat_id, msg.video.file_id, caption=msg.caption)
+
+    key = f"a{msg.message_id}"
+    cancel_markup = broadcast_cancel_markup(key)
+    status_msg = await msg.answer("⏳ <b>Xabar yuborilmoqda...</b>", parse_mode="HTML", reply_markup=cancel_markup)
+    on_progress = broadcast_status_updater(bot, status_msg, cancel_markup)
+    broadcast = Broadcast(db_iter_user_ids(), send, send_limiter,
+                          concurrency=BROADCAST_WORKERS, on_progress=on_progress, dead=dead_chats)
+    start_broadcast(key, broadcast)
+    await msg.answer("Xabar fon rejimida yuborilmoqda, holati yuqorida yangilanib turadi.", reply_markup=owner_kb)
+
+@router.callback_query(F.data.startswith("bc_cancel:"))
+async def broadcast_cancel(call: CallbackQuery):
+    key = call.data.split(":", 1)[1]
+    if key.startswith("s"):
+        allowed = str(await get_store_owner_id(call.from_user.id)) == key[1:]
+    else:
+        allowed = call.from_user.id in ADMINS or (call.from_user.username in ADMIN_USERNAMES)
+    if not allowed: return
+    entry = broadcasts.get(key)
+    if entry is None:
+        await call.answer("Bu yuborish allaqachon tugagan.", show_alert=True)
+        return
+    entry[0].cancel()
+    await call.answer("To'xtatilmoqda...")
+
 @router.message(F.text == "✉️ Sotuvchiga xabar")
 async def seller_msg_start(msg: Message, state: FSMContext):
     is_owner = msg.from_user.id in ADMINS or (msg.from_user.username in ADMIN_USERNAMES)
@@ -1716,6 +2694,5 @@ async def seller_msg_send(msg: Message, state: FSMContext, bot: Bot):
 
 if __name__ == "__main__":
     try: 
-        keep_alive() # Start web server for uptime monitors
         asyncio.run(main())
     except: pass
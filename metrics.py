@@ -0,0 +1,214 @@
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# -----------------------------------------------------------------------------
+# METRIKALAR (Prometheus matn formati)
+# -----------------------------------------------------------------------------
+# Tashqi kutubxonasiz kichik registr: Counter, Histogram va o'qish paytida
+# hisoblanadigan gauge lar. Yozish - bitta dict qidiruv va bir nechta
+# qo'shish (lock kerak emas, hammasi bitta event loop da). /metrics so'ralganda
+# registr matnga aylantiriladi.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket hisoblagichlari..., sum, count]
+
+    def observe(self, value, *labels):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        # bisect_left: qiymat chegaraga teng bo'lsa shu bucket ga (le - "<=")
+        row[bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def samples(self):
+        bounds = self.buckets + (float("inf"),)
+        for labels, row in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, row):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(row[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {row[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, collect, labelnames=()):
+        # collect() - so'rov paytida chaqiriladi (oddiy yoki async funksiya).
+        # Qaytaradi: son yoki {label qiymatlari kortej: son} lug'ati.
+        self._collectors.append((name, help, tuple(labelnames), collect))
+
+    async def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for name, help, labelnames, collect in self._collectors:
+            try:
+                value = collect()
+                if inspect.isawaitable(value):
+                    value = await value
+            except Exception as e:
+                logging.warning(f"Metrika {name} hisoblanmadi: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_number(v)}")
+            else:
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+# O'LCHOVCHILAR
+# -----------------------------------------------------------------------------
+
+def timed(histogram, errors, label):
+    # Korutina funksiyani o'raydi: davomiylik histogram ga, xatolar errors ga.
+    # Async generator uchun vaqt iteratsiya boshidan oxirigacha (yoki aclose
+    # gacha) o'lchanadi - iste'molchi bo'laklar orasida sarflagan vaqt ham ichida.
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def gen_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                agen = fn(*args, **kwargs)
+                try:
+                    async for item in agen:
+                        yield item
+                except Exception:
+                    errors.inc(label)
+                    raise
+                finally:
+                    await agen.aclose()
+                    histogram.observe(time.perf_counter() - started, label)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                errors.inc(label)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return wrapper
+    return decorator
+
+
+def instrument_functions(namespace, prefix, histogram, errors):
+    # Modul darajasidagi `prefix*` korutina va async generator funksiyalarini
+    # o'lchanadigan versiyasi bilan almashtiradi. Chaqiruvlar global nom orqali
+    # bo'lgani uchun barcha joylar avtomatik o'lchanadi.
+    for name, fn in list(namespace.items()):
+        if name.startswith(prefix) and (inspect.iscoroutinefunction(fn) or inspect.isasyncgenfunction(fn)):
+            namespace[name] = timed(histogram, errors, name)(fn)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Router observer iga inner middleware sifatida ulanadi - faqat mos kelgan
+    # handler uchun ishlaydi, data["handler"] orqali uning nomi olinadi.
+    def __init__(self, histogram, errors):
+        self.histogram = histogram
+        self.errors = errors
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(name)
+            raise
+        finally:
+            self.histogram.observe(time.perf_counter() - started, name)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    # bot.session.middleware(...) - har bir Bot API so'rovi
+    def __init__(self, histogram, errors):
+        self.histogram = histogram
+        self.errors = errors
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.histogram.observe(time.perf_counter() - started, name)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+
+from sender import alive_sql, deliver
+
+# -----------------------------------------------------------------------------
+# OUTBOX (CHIQUVCHI XABARLAR NAVBATI)
+# -----------------------------------------------------------------------------
+# Mijozga boradigan bildirishnomalar daftar yozuvi bilan bitta tranzaksiyada
+# outbox jadvaliga yoziladi (enqueue). Fon ishchisi ularni o'qib yuboradi:
+# muvaffaqiyatli bo'lsa o'chiradi, xato bo'lsa keyinroq qayta urinadi.
+# Jadval bazada turgani uchun bot qayta ishga tushsa ham xabarlar yo'qolmaydi
+# (kamdan-kam holda bitta xabar ikki marta borishi mumkin).
+
+OUTBOX_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        parse_mode TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at)",
+]
+
+
+async def enqueue(db, chat_id, text, parse_mode="HTML"):
+    # Chaqiruvchining tranzaksiyasi ichida ishlaydi, commit() qilmaydi.
+    # Botni bloklagan chatlarga (dead_chats) xabar navbatga qo'yilmaydi.
+    await db.execute(
+        f"INSERT INTO outbox (chat_id, text, parse_mode, next_attempt_at) SELECT ?, ?, ?, ? WHERE {alive_sql('?')}",
+        (chat_id, text, parse_mode, time.time(), chat_id),
+    )
+
+
+def backoff(attempts):
+    # 10 s, 20 s, 40 s, ... ko'pi bilan 1 soat
+    return min(10 * 2 ** (attempts - 1), 3600)
+
+
+class OutboxWorker:
+    def __init__(self, pool, limiter, batch=50, max_attempts=8, dead=None):
+        self.pool = pool
+        self.limiter = limiter
+        self.dead = dead
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self._wake = asyncio.Event()
+        self._task = None
+        self._bot = None
+
+    def start(self, bot):
+        if self._task is None:
+            self._bot = bot
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def pending(self):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT COUNT(*) FROM outbox") as cur:
+                return (await cur.fetchone())[0]
+
+    async def _due(self):
+        async with self.pool.reader() as db:
+            sql = "SELECT id, chat_id, text, parse_mode, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?"
+            async with db.execute(sql, (time.time(), self.batch)) as cur:
+                rows = await cur.fetchall()
+            async with db.execute("SELECT MIN(next_attempt_at) FROM outbox") as cur:
+                next_at = (await cur.fetchone())[0]
+        return rows, next_at
+
+    async def _send(self, row):
+        msg_id, chat_id, text, parse_mode, attempts = row
+        status = await deliver(self.limiter, chat_id,
+                               lambda: self._bot.send_message(chat_id, text, parse_mode=parse_mode),
+                               dead=self.dead)
+        return msg_id, chat_id, attempts, status
+
+    async def _ack(self, results):
+        done, retry = [], []
+        for msg_id, chat_id, attempts, status in results:
+            if status == "failed" and attempts + 1 < self.max_attempts:
+                retry.append((time.time() + backoff(attempts + 1), msg_id))
+                continue
+            if status != "sent":
+                logging.warning(f"Outbox: xabar {msg_id} ({chat_id}) yetkazilmadi, holat: {status}")
+            done.append((msg_id,))
+        async with self.pool.writer() as db:
+            await db.executemany("DELETE FROM outbox WHERE id = ?", done)
+            await db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?", retry)
+
+    async def _run(self):
+        while True:
+            # wake() _due() dan keyin kelsa ham yo'qolmasligi uchun oldin tozalanadi
+            self._wake.clear()
+            try:
+                rows, next_at = await self._due()
+                if rows:
+                    results = await asyncio.gather(*(self._send(r) for r in rows))
+                    await self._ack(results)
+                    continue
+                timeout = 60 if next_at is None else min(60, max(0.5, next_at - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Outbox ishchisi xatosi: {e}")
+                timeout = 5
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,199 @@
+import asyncio
+import csv
+import gzip
+import io
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import openpyxl
+
+# -----------------------------------------------------------------------------
+# HISOBOT FAYLLARI
+# -----------------------------------------------------------------------------
+# Fayl yasash (openpyxl) sinxron va og'ir ish, shuning uchun u event loop da
+# emas, cheklangan thread pool da bajariladi. Natija diskka yozilmaydi -
+# xotiradagi bufer baytlari qaytariladi (BufferedInputFile uchun).
+
+REPORT_HEADER = ["Sana", "Mijoz", "Telefon", "Summa", "Izoh", "Tur"]
+CSV_GZIP_BYTES = 5 * 1024 * 1024  # Bundan katta CSV gzip bilan siqiladi
+
+# content - fayl baytlari, rows - yozilgan qatorlar soni, ext - fayl kengaytmasi
+Rendered = namedtuple("Rendered", "content rows ext")
+
+
+def report_row(row):
+    dt, name, phone, amt, desc = row
+    trans_type = "Nasiya (+)" if amt > 0 else "To'lov (-)"
+    return [dt, name, phone, amt, desc, trans_type]
+
+
+def render_xlsx(rows):
+    # write_only rejimida qatorlar xotirada hujayra obyektlari sifatida
+    # to'planmaydi, to'g'ridan-to'g'ri faylga yoziladi
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Hisobot")
+    ws.append(REPORT_HEADER)
+    count = 0
+    for row in rows:
+        ws.append(report_row(row))
+        count += 1
+    buf = io.BytesIO()
+    wb.save(buf)
+    return Rendered(buf.getvalue(), count, "xlsx")
+
+
+def render_csv(rows):
+    # utf-8-sig: Excel kirill/lotin harflarni to'g'ri ochishi uchun BOM bilan
+    buf = io.BytesIO()
+    text = io.TextIOWrapper(buf, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(REPORT_HEADER)
+    count = 0
+    for row in rows:
+        writer.writerow(report_row(row))
+        count += 1
+    text.flush()
+    content = buf.getvalue()
+    if len(content) > CSV_GZIP_BYTES:
+        return Rendered(gzip.compress(content), count, "csv.gz")
+    return Rendered(content, count, "csv")
+
+
+_END = object()
+
+
+def _drain(q, loop):
+    # Thread tomoni: asyncio navbatidan bo'laklarni olib (kutib), qatorma-qator beradi
+    while True:
+        chunk = asyncio.run_coroutine_threadsafe(q.get(), loop).result()
+        if chunk is _END:
+            return
+        yield from chunk
+
+
+class ReportWorkers:
+    # workers - bir vaqtda ishlaydigan fayl yasovchilar soni (butun bot uchun)
+    # per_store - bitta do'kon bir vaqtda nechta hisobot so'ray oladi
+    def __init__(self, workers=2, per_store=1):
+        self.workers = workers
+        self.per_store = per_store
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._slots = {}
+        # Umumiy eksport sloti: bazadan o'qiyotgan eksportlar soni thread lar
+        # sonidan oshmaydi (navbatdagilar kursor ochmasdan kutadi)
+        self._exports = asyncio.Semaphore(workers)
+
+    def busy(self, store_id):
+        sem = self._slots.get(store_id)
+        return sem is not None and sem.locked()
+
+    @asynccontextmanager
+    async def slot(self, store_id):
+        sem = self._slots.get(store_id)
+        if sem is None:
+            sem = self._slots[store_id] = asyncio.Semaphore(self.per_store)
+        async with sem, self._exports:
+            yield
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    async def render_stream(self, fn, chunks):
+        # `chunks` - qator bo'laklarini beruvchi async iterator. Bo'laklar
+        # kichik asyncio navbati orqali threadga uzatiladi: navbat to'lsa
+        # manba kutadi (polling siz), xotirada bir vaqtda bir nechta bo'lak turadi.
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize=4)
+        fut = loop.run_in_executor(self._pool, fn, _drain(q, loop))
+
+        async def put(item):
+            if fut.done():
+                return
+            if not q.full():
+                q.put_nowait(item)
+                return
+            # Thread xato bilan to'xtasa navbat bo'shamaydi - uni ham kutamiz
+            waiter = asyncio.ensure_future(q.put(item))
+            await asyncio.wait({waiter, fut}, return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                waiter.cancel()
+
+        try:
+            async for chunk in chunks:
+                await put(chunk)
+                if fut.done():
+                    break
+        finally:
+            await put(_END)
+            # Manba (masalan, bazadagi kursor) erta to'xtasa ham yopilsin
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return await fut
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# -----------------------------------------------------------------------------
+# HISOBOT KESHI
+# -----------------------------------------------------------------------------
+# Kalit: (do'kon, davr, format, ma'lumot versiyasi, sana). Versiya o'zgarmagan
+# bo'lsa fayl qayta yasalmaydi va Telegramga qayta yuklanmaydi - birinchi
+# yuborishdan olingan file_id bilan jo'natiladi. Yozuvlar umumiy hajm
+# (max_bytes) va yosh (ttl) bo'yicha chiqarib yuboriladi.
+
+class CachedReport:
+    __slots__ = ("result", "filename", "file_id", "expires_at")
+
+    def __init__(self, result, filename, expires_at):
+        self.result = result
+        self.filename = filename
+        self.file_id = None
+        self.expires_at = expires_at
+
+
+class ReportCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=6 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _drop(self, key):
+        entry = self._data.pop(key)
+        self.size -= len(entry.result.content)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._drop(key)
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def set(self, key, result, filename):
+        # Kalitning oxirgi ikki qismi (versiya, sana) - shu hisobotning eski
+        # nusxalari endi kerak emas
+        for old in [k for k in self._data if k[:-2] == key[:-2]]:
+            self._drop(old)
+        entry = CachedReport(result, filename, time.monotonic() + self.ttl)
+        if len(result.content) > self.max_bytes:
+            return entry
+        self._data[key] = entry
+        self.size += len(result.content)
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._data)))
+        return entry
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# -----------------------------------------------------------------------------
+# VAQTLI VAZIFALAR (SCHEDULER)
+# -----------------------------------------------------------------------------
+# Har bir vazifa kuniga bir marta belgilangan soatda (berilgan vaqt zonasida)
+# ishga tushadi. Navbatdagi ishga tushish vaqtlari heap da saqlanadi va
+# scheduler aynan eng yaqin vaqtgacha uxlaydi. Oxirgi bajarilgan slot job_runs
+# jadvalida saqlanadi: bot o'chib qolgan paytda o'tib ketgan ish qayta ishga
+# tushganda (catch_up muddati ichida bo'lsa) bir marta bajariladi.
+# Tarixi yo'q vazifa (birinchi deploy) uchun faqat qisqa first_run_grace
+# oynasi amal qiladi: kechki hisobot ertalabki deployda yuborilib ketmasin.
+
+JOB_RUNS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS job_runs (
+        name TEXT PRIMARY KEY,
+        last_slot TEXT,
+        last_started_at TEXT,
+        last_duration REAL,
+        last_error TEXT,
+        runs INTEGER NOT NULL DEFAULT 0,
+        overlaps INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+
+class Job:
+    def __init__(self, name, at, fn, catch_up=timedelta(hours=12), first_run_grace=timedelta(minutes=15)):
+        self.name = name
+        hour, minute = map(int, at.split(":"))
+        self.hour = hour
+        self.minute = minute
+        self.fn = fn
+        self.catch_up = catch_up  # None - o'tib ketgan slot bajarilmaydi
+        self.first_run_grace = first_run_grace  # job_runs da yozuv bo'lmaganda, None - bajarilmaydi
+        self.last_slot = None
+        self.last_duration = None
+        self.runs = 0
+        self.overlaps = 0
+        self.running = None  # bajarilayotgan asyncio.Task
+
+    def slot_on(self, day, tz):
+        return datetime(day.year, day.month, day.day, self.hour, self.minute, tzinfo=tz)
+
+    def next_slot(self, after, tz):
+        slot = self.slot_on(after.date(), tz)
+        if slot <= after:
+            slot = self.slot_on(after.date() + timedelta(days=1), tz)
+        return slot
+
+    def prev_slot(self, now, tz):
+        slot = self.slot_on(now.date(), tz)
+        if slot > now:
+            slot = self.slot_on(now.date() - timedelta(days=1), tz)
+        return slot
+
+    def first_slot(self, now, tz):
+        # Ishga tushgandagi birinchi slot: bajarilmagan o'tgan slot catch_up
+        # ichida bo'lsa - o'sha, aks holda keyingisi. Tarixi yo'q vazifa
+        # (birinchi deploy, job_runs bo'sh) faqat first_run_grace ichida.
+        prev = self.prev_slot(now, tz)
+        if self.last_slot is None:
+            window = self.first_run_grace
+        elif self.last_slot < prev:
+            window = self.catch_up
+        else:
+            window = None
+        if window is not None and self.catch_up is not None and now - prev <= min(window, self.catch_up):
+            return prev
+        return self.next_slot(now, tz)
+
+
+class Scheduler:
+    def __init__(self, pool, tz="Asia/Tashkent"):
+        self.pool = pool
+        self.tz = ZoneInfo(tz)
+        self.jobs = {}
+        self._heap = []
+        self._seq = 0
+        self._task = None
+        self._args = ()
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def add(self, name, at, fn, **kwargs):
+        self.jobs[name] = Job(name, at, fn, **kwargs)
+
+    def _push(self, slot, job):
+        self._seq += 1
+        heapq.heappush(self._heap, (slot, self._seq, job))
+
+    async def _load(self):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT name, last_slot, last_duration, runs, overlaps FROM job_runs") as cur:
+                rows = await cur.fetchall()
+        for name, last_slot, last_duration, runs, overlaps in rows:
+            job = self.jobs.get(name)
+            if job is None:
+                continue
+            job.last_slot = datetime.fromisoformat(last_slot) if last_slot else None
+            job.last_duration = last_duration
+            job.runs = runs
+            job.overlaps = overlaps
+
+    async def start(self, *args):
+        # args - har bir vazifa funksiyasiga uzatiladi (masalan, bot)
+        if self._task is not None:
+            return
+        self._args = args
+        await self._load()
+        now = self.now()
+        for job in self.jobs.values():
+            slot = job.first_slot(now, self.tz)
+            if slot <= now:
+                logging.info(f"Scheduler: '{job.name}' {slot:%d.%m %H:%M} dagi ishi o'tkazib yuborilgan, hozir bajariladi")
+            self._push(slot, job)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._heap = []
+        for job in self.jobs.values():
+            if job.running is not None and not job.running.done():
+                job.running.cancel()
+
+    async def _run(self):
+        while self._heap:
+            slot, _, job = self._heap[0]
+            delay = (slot - self.now()).total_seconds()
+            if delay > 0:
+                # Soat siljishi yoki uzoq uyqudan keyin ham aniq bo'lishi
+                # uchun ko'pi bilan 1 soat uxlab, qayta hisoblaymiz
+                await asyncio.sleep(min(delay, 3600))
+                continue
+            heapq.heappop(self._heap)
+            self._push(job.next_slot(max(slot, self.now()), self.tz), job)
+            if job.running is not None and not job.running.done():
+                job.overlaps += 1
+                logging.warning(f"Scheduler: '{job.name}' oldingi ishi hali tugamagan, {slot:%d.%m %H:%M} o'tkazib yuborildi")
+                await self._save(job, slot=None)
+                continue
+            job.running = asyncio.create_task(self._execute(job, slot))
+
+    async def _execute(self, job, slot):
+        started = time.monotonic()
+        started_at = self.now()
+        error = None
+        try:
+            await job.fn(*self._args)
+        except Exception as e:
+            error = str(e)
+            logging.error(f"Scheduler: '{job.name}' xatosi: {e}")
+        job.last_duration = time.monotonic() - started
+        job.last_slot = slot
+        job.runs += 1
+        logging.info(f"Scheduler: '{job.name}' {job.last_duration:.1f} s da bajarildi")
+        await self._save(job, slot=slot, started_at=started_at, error=error)
+
+    async def _save(self, job, slot, started_at=None, error=None):
+        sql = """
+            INSERT INTO job_runs (name, last_slot, last_started_at, last_duration, last_error, runs, overlaps)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                last_slot = COALESCE(excluded.last_slot, last_slot),
+                last_started_at = COALESCE(excluded.last_started_at, last_started_at),
+                last_duration = excluded.last_duration,
+                last_error = CASE WHEN excluded.last_slot IS NULL THEN last_error ELSE excluded.last_error END,
+                runs = excluded.runs,
+                overlaps = excluded.overlaps
+        """
+        params = (job.name, slot.isoformat() if slot else None,
+                  started_at.isoformat() if started_at else None,
+                  job.last_duration, error, job.runs, job.overlaps)
+        try:
+            async with self.pool.writer() as db:
+                await db.execute(sql, params)
+        except Exception as e:
+            logging.error(f"Scheduler: job_runs yozilmadi ({job.name}): {e}")
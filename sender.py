@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+
+# -----------------------------------------------------------------------------
+# YUBORISH TEZLIGI CHEKLOVCHISI
+# -----------------------------------------------------------------------------
+# Telegram cheklovlari: bot jami ~30 xabar/soniya, bitta chatga ~1 xabar/soniya.
+# Global cheklov token bucket, chat cheklovi esa har chat uchun keyingi ruxsat
+# etilgan vaqt. RetryAfter kelsa, butun cheklovchi shu muddatga to'xtatiladi.
+
+class RateLimiter:
+    def __init__(self, rate=30, per_chat=1.0):
+        self.rate = rate
+        self.per_chat = per_chat
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self._chat_next = {}
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        ready_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = ready_at + self.per_chat
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    async def acquire(self, chat_id=None):
+        if chat_id is not None:
+            await self._wait_chat(chat_id)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self._paused_until > now:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def unreachable_reason(error):
+    # Chatga umuman yetib bo'lmaydigan xatolar: qayta urinish foydasiz
+    text = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in text:
+            return "deactivated"
+        if "blocked" in text:
+            return "blocked"
+        return "forbidden"
+    if isinstance(error, TelegramBadRequest) and "chat not found" in text:
+        return "not_found"
+    return None
+
+
+def is_unreachable(error):
+    return unreachable_reason(error) is not None
+
+
+# -----------------------------------------------------------------------------
+# "O'LIK" CHATLAR REESTRI
+# -----------------------------------------------------------------------------
+# Botni bloklagan yoki o'chirilgan akkauntlar dead_chats jadvaliga yoziladi.
+# Ommaviy yuborish so'rovlari ularni SQL darajasida chiqarib tashlaydi
+# (alive_sql), lekin probe_after vaqti o'tgach ular yana bir marta sinab
+# ko'riladi. Yuborish muvaffaqiyatli bo'lsa yoki foydalanuvchi botga yozsa,
+# yozuv o'chiriladi.
+
+DEAD_CHATS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS dead_chats (
+        telegram_id INTEGER PRIMARY KEY,
+        reason TEXT,
+        failures INTEGER NOT NULL DEFAULT 1,
+        failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        probe_after REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_dead_chats_probe ON dead_chats(probe_after)",
+]
+
+
+def alive_sql(column):
+    # WHERE ichida ishlatiladi: f"... AND {alive_sql('c.telegram_id')}"
+    return (f"{column} NOT IN (SELECT telegram_id FROM dead_chats "
+            f"WHERE probe_after > CAST(strftime('%s', 'now') AS REAL))")
+
+
+class DeadChats:
+    def __init__(self, pool, probe_interval=7 * 86400):
+        self.pool = pool
+        self.probe_interval = probe_interval
+        self._known = set()
+
+    def __contains__(self, chat_id):
+        return chat_id in self._known
+
+    async def load(self):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT telegram_id FROM dead_chats") as cur:
+                self._known = {row[0] for row in await cur.fetchall()}
+
+    async def mark_dead(self, chat_id, reason):
+        # Har qayta muvaffaqiyatsiz sinovdan keyin keyingi sinov kechroq
+        sql = """
+            INSERT INTO dead_chats (telegram_id, reason, probe_after) VALUES (?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+                reason = excluded.reason,
+                failures = failures + 1,
+                failed_at = CURRENT_TIMESTAMP,
+                probe_after = ? + ? * MIN(failures + 1, 4)
+        """
+        now = time.time()
+        async with self.pool.writer() as db:
+            await db.execute(sql, (chat_id, reason, now + self.probe_interval, now, self.probe_interval))
+        self._known.add(chat_id)
+
+    async def mark_alive(self, chat_id):
+        if chat_id not in self._known:
+            return
+        self._known.discard(chat_id)
+        async with self.pool.writer() as db:
+            await db.execute("DELETE FROM dead_chats WHERE telegram_id = ?", (chat_id,))
+
+
+async def deliver(limiter, chat_id, send, attempts=3, dead=None):
+    # send() - bitta xabarni yuboruvchi korutina funksiya.
+    # dead - DeadChats reestri (ixtiyoriy), natija unga yozib boriladi.
+    # Qaytaradi: "sent", "blocked" yoki "failed".
+    for _ in range(attempts):
+        await limiter.acquire(chat_id)
+        try:
+            await send()
+            if dead is not None:
+                await dead.mark_alive(chat_id)
+            return "sent"
+        except TelegramRetryAfter as e:
+            logging.warning(f"Flood limit: {e.retry_after} s kutamiz")
+            limiter.pause(e.retry_after)
+        except TelegramAPIError as e:
+            reason = unreachable_reason(e)
+            if reason is not None:
+                if dead is not None:
+                    await dead.mark_dead(chat_id, reason)
+                return "blocked"
+            logging.warning(f"Xabar yuborilmadi ({chat_id}): {e}")
+            return "failed"
+        except Exception as e:
+            logging.error(f"Xabar yuborishda kutilmagan xato ({chat_id}): {e}")
+            return "failed"
+    return "failed"
+
+
+# -----------------------------------------------------------------------------
+# OMMAVIY XABAR (BROADCAST)
+# -----------------------------------------------------------------------------
+# Qabul qiluvchilar async iterator orqali keladi (bazadan bo'laklab), bir
+# nechta ishchi ularni parallel, lekin RateLimiter ostida yuboradi.
+# on_progress(broadcast) har `progress_every` soniyada va oxirida chaqiriladi.
+
+class Broadcast:
+    def __init__(self, recipients, send, limiter, concurrency=10, on_progress=None, progress_every=3.0, dead=None):
+        self.recipients = recipients
+        self.send = send  # async def send(chat_id)
+        self.limiter = limiter
+        self.dead = dead
+        self.concurrency = concurrency
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.cancelled = False
+        self.done = False
+
+    @property
+    def processed(self):
+        return self.sent + self.blocked + self.failed
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def _produce(self, queue):
+        try:
+            async for chat_id in self.recipients:
+                if self.cancelled:
+                    break
+                await queue.put(chat_id)
+        finally:
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+    async def _work(self, queue):
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            if self.cancelled:
+                continue
+            status = await deliver(self.limiter, chat_id, lambda: self.send(chat_id), dead=self.dead)
+            setattr(self, status, getattr(self, status) + 1)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_every)
+            await self._notify()
+
+    async def _notify(self):
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(self)
+        except Exception as e:
+            logging.warning(f"Broadcast holatini yangilab bo'lmadi: {e}")
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(self._produce(queue), *(self._work(queue) for _ in range(self.concurrency)))
+        finally:
+            reporter.cancel()
+            self.done = True
+            await self._notify()
+        return self
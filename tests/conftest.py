@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    # main dagi navbat va qulflar birinchi ishlatilgan loop ga bog'lanadi,
+    # shuning uchun barcha testlar bitta loop da bajariladi
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def run_db(tmp_path, event_loop):
+    # Har bir test uchun bo'sh (migratsiyalangan) baza: run_db(coro_fn) -
+    # init_db, coro_fn(), close_db
+    def run(fn):
+        async def scenario():
+            main.db_pool.path = str(tmp_path / "test.db")
+            main.user_ctx_cache.clear()
+            await main.init_db()
+            try:
+                return await fn()
+            finally:
+                await main.close_db()
+        return event_loop.run_until_complete(scenario())
+    return run
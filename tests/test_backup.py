@@ -0,0 +1,38 @@
+import sqlite3
+import threading
+
+from backup import snapshot
+
+
+def test_snapshot_completes_while_writer_is_busy(tmp_path):
+    path = str(tmp_path / "src.db")
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany("INSERT INTO t (v) VALUES (?)", [("x" * 200,) for _ in range(100000)])
+    conn.commit()
+
+    stop = threading.Event()
+
+    def write():
+        while not stop.is_set():
+            conn.execute("INSERT INTO t (v) VALUES ('y')")
+            conn.commit()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    # Bo'lib-bo'lib olinadigan backup doimiy yozuvda qayta-qayta boshlanadi
+    backup = threading.Thread(target=snapshot, args=(path, str(tmp_path / "copy.db")), daemon=True)
+    backup.start()
+    backup.join(timeout=30)
+    stop.set()
+    writer.join()
+    assert not backup.is_alive()
+    conn.close()
+
+    copy = sqlite3.connect(str(tmp_path / "copy.db"))
+    try:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert copy.execute("SELECT COUNT(*) FROM t WHERE v != 'y'").fetchone()[0] == 100000
+    finally:
+        copy.close()
@@ -0,0 +1,33 @@
+import re
+
+from main import chunk_blocks
+
+
+def _balanced(chunk):
+    for tag in ("b", "i"):
+        if chunk.count(f"<{tag}>") != chunk.count(f"</{tag}>"):
+            return False
+    return not re.search(r"&[a-z]*$|<[^>]*$", chunk)
+
+
+def test_blocks_are_packed_up_to_limit():
+    blocks = [f"<b>Mijoz {i}</b>\n└ Qarz: {i * 1000} so'm" for i in range(50)]
+    chunks = chunk_blocks(blocks, limit=200)
+    assert all(len(c) <= 200 for c in chunks)
+    assert "".join(chunks) == "".join(b + "\n" for b in blocks)
+
+
+def test_oversize_block_is_split_on_lines():
+    block = "\n".join(f"   • <i>non</i>: {i},000 <i>(2026-10-0{i % 10})</i>" for i in range(40))
+    chunks = chunk_blocks(["<b>Do'kon</b>", block], limit=300)
+    assert len(chunks) > 1
+    assert all(len(c) <= 300 and _balanced(c) for c in chunks)
+    assert "".join(chunks) == "<b>Do'kon</b>\n" + block + "\n"
+
+
+def test_oversize_line_is_cut_as_escaped_text():
+    line = "<b>" + "A&B " * 100 + "</b>"
+    chunks = chunk_blocks([line], limit=100)
+    assert all(len(c) <= 100 and _balanced(c) for c in chunks)
+    assert "<b>" not in "".join(chunks)
+    assert "".join(chunks).replace("\n", "").replace("&amp;", "&") == "A&B " * 100
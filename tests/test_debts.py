@@ -0,0 +1,33 @@
+import main
+
+
+async def _seed(with_store):
+    async with main.db_pool.writer() as db:
+        await db.execute("INSERT INTO users (telegram_id, full_name, role, is_owner) VALUES (10, 'Ega', 'admin', 1)")
+        await db.execute("INSERT INTO users (telegram_id, full_name, role) VALUES (20, 'Xaridor', 'client')")
+        if with_store:
+            await db.execute("INSERT INTO stores (name, owner_id) VALUES ('Baraka', 10)")
+        await db.execute(
+            "INSERT INTO customers (seller_id, full_name, phone, telegram_id, balance) "
+            "VALUES (10, 'Ali', '998901234567', 20, 5000)"
+        )
+
+
+def test_buyer_debts_show_store_name(run_db):
+    async def scenario():
+        await _seed(with_store=True)
+        return await main.db_get_buyer_debts(20), await main.db_get_all_debtors_with_store()
+    debts, debtors = run_db(scenario)
+    assert [tuple(r[:2]) for r in debts] == [("Baraka", 5000)]
+    assert [tuple(r) for r in debtors] == [(20, "Ali", 5000, "Baraka")]
+
+
+def test_debts_without_store_row_are_not_dropped(run_db):
+    async def scenario():
+        await _seed(with_store=False)
+        return (await main.db_get_buyer_debts(20), await main.db_get_buyer_debts_with_history(20),
+                await main.db_get_all_debtors_with_store())
+    debts, history, debtors = run_db(scenario)
+    assert [tuple(r[:2]) for r in debts] == [("Do'kon", 5000)]
+    assert [r[0] for r in history] == ["Do'kon"]
+    assert [r[3] for r in debtors] == ["Do'kon"]
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import main
+from fsm_storage import SQLiteStorage, storage_key
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+async def _rows():
+    async with main.db_pool.reader() as db:
+        async with db.execute("SELECT key, state, data FROM fsm_states ORDER BY key") as cur:
+            return [tuple(r) for r in await cur.fetchall()]
+
+
+def test_state_survives_restart(run_db):
+    async def scenario():
+        storage = SQLiteStorage(main.db_pool, flush_interval=3600)
+        await storage.set_state(key(7), "Trans:amount")
+        await storage.set_data(key(7), {"cust_id": 5, "izoh": "non"})
+        await storage.close()
+        # Bot qayta ishga tushdi: yangi ulanishlar, yangi (bo'sh) kesh
+        await main.close_db()
+        await main.init_db()
+        fresh = SQLiteStorage(main.db_pool)
+        return await fresh.get_state(key(7)), await fresh.get_data(key(7))
+    assert run_db(scenario) == ("Trans:amount", {"cust_id": 5, "izoh": "non"})
+
+
+def test_writes_are_flushed_behind(run_db):
+    async def scenario():
+        storage = SQLiteStorage(main.db_pool, flush_interval=0.01)
+        await storage.set_state(key(7), "Trans:amount")
+        before = await _rows()
+        await asyncio.sleep(0.1)
+        after = await _rows()
+        await storage.set_state(key(7), None)
+        await storage.close()
+        return before, after, await _rows()
+    before, after, cleared = run_db(scenario)
+    assert before == []
+    assert after == [(storage_key(key(7)), "Trans:amount", None)]
+    assert cleared == []
+
+
+def test_expired_state_is_dropped_and_purged(run_db):
+    async def scenario():
+        old = time.time() - 120
+        async with main.db_pool.writer() as db:
+            await db.executemany("INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, 'Trans:amount', NULL, ?)",
+                                 [(storage_key(key(7)), old), (storage_key(key(8)), old)])
+        storage = SQLiteStorage(main.db_pool, ttl=60, flush_interval=3600)
+        state = await storage.get_state(key(7))
+        await storage.flush()
+        left = await _rows()
+        purged = await storage.purge()
+        await storage.close()
+        return state, left, purged, await _rows()
+    state, left, purged, rows = run_db(scenario)
+    assert state is None
+    assert [r[0] for r in left] == [storage_key(key(8))]
+    assert purged == 1 and rows == []
+
+
+def test_lru_keeps_dirty_entries(run_db):
+    async def scenario():
+        storage = SQLiteStorage(main.db_pool, maxsize=2, flush_interval=3600)
+        for user_id in (1, 2, 3):
+            await storage.set_state(key(user_id), f"S{user_id}")
+        # Hammasi hali bazaga yozilmagan: limitdan oshsa ham chiqarilmaydi
+        cached_dirty = len(storage._cache)
+        await storage.flush()
+        await storage.set_state(key(3), "S3")
+        cached_clean = list(storage._cache)
+        states = [await storage.get_state(key(u)) for u in (1, 2, 3)]
+        await storage.close()
+        return cached_dirty, cached_clean, states
+    cached_dirty, cached_clean, states = run_db(scenario)
+    assert cached_dirty == 3
+    assert cached_clean == [storage_key(key(2)), storage_key(key(3))]
+    assert states == ["S1", "S2", "S3"]
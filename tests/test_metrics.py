@@ -0,0 +1,55 @@
+import pytest
+
+from metrics import Registry, instrument_functions
+
+
+async def db_rows(n, fail=False):
+    for i in range(n):
+        if fail and i == 1:
+            raise ValueError("xato")
+        yield i
+
+
+async def db_one():
+    return 1
+
+
+def _setup():
+    registry = Registry()
+    seconds = registry.histogram("db_seconds", "test", ["function"])
+    errors = registry.counter("db_errors_total", "test", ["function"])
+    namespace = {"db_rows": db_rows, "db_one": db_one}
+    instrument_functions(namespace, "db_", seconds, errors)
+    return registry, namespace
+
+
+def _lines(event_loop, registry, prefix):
+    text = event_loop.run_until_complete(registry.render())
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_async_generators_are_timed(event_loop):
+    registry, ns = _setup()
+
+    async def scenario():
+        assert [x async for x in ns["db_rows"](3)] == [0, 1, 2]
+        assert await ns["db_one"]() == 1
+
+    event_loop.run_until_complete(scenario())
+    assert 'db_seconds_count{function="db_rows"} 1' in _lines(event_loop, registry, "db_seconds_count")
+    assert 'db_seconds_count{function="db_one"} 1' in _lines(event_loop, registry, "db_seconds_count")
+
+
+def test_async_generator_errors_and_early_close(event_loop):
+    registry, ns = _setup()
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            [x async for x in ns["db_rows"](3, fail=True)]
+        agen = ns["db_rows"](10)
+        assert await agen.__anext__() == 0
+        await agen.aclose()
+
+    event_loop.run_until_complete(scenario())
+    assert 'db_seconds_count{function="db_rows"} 2' in _lines(event_loop, registry, "db_seconds_count")
+    assert _lines(event_loop, registry, "db_errors_total{") == ['db_errors_total{function="db_rows"} 1']
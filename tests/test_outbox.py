@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+import main
+from outbox import OutboxWorker, backoff, enqueue
+from sender import DeadChats, RateLimiter
+
+
+class FakeBot:
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail or {}  # chat_id -> istisno yaratuvchi funksiya
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.fail:
+            raise self.fail[chat_id](chat_id, text)
+        self.sent.append((chat_id, text))
+
+
+def _worker(bot, dead=None, max_attempts=8):
+    worker = OutboxWorker(main.db_pool, RateLimiter(rate=1000, per_chat=0), max_attempts=max_attempts, dead=dead)
+    worker._bot = bot
+    return worker
+
+
+async def _tick(worker):
+    # _run() siklining bitta aylanishi
+    rows, _ = await worker._due()
+    await worker._ack(await asyncio.gather(*(worker._send(r) for r in rows)))
+    return len(rows)
+
+
+async def _rows():
+    async with main.db_pool.reader() as db:
+        async with db.execute("SELECT chat_id, attempts, next_attempt_at FROM outbox") as cur:
+            return [tuple(r) for r in await cur.fetchall()]
+
+
+async def _customer():
+    await main.db_add_user(10, "Ega", None, "admin", store_name="Baraka", is_owner=1)
+    return await main.db_add_customer(10, "Ali", "998901234567", linked_tg_id=20)
+
+
+def test_enqueue_rolls_back_with_ledger_row(run_db):
+    async def scenario():
+        cust = await _customer()
+
+        async def failing(db):
+            await main._job_add_trans(db, cust, 5000, "non", (20, "Yangi nasiya"))
+            raise RuntimeError("boom")
+        with pytest.raises(RuntimeError):
+            await main.ledger_queue.submit(failing)
+        failed = await _rows(), await main.db_get_store_stats(10)
+
+        await main.db_add_trans(cust, 700, "sut", (20, "Yangi nasiya"))
+        return failed, await _rows()
+    (rows, stats), after = run_db(scenario)
+    assert rows == [] and stats.total_debt == 0
+    assert [r[0] for r in after] == [20]
+
+
+def test_failed_send_is_retried_with_backoff(run_db):
+    bot = FakeBot(fail={20: lambda chat_id, text: RuntimeError("tarmoq")})
+
+    async def scenario():
+        worker = _worker(bot)
+        async with main.db_pool.writer() as db:
+            await enqueue(db, 20, "salom")
+        started = time.time()
+        first = await _tick(worker)
+        retry = await _rows()
+        # Hali vaqti kelmagan xabar qayta yuborilmaydi
+        early = await _tick(worker)
+
+        del bot.fail[20]
+        async with main.db_pool.writer() as db:
+            await db.execute("UPDATE outbox SET next_attempt_at = 0")
+        return started, first, retry, early, await _tick(worker), await _rows()
+    started, first, retry, early, second, left = run_db(scenario)
+    assert first == 1 and early == 0 and second == 1
+    [(chat_id, attempts, next_at)] = retry
+    assert (chat_id, attempts) == (20, 1)
+    assert next_at >= started + backoff(1)
+    assert bot.sent == [(20, "salom")] and left == []
+
+
+def test_gives_up_after_max_attempts(run_db):
+    bot = FakeBot(fail={20: lambda chat_id, text: RuntimeError("tarmoq")})
+
+    async def scenario():
+        worker = _worker(bot, max_attempts=2)
+        async with main.db_pool.writer() as db:
+            await enqueue(db, 20, "salom")
+        await _tick(worker)
+        async with main.db_pool.writer() as db:
+            await db.execute("UPDATE outbox SET next_attempt_at = 0")
+        await _tick(worker)
+        return await _rows()
+    assert run_db(scenario) == []
+
+
+def test_dead_chats_are_skipped(run_db):
+    def blocked(chat_id, text):
+        return TelegramForbiddenError(SendMessage(chat_id=chat_id, text=text), "Forbidden: bot was blocked by the user")
+    bot = FakeBot(fail={30: blocked})
+
+    async def scenario():
+        dead = DeadChats(main.db_pool)
+        worker = _worker(bot, dead=dead)
+        async with main.db_pool.writer() as db:
+            await enqueue(db, 30, "birinchi")
+            await enqueue(db, 40, "salom")
+        await _tick(worker)
+        after_block = await _rows()
+        # Endi 30 o'lik: navbatga umuman yozilmaydi
+        async with main.db_pool.writer() as db:
+            await enqueue(db, 30, "ikkinchi")
+        return 30 in dead, after_block, await _rows()
+    is_dead, after_block, rows = run_db(scenario)
+    assert is_dead
+    assert after_block == [] and rows == []
+    assert bot.sent == [(40, "salom")]
@@ -0,0 +1,68 @@
+import main
+
+SELLER = 10
+
+
+async def _seed(n=45):
+    async with main.db_pool.writer() as db:
+        await db.executemany("INSERT INTO customers (seller_id, full_name, phone) VALUES (?, ?, ?)",
+                             [(SELLER, f"Mijoz {i:02d}", f"9012345{i:02d}") for i in range(n)])
+        await db.execute("INSERT INTO customers (seller_id, full_name) VALUES (99, 'Begona')")
+    rows, _, _ = await main.db_get_customers_page(SELLER, limit=100)
+    return [r[0] for r in rows]
+
+
+def _nav(kb):
+    return [b.callback_data for row in kb.inline_keyboard for b in row if b.callback_data.startswith("cp:") and
+            b.callback_data.split(":")[4] != "0"]
+
+
+def test_pages_walk_forward_and_back(run_db):
+    async def scenario():
+        ids = await _seed()
+        p1 = await main.db_get_customers_page(SELLER)
+        p2 = await main.db_get_customers_page(SELLER, after=p1[0][-1][0])
+        back = await main.db_get_customers_page(SELLER, before=p2[0][0][0])
+        return ids, p1, p2, back
+
+    ids, p1, p2, back = run_db(scenario)
+    assert [r[0] for r in p1[0]] == ids[:20] and p1[1:] == (False, True)
+    assert [r[0] for r in p2[0]] == ids[20:40] and p2[1:] == (True, True)
+    assert [r[0] for r in back[0]] == ids[:20] and back[1:] == (False, True)
+
+
+def test_deleted_anchor_falls_back_to_first_page(run_db):
+    async def scenario():
+        ids = await _seed()
+        assert await main.db_delete_customer(ids[20], SELLER)
+        assert await main.db_delete_customer(ids[19], SELLER)
+        prev_kb = await main.get_my_cust_kb(SELLER, "debt", before=ids[20])
+        next_page = await main.db_get_customers_page(SELLER, after=ids[19])
+        return ids, prev_kb, next_page
+
+    ids, prev_kb, (rows, has_prev, has_next) = run_db(scenario)
+    assert prev_kb.inline_keyboard[0][0].callback_data == f"debt_{ids[0]}"
+    assert _nav(prev_kb) == [f"cp:debt:a:n:{ids[21]}"]
+    assert [r[0] for r in rows] == ids[:19] + [ids[21]]
+    assert (has_prev, has_next) == (False, True)
+
+
+def test_anchor_of_another_store_is_ignored(run_db):
+    async def scenario():
+        ids = await _seed()
+        async with main.db_pool.reader() as db:
+            async with db.execute("SELECT id FROM customers WHERE seller_id = 99") as cur:
+                foreign = (await cur.fetchone())[0]
+        return ids, await main.db_get_customers_page(SELLER, after=foreign)
+
+    ids, (rows, has_prev, _) = run_db(scenario)
+    assert [r[0] for r in rows] == ids[:20] and not has_prev
+
+
+def test_empty_filtered_page_has_no_nav_buttons(run_db):
+    async def scenario():
+        await _seed(5)
+        return await main.get_my_cust_kb(SELLER, "debt", flt="d")
+
+    kb = run_db(scenario)
+    assert len(kb.inline_keyboard) == 1  # faqat filtr tugmalari
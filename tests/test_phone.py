@@ -0,0 +1,28 @@
+from main import clean_phone, phone_key, phone_keys
+
+
+def test_phone_key_keeps_last_nine_digits():
+    assert phone_key("998901234567") == "901234567"
+    assert phone_key("+998 (90) 123-45-67") == "901234567"
+    assert phone_key("901234567") == "901234567"
+
+
+def test_phone_key_short_and_empty():
+    assert phone_key("1234") == "1234"
+    assert phone_key("") is None
+    assert phone_key(None) is None
+    assert phone_key("+-()") is None
+
+
+def test_phone_keys_splits_owner_phones():
+    assert phone_keys("998901234567, 998917654321") == ["901234567", "917654321"]
+
+
+def test_phone_keys_deduplicates_and_skips_blanks():
+    assert phone_keys("998901234567,, +998 90 123 45 67 ,") == ["901234567"]
+    assert phone_keys(None) == []
+
+
+def test_clean_phone_strips_formatting():
+    assert clean_phone("+998 (90) 123-45-67") == "998901234567"
+    assert clean_phone(None) is None
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import main
+from reports import ReportWorkers, render_csv
+
+ROW = ("2026-10-01 10:00:00", "Ali", "998901234567", 5000, "non")
+
+
+async def _chunks(n, size=100):
+    for _ in range(n):
+        yield [ROW] * size
+
+
+def test_render_stream_consumes_all_chunks(event_loop):
+    workers = ReportWorkers(workers=2)
+    try:
+        result = event_loop.run_until_complete(workers.render_stream(render_csv, _chunks(50)))
+    finally:
+        workers.shutdown()
+    assert result.rows == 5000
+
+
+def test_render_stream_stops_source_when_render_fails(event_loop):
+    closed = []
+
+    async def chunks():
+        try:
+            for _ in range(1000):
+                yield [ROW]
+        finally:
+            closed.append(True)
+
+    def render(rows):
+        next(iter(rows))
+        raise ValueError("render xatosi")
+
+    workers = ReportWorkers(workers=1)
+    try:
+        with pytest.raises(ValueError):
+            event_loop.run_until_complete(asyncio.wait_for(workers.render_stream(render, chunks()), 5))
+    finally:
+        workers.shutdown()
+    assert closed == [True]
+
+
+def test_export_slots_are_limited_to_workers(event_loop):
+    workers = ReportWorkers(workers=2, per_store=1)
+    active, peak = 0, 0
+
+    async def export(store_id):
+        nonlocal active, peak
+        async with workers.slot(store_id):
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    async def scenario():
+        await asyncio.gather(*(export(i) for i in range(6)))
+
+    try:
+        event_loop.run_until_complete(scenario())
+    finally:
+        workers.shutdown()
+    assert peak == 2
+
+
+def test_report_iterator_does_not_hold_a_pool_reader(run_db):
+    async def scenario():
+        async with main.db_pool.writer() as db:
+            await db.execute("INSERT INTO customers (id, seller_id, full_name) VALUES (1, 10, 'Ali')")
+            await db.executemany("INSERT INTO transactions (customer_id, amount, description) VALUES (1, ?, 'non')",
+                                 [(i,) for i in range(1, 26)])
+        free, rows = [], 0
+        async for chunk in main.db_iter_transactions_report(10, chunk_size=10):
+            free.append(main.db_pool._readers.qsize())
+            rows += len(chunk)
+        return free, rows
+
+    free, rows = run_db(scenario)
+    assert rows == 25
+    assert free == [main.DB_READERS] * 3
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import main
+from scheduler import Job, Scheduler
+
+TZ = ZoneInfo("Asia/Tashkent")
+
+
+def at(day, hour, minute=0):
+    return datetime(2026, 10, day, hour, minute, tzinfo=TZ)
+
+
+def job(last_slot=None, catch_up=timedelta(hours=12)):
+    j = Job("daily", "20:00", None, catch_up=catch_up)
+    j.last_slot = last_slot
+    return j
+
+
+def test_next_slot():
+    assert job().next_slot(at(18, 19, 59), TZ) == at(18, 20)
+    assert job().next_slot(at(18, 20), TZ) == at(19, 20)  # aynan slot vaqtida - keyingisi
+    assert job().next_slot(at(18, 23), TZ) == at(19, 20)
+
+
+def test_next_slot_crosses_month():
+    assert job().next_slot(datetime(2026, 10, 31, 21, tzinfo=TZ), TZ) == datetime(2026, 11, 1, 20, tzinfo=TZ)
+
+
+def test_prev_slot():
+    assert job().prev_slot(at(18, 20), TZ) == at(18, 20)
+    assert job().prev_slot(at(18, 21), TZ) == at(18, 20)
+    assert job().prev_slot(at(18, 19), TZ) == at(17, 20)
+
+
+def test_first_slot_runs_missed_slot_within_catch_up():
+    assert job(last_slot=at(17, 20)).first_slot(at(18, 22), TZ) == at(18, 20)
+    assert job(last_slot=at(16, 20)).first_slot(at(18, 8), TZ) == at(17, 20)
+
+
+def test_first_slot_skips_slot_already_done():
+    assert job(last_slot=at(18, 20)).first_slot(at(18, 22), TZ) == at(19, 20)
+
+
+def test_first_slot_skips_slot_older_than_catch_up():
+    assert job(last_slot=at(16, 20)).first_slot(at(18, 9), TZ) == at(18, 20)
+
+
+def test_first_slot_without_catch_up():
+    assert job(last_slot=at(17, 20), catch_up=None).first_slot(at(18, 22), TZ) == at(19, 20)
+
+
+def test_first_deploy_only_catches_up_within_grace():
+    # job_runs da yozuv yo'q: faqat hozirgina o'tgan slot bajariladi
+    assert job().first_slot(at(18, 20, 5), TZ) == at(18, 20)
+    assert job().first_slot(at(19, 7), TZ) == at(19, 20)  # kechagi 20:00 hisobot ertalab yuborilmaydi
+    assert job().first_slot(at(18, 12), TZ) == at(18, 20)
+
+
+def test_first_deploy_without_grace():
+    j = Job("daily", "20:00", None, first_run_grace=None)
+    assert j.first_slot(at(18, 20, 5), TZ) == at(19, 20)
+    assert job(catch_up=None).first_slot(at(18, 20, 5), TZ) == at(19, 20)
+
+
+def test_scheduler_without_jobs(run_db):
+    async def scenario():
+        sched = Scheduler(main.db_pool)
+        await sched.start()
+        await asyncio.sleep(0)
+        task = sched._task
+        await sched.stop()
+        return task
+    task = run_db(scenario)
+    assert task.done() and task.exception() is None
@@ -0,0 +1,54 @@
+import main
+
+SELLER = 10
+
+
+async def _seed():
+    async with main.db_pool.writer() as db:
+        await db.execute("INSERT INTO users (telegram_id, full_name, role, is_owner) VALUES (?, 'Ega', 'admin', 1)", (SELLER,))
+        await db.execute("INSERT INTO stores (name, owner_id) VALUES ('Baraka', ?)", (SELLER,))
+    await main.db_add_customer(SELLER, "Alisher Karimov", main.clean_phone("+998 90 123 45 67"))
+    await main.db_add_customer(SELLER, "Дилшод Юсупов", main.clean_phone("91 765 43 21"))
+    await main.db_add_customer(SELLER, "Nodira opa", main.clean_phone("(93) 555-00-11"))
+
+
+def _search(run_db, *queries):
+    async def scenario():
+        await _seed()
+        return [[r[1] for r in await main.db_search_customers(SELLER, q)] for q in queries]
+    return run_db(scenario)
+
+
+def test_search_key_indexes_full_phone_and_key():
+    assert main.customer_search_key("Ali", "998901234567") == "ali 998901234567 901234567"
+    assert main.customer_search_key("Ali", "901234567") == "ali 998901234567 901234567"
+    assert main.customer_search_key("Ali", None) == "ali"
+
+
+def test_search_tokens_join_digit_groups():
+    assert main.search_tokens("+998 90 123") == ["99890123"]
+    assert main.search_tokens("Ali 90 123 45 67") == ["ali", "901234567"]
+
+
+def test_search_by_phone_in_any_format(run_db):
+    results = _search(run_db, "998901234567", "90 123 45 67", "+998 90 123", "901234567", "4567", "90")
+    assert results == [["Alisher Karimov"]] * 6
+
+
+def test_search_local_number_stored_without_code(run_db):
+    results = _search(run_db, "998917654321", "+998 91 765")
+    assert results == [["Дилшод Юсупов"]] * 2
+
+
+def test_search_by_name(run_db):
+    results = _search(run_db, "alisher", "Дилшод", "dilshod yusupov", "nodira 93", "opa")
+    assert results == [["Alisher Karimov"], ["Дилшод Юсупов"], ["Дилшод Юсупов"], ["Nodira opa"], ["Nodira opa"]]
+
+
+def test_search_after_rename_keeps_phone(run_db):
+    async def scenario():
+        await _seed()
+        cust_id = (await main.db_search_customers(SELLER, "alisher"))[0][0]
+        assert await main.db_update_customer_name(cust_id, SELLER, "Aziz")
+        return [[r[1] for r in await main.db_search_customers(SELLER, q)] for q in ("aziz", "+998 90 123", "alisher")]
+    assert run_db(scenario) == [["Aziz"], ["Aziz"], []]
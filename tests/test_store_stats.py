@@ -0,0 +1,45 @@
+import main
+
+
+async def _seller_with_customer():
+    await main.db_add_user(10, "Ega", None, "admin", store_name="Baraka", is_owner=1)
+    return await main.db_add_customer(10, "Ali", "998901234567")
+
+
+def test_triggers_track_debt_and_payments(run_db):
+    async def scenario():
+        cust = await _seller_with_customer()
+        await main.db_add_trans(cust, 5000, "non")
+        await main.db_add_trans(cust, -2000, "to'lov")
+        return await main.db_get_store_stats(10), await main.db_rebuild_store_stats()
+    stats, mismatched = run_db(scenario)
+    assert stats == (3000, 1, 1, 5000, 2000)
+    assert mismatched == 0
+
+
+def test_deleting_customer_removes_today_totals(run_db):
+    async def scenario():
+        cust = await _seller_with_customer()
+        other = await main.db_add_customer(10, "Vali", "998907654321")
+        await main.db_add_trans(cust, 5000, "non")
+        await main.db_add_trans(cust, -5000, "to'lov")
+        await main.db_add_trans(other, 700, "sut")
+        assert await main.db_delete_customer(cust, 10)
+        return await main.db_get_store_stats(10), await main.db_rebuild_store_stats()
+    stats, mismatched = run_db(scenario)
+    assert stats == (700, 1, 1, 700, 0)
+    assert mismatched == 0
+
+
+def test_rebuild_counts_drifted_today_totals(run_db):
+    async def scenario():
+        cust = await _seller_with_customer()
+        await main.db_add_trans(cust, 5000, "non")
+        async with main.db_pool.writer() as db:
+            await db.execute("UPDATE store_stats SET debt_today = 1, paid_today = 99 WHERE seller_id = 10")
+            await db.commit()
+        first = await main.db_rebuild_store_stats()
+        return first, await main.db_rebuild_store_stats(), await main.db_get_store_stats(10)
+    first, second, stats = run_db(scenario)
+    assert (first, second) == (1, 0)
+    assert stats == (5000, 1, 1, 5000, 0)
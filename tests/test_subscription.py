@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import main
+from main import add_months
+
+
+def test_add_months_clamps_to_month_end():
+    assert add_months(date(2026, 1, 31), 1) == date(2026, 2, 28)
+    assert add_months(date(2028, 1, 31), 1) == date(2028, 2, 29)
+    assert add_months(date(2026, 3, 31), 1) == date(2026, 4, 30)
+    assert add_months(date(2026, 8, 31), 6) == date(2027, 2, 28)
+
+
+def test_add_months_keeps_day_and_rolls_year():
+    assert add_months(date(2026, 1, 15), 1) == date(2026, 2, 15)
+    assert add_months(date(2026, 11, 30), 2) == date(2027, 1, 30)
+    assert add_months(date(2026, 12, 31), 12) == date(2027, 12, 31)
+
+
+def test_add_months_does_not_drift_after_short_month():
+    # Har safar boshlang'ich sanadan: 31-yanvar -> 28-fevral -> 31-mart
+    assert add_months(date(2026, 1, 31), 2) == date(2026, 3, 31)
+
+
+async def _seller(tg_id, until):
+    async with main.db_pool.writer() as db:
+        await db.execute("INSERT INTO users (telegram_id, full_name, role, is_owner, subscription_until) "
+                         "VALUES (?, 'Sotuvchi', 'admin', 1, ?)", (tg_id, until.isoformat()))
+
+
+async def _role(tg_id):
+    main.user_ctx_cache.clear()
+    return (await main.db_get_user(tg_id))[4]
+
+
+def test_renew_reactivates_only_expired_block(run_db):
+    async def scenario():
+        yesterday = main.today_local() - timedelta(days=1)
+        await _seller(1, yesterday)
+        await _seller(2, yesterday)
+        expired = await main.db_block_expired_subscriptions()
+        await main.db_block_user(2)  # keyin qo'lda ham bloklangan
+        r1, r2 = await main.db_renew_subscription(1), await main.db_renew_subscription(2)
+        return [r[0] for r in expired], r1, r2, await _role(1), await _role(2)
+
+    expired, r1, r2, role1, role2 = run_db(scenario)
+    assert expired == [1, 2]
+    assert r1 == add_months(main.today_local(), 1) and role1 == "admin"
+    assert r2 == "blocked" and role2 == "blocked"
+
+
+def test_renew_after_manual_unblock(run_db):
+    async def scenario():
+        await _seller(3, main.today_local() + timedelta(days=10))
+        await main.db_block_user(3)
+        refused = await main.db_renew_subscription(3)
+        await main.db_unblock_user(3)
+        result = await main.db_renew_subscription(3)
+        async with main.db_pool.reader() as db:
+            async with db.execute("SELECT subscription_until FROM users WHERE telegram_id = 3") as cur:
+                until = (await cur.fetchone())[0]
+        return refused, result, await _role(3), until
+
+    refused, result, role, until = run_db(scenario)
+    assert refused == "blocked"
+    # Blokdan ochilgan foydalanuvchi client: obuna unga sotish huquqini bermaydi
+    assert result == "not_seller"
+    assert role == "client"
+    assert until == (main.today_local() + timedelta(days=10)).isoformat()
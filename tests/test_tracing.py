@@ -0,0 +1,63 @@
+import json
+import logging
+
+from database import ConnectionManager, WriteQueue
+from tracing import Tracer
+
+
+async def _job(db, n):
+    for i in range(n):
+        async with db.execute("SELECT COUNT(*) FROM t WHERE v = ?", (i,)) as cur:
+            await cur.fetchone()
+    await db.execute("INSERT INTO t (v) VALUES (?)", (n,))
+
+
+def _trace_line(event_loop, tmp_path, caplog, fn):
+    pool = ConnectionManager(str(tmp_path / "trace.db"), readers=1)
+    queue = WriteQueue(pool)
+    tracer = Tracer(pool, slow_ms=0)  # har bir so'rov "sekin"
+    explained = []
+    explain = tracer._explain
+
+    async def counting_explain(sql, params):
+        explained.append(sql)
+        return await explain(sql, params)
+
+    tracer._explain = counting_explain
+
+    async def scenario():
+        await pool.open()
+        async with pool.writer() as db:
+            await db.execute("CREATE TABLE t (v INTEGER)")
+        tracer.install(queue)
+        queue.start()
+        try:
+            await tracer.run("update", "message", fn, queue)
+        finally:
+            await queue.stop()
+            await pool.close()
+
+    with caplog.at_level(logging.INFO, logger="trace"):
+        event_loop.run_until_complete(scenario())
+    return json.loads(caplog.records[-1].getMessage()), explained
+
+
+def test_queued_job_counts_as_checkout_without_savepoints(event_loop, tmp_path, caplog):
+    async def handler(queue):
+        await queue.submit(_job, 1)
+
+    line, _ = _trace_line(event_loop, tmp_path, caplog, handler)
+    assert line["conns"] == 1
+    assert line["sql"] == 2
+    assert not any(s["sql"].startswith(("SAVEPOINT", "RELEASE", "BEGIN")) for s in line["slow"])
+
+
+def test_slow_sql_is_explained_once(event_loop, tmp_path, caplog):
+    async def handler(queue):
+        await queue.submit(_job, 5)
+
+    line, explained = _trace_line(event_loop, tmp_path, caplog, handler)
+    select = [s for s in line["slow"] if s["sql"].startswith("SELECT")]
+    assert len(select) == 1 and select[0]["n"] == 5
+    assert len(explained) == len(line["slow"]) == 2
+    assert line["repeat"][0]["n"] == 5
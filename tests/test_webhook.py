@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.base import BaseSession
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import HEALTH_TEXT, make_app
+
+SECRET = "s3cret"
+
+
+class FakeSession(BaseSession):
+    # Telegram ga so'rov yubormaydi
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        if False:
+            yield b""
+
+
+def update(update_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.datetime.now().timestamp()),
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "Ali"},
+            "text": text,
+        },
+    }
+
+
+def serve(event_loop, scenario):
+    received = []
+    router = Router()
+
+    @router.message()
+    async def on_message(msg):
+        received.append(msg.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    app = make_app(dp, Bot(token="42:TEST", session=FakeSession()), path="/webhook", secret=SECRET)
+
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client, received)
+    return event_loop.run_until_complete(run())
+
+
+async def _wait_for(received, count):
+    # Yangilanish javobdan keyin fonda qayta ishlanadi
+    for _ in range(100):
+        if len(received) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_update_with_secret_is_dispatched(event_loop):
+    async def scenario(client, received):
+        resp = await client.post("/webhook", json=update(1, "salom"),
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        await _wait_for(received, 1)
+        return resp.status, received
+    status, received = serve(event_loop, scenario)
+    assert status == 200
+    assert received == ["salom"]
+
+
+def test_update_without_valid_secret_is_rejected(event_loop):
+    async def scenario(client, received):
+        wrong = await client.post("/webhook", json=update(2, "a"), headers={"X-Telegram-Bot-Api-Secret-Token": "xato"})
+        missing = await client.post("/webhook", json=update(3, "b"))
+        await asyncio.sleep(0.05)
+        return wrong.status, missing.status, received
+    wrong, missing, received = serve(event_loop, scenario)
+    assert (wrong, missing) == (401, 401)
+    assert received == []
+
+
+def test_health_route(event_loop):
+    async def scenario(client, received):
+        resp = await client.get("/")
+        return resp.status, await resp.text()
+    assert serve(event_loop, scenario) == (200, HEALTH_TEXT)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from database import ConnectionManager, WriteQueue
+
+
+async def _insert(db, v):
+    await db.execute("INSERT INTO t (v) VALUES (?)", (v,))
+    return v
+
+
+async def _fail_after_insert(db, v):
+    await db.execute("INSERT INTO t (v) VALUES (?)", (v,))
+    raise ValueError(f"ish {v} xatosi")
+
+
+def _run(event_loop, tmp_path, fn):
+    pool = ConnectionManager(str(tmp_path / "queue.db"), readers=1)
+    queue = WriteQueue(pool)
+
+    async def scenario():
+        await pool.open()
+        async with pool.writer() as db:
+            await db.execute("CREATE TABLE t (v INTEGER)")
+        queue.start()
+        try:
+            result = await fn(pool, queue)
+        finally:
+            await queue.stop()
+        async with pool.reader() as db:
+            async with db.execute("SELECT v FROM t ORDER BY v") as cur:
+                rows = [r[0] for r in await cur.fetchall()]
+        await pool.close()
+        return result, rows
+
+    return event_loop.run_until_complete(scenario())
+
+
+def _count_commits(pool):
+    # Yozuvchi ulanishdagi commit() chaqiruvlarini sanaydi
+    commits = []
+    conn = pool._writer
+    original = conn.commit
+
+    async def commit():
+        commits.append(1)
+        return await original()
+
+    conn.commit = commit
+    return commits
+
+
+def test_concurrent_submits_share_one_commit(event_loop, tmp_path):
+    async def scenario(pool, queue):
+        commits = _count_commits(pool)
+        results = await asyncio.gather(*(queue.submit(_insert, i) for i in range(10)))
+        return results, len(commits)
+
+    (results, commits), rows = _run(event_loop, tmp_path, scenario)
+    assert results == list(range(10))
+    assert rows == list(range(10))
+    assert commits == 1
+
+
+def test_failing_job_rolls_back_only_itself(event_loop, tmp_path):
+    async def scenario(pool, queue):
+        commits = _count_commits(pool)
+        results = await asyncio.gather(
+            queue.submit(_insert, 1),
+            queue.submit(_fail_after_insert, 2),
+            queue.submit(_insert, 3),
+            return_exceptions=True,
+        )
+        return results, len(commits)
+
+    (results, commits), rows = _run(event_loop, tmp_path, scenario)
+    assert results[0] == 1 and results[2] == 3
+    assert isinstance(results[1], ValueError) and str(results[1]) == "ish 2 xatosi"
+    assert rows == [1, 3]
+    assert commits == 1
+
+
+def test_submit_before_start_raises(event_loop, tmp_path):
+    queue = WriteQueue(ConnectionManager(str(tmp_path / "queue.db")))
+    with pytest.raises(RuntimeError):
+        event_loop.run_until_complete(queue.submit(_insert, 1))
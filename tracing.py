@@ -0,0 +1,320 @@
+import functools
+import inspect
+import json
+import logging
+import re
+import time
+import uuid
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+
+# -----------------------------------------------------------------------------
+# UPDATE TRACING (ixtiyoriy, TRACE_UPDATES=1)
+# -----------------------------------------------------------------------------
+# Har bir update (yoki vaqtli vazifa) uchun Trace obyekti ContextVar ga
+# qo'yiladi. Shu kontekstda:
+#   - qaysi db_* funksiyalari necha marta chaqirilgani,
+#   - nechta ulanish olingani (pool.reader()/writer()),
+#   - har bir SQL so'rov, parametrlar shakli va vaqti (fetch lar bilan)
+# yozib boriladi. Oxirida "trace" loggeriga bitta JSON qator chiqadi. Sekin
+# so'rovlar uchun EXPLAIN QUERY PLAN ham qo'shiladi, bir xil so'rov ko'p
+# marta takrorlansa (N+1) "repeat" ro'yxatiga tushadi.
+#
+# O'chiq bo'lganda hech narsa o'ralmaydi - qo'shimcha xarajat yo'q.
+
+current_trace = ContextVar("current_trace", default=None)
+log = logging.getLogger("trace")
+
+MAX_STATEMENTS = 1000  # Bitta trace da saqlanadigan so'rovlar (ortig'i faqat sanaladi)
+REPEAT_MIN = 3         # Shuncha va undan ko'p takrorlangan so'rov "repeat" ga chiqadi
+PLAN_CACHE = 500       # EXPLAIN natijalari shu sondagi turli so'rovlar uchun eslab qolinadi
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def _short(sql, limit=160):
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return sql if len(sql) <= limit else sql[:limit - 3] + "..."
+
+
+def _shape(params, many):
+    # Qiymatlar logga yozilmaydi, faqat soni: "3" yoki executemany uchun "50x3"
+    if many:
+        rows = len(params)
+        return f"{rows}x{len(params[0]) if rows else 0}"
+    return str(len(params)) if params else "0"
+
+
+class Trace:
+    def __init__(self, kind, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.name = name
+        self.handler = None
+        self.started = time.perf_counter()
+        self.calls = {}
+        self.checkouts = 0
+        self.statements = []  # [sql, shape, params, seconds]
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.closed = False
+
+    def record(self, sql, params, many, seconds):
+        if self.closed:
+            return None
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        if len(self.statements) >= MAX_STATEMENTS:
+            return None
+        stmt = [sql, _shape(params, many), params[0] if many and params else params, seconds]
+        self.statements.append(stmt)
+        return stmt
+
+    def add_time(self, stmt, seconds):
+        if self.closed:
+            return
+        self.sql_seconds += seconds
+        if stmt is not None:
+            stmt[3] += seconds
+
+
+# -----------------------------------------------------------------------------
+# ULANISH PROKSISI
+# -----------------------------------------------------------------------------
+# pool.wrap sifatida o'rnatiladi. Joriy trace har bir so'rovda ContextVar dan
+# olinadi, shuning uchun umumiy yozuvchi ulanishdagi (WriteQueue) so'rovlar
+# ham ishni yuborgan update ga yoziladi.
+
+class _TracedCursor:
+    def __init__(self, cursor, stmt, trace):
+        self._cursor = cursor
+        self._stmt = stmt
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def _timed(self, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self._trace.add_time(self._stmt, time.perf_counter() - started)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone())
+
+    async def fetchmany(self, size=None):
+        return await self._timed(self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany())
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall())
+
+    async def close(self):
+        await self._cursor.close()
+
+
+class _TracedCall:
+    # aiosqlite kabi: ham `await db.execute(...)`, ham `async with db.execute(...)`
+    def __init__(self, call, sql, params, many):
+        self._call = call
+        self._sql = sql
+        self._params = params
+        self._many = many
+        self._cursor = None
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def _run(self):
+        trace = current_trace.get()
+        if trace is None:
+            return await self._call
+        started = time.perf_counter()
+        try:
+            cursor = await self._call
+        finally:
+            stmt = trace.record(self._sql, self._params, self._many, time.perf_counter() - started)
+        return _TracedCursor(cursor, stmt, trace)
+
+    async def __aenter__(self):
+        self._cursor = await self
+        return self._cursor
+
+    async def __aexit__(self, *exc):
+        await self._cursor.close()
+
+
+class _TracedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, parameters=None):
+        call = self._conn.execute(sql, parameters) if parameters is not None else self._conn.execute(sql)
+        return _TracedCall(call, sql, parameters or (), False)
+
+    def executemany(self, sql, parameters):
+        parameters = list(parameters)
+        return _TracedCall(self._conn.executemany(sql, parameters), sql, parameters, True)
+
+
+def count_checkout():
+    trace = current_trace.get()
+    if trace is not None and not trace.closed:
+        trace.checkouts += 1
+
+
+def wrap_connection(conn):
+    count_checkout()
+    return _TracedConnection(conn)
+
+
+# -----------------------------------------------------------------------------
+# TRACER
+# -----------------------------------------------------------------------------
+
+def trace_functions(namespace, prefix):
+    # Modul darajasidagi `prefix*` korutina va async generator funksiyalari chaqiruvlarini sanaydi
+    for name, fn in list(namespace.items()):
+        if name.startswith(prefix) and (inspect.iscoroutinefunction(fn) or inspect.isasyncgenfunction(fn)):
+            namespace[name] = _counted(fn, name)
+
+
+def _count_call(name):
+    trace = current_trace.get()
+    if trace is not None and not trace.closed:
+        trace.calls[name] = trace.calls.get(name, 0) + 1
+
+
+def _counted(fn, name):
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def gen_wrapper(*args, **kwargs):
+            _count_call(name)
+            agen = fn(*args, **kwargs)
+            try:
+                async for item in agen:
+                    yield item
+            finally:
+                await agen.aclose()
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        _count_call(name)
+        return await fn(*args, **kwargs)
+    return wrapper
+
+
+class Tracer:
+    def __init__(self, pool, slow_ms=50):
+        self.pool = pool
+        self.slow = slow_ms / 1000
+        self._plans = {}  # sql -> EXPLAIN QUERY PLAN (har bir so'rov bir marta)
+
+    def install(self, *queues):
+        # queues - trace ni ishlarga o'tkazadigan WriteQueue lar. Navbatdagi
+        # ish umumiy yozuvchida bajariladi - har bir ish bitta ulanish sifatida sanaladi
+        self.pool.wrap = wrap_connection
+        for queue in queues:
+            queue.propagate = tuple(queue.propagate) + (current_trace,)
+            queue.on_job = count_checkout
+
+    async def run(self, kind, name, fn, *args):
+        trace = Trace(kind, name)
+        token = current_trace.set(trace)
+        error = None
+        try:
+            return await fn(*args)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            current_trace.reset(token)
+            await self._finish(trace, error)
+
+    def wrap_job(self, name, fn):
+        # Vaqtli vazifa (scheduler) uchun: har bir ishga tushish alohida trace
+        @functools.wraps(fn)
+        async def wrapper(*args):
+            return await self.run("job", name, fn, *args)
+        return wrapper
+
+    async def _explain(self, sql, params):
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        plan = self._plans.get(sql)
+        if plan is not None:
+            return plan
+        try:
+            async with self.pool.reader() as db:
+                async with db.execute("EXPLAIN QUERY PLAN " + sql, params) as cur:
+                    plan = [row[3] for row in await cur.fetchall()]
+        except Exception as e:
+            return [f"explain xatosi: {e}"]
+        if len(self._plans) >= PLAN_CACHE:
+            self._plans.clear()
+        self._plans[sql] = plan
+        return plan
+
+    async def _finish(self, trace, error):
+        trace.closed = True
+        elapsed = time.perf_counter() - trace.started
+        groups = {}
+        for sql, shape, params, seconds in trace.statements:
+            group = groups.setdefault(sql, [0, 0.0])
+            group[0] += 1
+            group[1] += seconds
+        line = {
+            "trace": trace.id,
+            "kind": trace.kind,
+            "name": trace.handler or trace.name,  # handler topilmasa update turi
+            "ms": round(elapsed * 1000, 1),
+            "conns": trace.checkouts,
+            "calls": trace.calls,
+            "sql": trace.sql_count,
+            "sql_ms": round(trace.sql_seconds * 1000, 1),
+        }
+        if error:
+            line["error"] = error
+        repeat = [{"sql": _short(sql), "n": n, "ms": round(s * 1000, 1)}
+                  for sql, (n, s) in groups.items() if n >= REPEAT_MIN]
+        if repeat:
+            line["repeat"] = repeat
+        # Sekin so'rovlar SQL matni bo'yicha bitta yozuvga: soni va eng sekini
+        slowest = {}
+        for stmt in trace.statements:
+            if stmt[3] >= self.slow:
+                entry = slowest.setdefault(stmt[0], [0, stmt])
+                entry[0] += 1
+                if stmt[3] > entry[1][3]:
+                    entry[1] = stmt
+        slow = []
+        for sql, (n, (_, shape, params, seconds)) in slowest.items():
+            slow.append({"sql": _short(sql), "params": shape, "n": n, "ms": round(seconds * 1000, 1),
+                         "plan": await self._explain(sql, params)})
+        if slow:
+            line["slow"] = slow
+        log.info(json.dumps(line, ensure_ascii=False, separators=(",", ":"), default=str))
+
+
+class TracingMiddleware(BaseMiddleware):
+    # dp.update.outer_middleware - har bir update o'z trace i ichida
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        return await self.tracer.run("update", event.event_type, handler, event, data)
+
+
+class TraceHandlerMiddleware(BaseMiddleware):
+    # Router observer lariga inner middleware: trace ga handler nomini yozadi
+    async def __call__(self, handler, event, data):
+        trace = current_trace.get()
+        if trace is not None:
+            handler_obj = data.get("handler")
+            trace.handler = getattr(getattr(handler_obj, "callback", None), "__name__", None)
+        return await handler(event, data)
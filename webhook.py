@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import CONTENT_TYPE
+
+# -----------------------------------------------------------------------------
+# HTTP SERVER (HEALTH + WEBHOOK)
+# -----------------------------------------------------------------------------
+# Bot bilan bitta event loop da ishlaydigan aiohttp server. "/" - uptime
+# monitorlar uchun health javobi, /metrics - Prometheus metrikalari (har ikki
+# rejimda ham). Webhook rejimida Telegram yangilanishlari `path` ga POST
+# qilinadi; X-Telegram-Bot-Api-Secret-Token sarlavhasi `secret` bilan mos
+# kelmasa so'rov 401 bilan rad etiladi.
+# Javob darhol qaytariladi, yangilanish esa fonda qayta ishlanadi.
+
+HEALTH_TEXT = "Bot is alive and running!"
+
+
+async def health(request):
+    return web.Response(text=HEALTH_TEXT)
+
+
+def make_app(dp=None, bot=None, path="/webhook", secret=None, metrics=None, **workflow_data):
+    # dp berilmasa - faqat health route (polling rejimi)
+    app = web.Application()
+    app.router.add_get("/", health)
+    if metrics is not None:
+        async def metrics_view(request):
+            return web.Response(body=(await metrics.render()).encode(), headers={"Content-Type": CONTENT_TYPE})
+        app.router.add_get("/metrics", metrics_view)
+    if dp is not None:
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+        # dp.startup / dp.shutdown (FSM omborini yopish va h.k.) server bilan birga
+        setup_application(app, dp, bot=bot, **workflow_data)
+    return app
+
+
+async def start_server(app, port, host="0.0.0.0"):
+    # Qaytaradi: AppRunner - to'xtatish uchun `await runner.cleanup()`
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"HTTP server {host}:{port} da ishga tushdi")
+    return runner
+
+
+async def wait_for_signal():
+    # SIGINT/SIGTERM kelguncha kutadi (Windows da faqat Ctrl+C - KeyboardInterrupt)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop.wait()